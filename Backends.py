@@ -0,0 +1,121 @@
+# CPU inference backends that run the QTracker networks without TensorFlow
+# convert_networks.py turns every SavedModel in Networks/ into Networks_onnx/<name>.onnx or
+# Networks_tflite/<name>.tflite and writes a manifest.json next to them. The manifest records the
+# content hash of the SavedModel each file was made from and whether its outputs matched TensorFlow,
+# so a stale or failed conversion is never loaded. The models here have the same predict() call as
+# the Keras models, and the event filter's softmax is applied in NumPy.
+
+import os
+import json
+import numpy as np
+
+try:
+    import onnxruntime
+except ImportError:  # optional, only for the onnx backend
+    onnxruntime = None
+
+try:
+    from tflite_runtime.interpreter import Interpreter as TFLiteInterpreter
+except ImportError:  # optional, only for the tflite backend
+    TFLiteInterpreter = None
+
+BACKENDS = ('tensorflow', 'onnx', 'tflite')
+EXTENSIONS = {'onnx': '.onnx', 'tflite': '.tflite'}
+MANIFEST = 'manifest.json'
+
+
+def converted_dir(networks_dir, backend):
+    # Directory of a backend's converted networks, next to the SavedModels
+    return os.path.normpath(networks_dir) + '_' + backend
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as manifest:
+        return json.load(manifest)
+
+
+def write_manifest(directory, manifest):
+    temporary = os.path.join(directory, MANIFEST + '.tmp')
+    with open(temporary, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(temporary, os.path.join(directory, MANIFEST))
+
+
+def softmax(logits):
+    shifted = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return shifted / shifted.sum(axis=1, keepdims=True)
+
+
+class OnnxModel:
+    def __init__(self, path, softmax=False, threads=None):
+        if onnxruntime is None:
+            raise ImportError("The onnx backend needs onnxruntime (pip install onnxruntime)")
+        options = onnxruntime.SessionOptions()
+        if threads is not None:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.input_shape = (None,) + tuple(self.session.get_inputs()[0].shape[1:])
+        self.softmax = softmax
+
+    def predict(self, inputs, batch_size=8192, verbose=0):
+        inputs = np.asarray(inputs, dtype=np.float32)
+        batch_size = batch_size or 8192
+        outputs = [self.session.run(None, {self.input_name: inputs[start:start + batch_size]})[0]
+                   for start in range(0, len(inputs), batch_size)]
+        if not outputs:
+            return np.zeros((0,) + tuple(self.session.get_outputs()[0].shape[1:]), dtype=np.float32)
+        outputs = np.concatenate(outputs)
+        return softmax(outputs) if self.softmax else outputs
+
+
+class TFLiteModel:
+    def __init__(self, path, softmax=False, threads=None):
+        if TFLiteInterpreter is None:
+            raise ImportError("The tflite backend needs tflite-runtime (pip install tflite-runtime)")
+        self.interpreter = TFLiteInterpreter(model_path=path, num_threads=threads)
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.input_shape = (None,) + tuple(self.input['shape'][1:])
+        self.batch = None  # batch size the interpreter's tensors are allocated for
+        self.softmax = softmax
+
+    def run(self, batch):
+        if len(batch) != self.batch:
+            self.interpreter.resize_tensor_input(self.input['index'], (len(batch),) + tuple(self.input_shape[1:]))
+            self.interpreter.allocate_tensors()
+            self.batch = len(batch)
+        self.interpreter.set_tensor(self.input['index'], batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output['index']).copy()
+
+    def predict(self, inputs, batch_size=8192, verbose=0):
+        # Full batches keep the interpreter's allocation, only the last one resizes it
+        inputs = np.asarray(inputs, dtype=np.float32)
+        batch_size = batch_size or 8192
+        outputs = [self.run(inputs[start:start + batch_size]) for start in range(0, len(inputs), batch_size)]
+        if not outputs:
+            return np.zeros((0,) + tuple(self.output['shape'][1:]), dtype=np.float32)
+        outputs = np.concatenate(outputs)
+        return softmax(outputs) if self.softmax else outputs
+
+
+def load(backend, networks_dir, name, fingerprint, softmax=False, threads=None):
+    # Load a converted network. fingerprint is the content hash of its SavedModel now; the
+    # conversion must have been made from exactly that SavedModel and have passed the check.
+    directory = converted_dir(networks_dir, backend)
+    entry = read_manifest(directory).get(name)
+    if entry is None:
+        raise FileNotFoundError(f"{name} has no {backend} conversion in {directory}, run convert_networks.py --backend {backend}")
+    if entry['fingerprint'] != fingerprint:
+        raise RuntimeError(f"The {backend} conversion of {name} is older than its SavedModel, run convert_networks.py --backend {backend}")
+    if not entry['check']['passed']:
+        raise RuntimeError(f"The {backend} conversion of {name} did not match TensorFlow "
+                           f"(max abs diff {entry['check']['max_abs_diff']:.3g}), see convert_networks.py")
+    path = os.path.join(directory, name + EXTENSIONS[backend])
+    model_class = OnnxModel if backend == 'onnx' else TFLiteModel
+    return model_class(path, softmax, threads)
@@ -0,0 +1,218 @@
+# Columnar output format of QTracker
+# Every reconstructed file is a directory with one .npy file per named column plus a manifest.json
+# describing the schema. Columns are opened with np.load(mmap_mode='r'), so a reader only pages in
+# the columns it actually uses. ColumnarWriter builds the same layout chunk by chunk.
+
+import os
+import json
+import struct
+import shutil
+import numpy as np
+
+# Layout of the positional output_data array built by QTracker.reconstruct: (column name, width)
+OUTPUT_SCHEMA = [
+    ('event_filter_prob', 6),  # softmax output of the event filter, [:, 3] is the dimuon class
+    ('all_mom', 6),  # px, py, pz of mu+ then mu-, track finder trained on all vertices
+    ('all_vtx', 3),  # x, y, z vertex
+    ('z_mom', 6),  # same for the z-vertex track finder
+    ('z_vtx', 3),
+    ('target_mom', 6),  # target track finder, no vertexing
+    ('target_dump_prob', 2),  # [:, 0] dump, [:, 1] target
+    ('run_id', 1),
+    ('event_id', 1),
+    ('spill_id', 1),
+    ('trigger_bits', 1),
+    ('target_pos', 1),
+    ('turn_id', 1),
+    ('rf_id', 1),
+    ('intensity', 33),
+    ('n_roads', 4),
+    ('n_hits', 55),
+]
+# Identifier columns are stored as integers
+INTEGER_COLUMNS = {'run_id', 'event_id', 'spill_id', 'trigger_bits', 'target_pos', 'turn_id', 'rf_id', 'n_roads', 'n_hits'}
+
+MANIFEST = 'manifest.json'
+# Append-only log of finished outputs in the output directory, one JSON object per line
+OUTPUT_LOG = 'outputs.jsonl'
+FORMAT_VERSION = 4
+# Bytes reserved for the .npy header of a column written by ColumnarWriter, enough for any shape
+HEADER_BYTES = 128
+
+
+def split_output(output_data):
+    # Named columns from the positional output_data array
+    columns = {}
+    start = 0
+    for name, width in OUTPUT_SCHEMA:
+        column = output_data[:, start:start + width]
+        if width == 1:
+            column = column[:, 0]
+        if name in INTEGER_COLUMNS:
+            column = np.rint(column).astype(np.int64)
+        columns[name] = np.ascontiguousarray(column)
+        start += width
+    return columns
+
+
+def write(directory, columns, **attributes):
+    # Write every column and the manifest into a temporary directory, then swap it in,
+    # so readers never see a half written output.
+    temporary = directory + '.tmp'
+    shutil.rmtree(temporary, ignore_errors=True)
+    os.makedirs(temporary)
+    manifest = {'version': FORMAT_VERSION, 'columns': {}, **attributes}
+    for name, array in columns.items():
+        array = np.asarray(array)
+        np.save(os.path.join(temporary, name + '.npy'), array)
+        manifest['columns'][name] = {'file': name + '.npy', 'dtype': array.dtype.str, 'shape': list(array.shape)}
+    with open(os.path.join(temporary, MANIFEST), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    return swap_in(temporary, directory)
+
+
+def swap_in(temporary, directory):
+    # Replace directory by the finished temporary one. The old output is renamed aside first and
+    # only deleted once the new one is in place, so there is always a complete output at directory
+    # except for the instant between the two renames.
+    old = directory + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, old)
+    os.replace(temporary, directory)
+    shutil.rmtree(old, ignore_errors=True)
+    return directory
+
+
+def npy_header(dtype, shape):
+    # A version 1.0 .npy header padded to HEADER_BYTES, so it can be rewritten once the shape is known
+    header = repr({'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': tuple(shape)})
+    header = header.ljust(HEADER_BYTES - 11) + '\n'
+    if len(header) != HEADER_BYTES - 10:
+        raise ValueError(f"The .npy header of shape {shape} does not fit in {HEADER_BYTES} bytes")
+    return np.lib.format.MAGIC_PREFIX + bytes([1, 0]) + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class ColumnarWriter:
+    # Writes an output directory chunk by chunk: append() adds the rows of one chunk to the end of a
+    # column's .npy file, so nothing but the current chunk is held in memory. Like write(), everything
+    # goes to a temporary directory that close() swaps in, with the manifest written last.
+    def __init__(self, directory):
+        self.directory = directory
+        self.temporary = directory + '.tmp'
+        shutil.rmtree(self.temporary, ignore_errors=True)
+        os.makedirs(self.temporary)
+        self.files = {}  # column name -> open file
+        self.layout = {}  # column name -> [dtype, rows so far, shape of one row]
+
+    def path(self, name):
+        return os.path.join(self.temporary, name + '.npy')
+
+    def append(self, name, array):
+        array = np.asarray(array)
+        if name not in self.files:
+            self.files[name] = open(self.path(name), 'wb')
+            self.files[name].write(npy_header(array.dtype, (0,) + array.shape[1:]))
+            self.layout[name] = [array.dtype, 0, array.shape[1:]]
+        dtype, rows, row_shape = self.layout[name]
+        if array.shape[1:] != row_shape:
+            raise ValueError(f"Column {name} has rows of shape {row_shape}, not {array.shape[1:]}")
+        self.files[name].write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        self.layout[name][1] = rows + len(array)
+
+    def rows(self, name):
+        return self.layout[name][1] if name in self.layout else 0
+
+    def finish(self, name):
+        # Complete the header of a column; returns it memory-mapped. Nothing can be appended after.
+        if name in self.files:
+            column_file = self.files.pop(name)
+            dtype, rows, row_shape = self.layout[name]
+            column_file.seek(0)
+            column_file.write(npy_header(dtype, (rows,) + row_shape))
+            column_file.close()
+        return np.load(self.path(name), mmap_mode='r')
+
+    def close(self, columns=None, **attributes):
+        # Add whole columns that need the complete file, e.g. summaries of other columns, then the
+        # manifest, and swap the output in
+        for name in list(self.files):
+            self.finish(name)
+        manifest = {'version': FORMAT_VERSION, 'columns': {}, **attributes}
+        for name, (dtype, rows, row_shape) in self.layout.items():
+            manifest['columns'][name] = {'file': name + '.npy', 'dtype': dtype.str, 'shape': [rows, *row_shape]}
+        for name, array in (columns or {}).items():
+            array = np.asarray(array)
+            np.save(self.path(name), array)
+            manifest['columns'][name] = {'file': name + '.npy', 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        with open(os.path.join(self.temporary, MANIFEST), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        return swap_in(self.temporary, self.directory)
+
+    def abort(self):
+        for column_file in self.files.values():
+            column_file.close()
+        self.files = {}
+        shutil.rmtree(self.temporary, ignore_errors=True)
+
+
+def log_output(output_directory, entry):
+    # A single O_APPEND write per line, so the GUI and batch workers can log to the same file
+    line = (json.dumps(entry) + '\n').encode()
+    descriptor = os.open(os.path.join(output_directory, OUTPUT_LOG), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(descriptor, line)
+    finally:
+        os.close(descriptor)
+
+
+class OutputLog:
+    # Reads the output log incrementally; each call to new_entries() only parses what was appended since the last one
+    def __init__(self, output_directory):
+        self.path = os.path.join(output_directory, OUTPUT_LOG)
+        self.cursor = 0
+
+    def new_entries(self):
+        try:
+            if os.path.getsize(self.path) <= self.cursor:
+                return []
+        except FileNotFoundError:
+            return []
+        with open(self.path, 'rb') as log_file:
+            log_file.seek(self.cursor)
+            data = log_file.read()
+        # A line still being written has no newline yet, it is picked up on the next call
+        complete = data[:data.rfind(b'\n') + 1]
+        self.cursor += len(complete)
+        return [json.loads(line) for line in complete.splitlines() if line.strip()]
+
+
+def size(directory):
+    return sum(os.path.getsize(os.path.join(directory, filename)) for filename in os.listdir(directory))
+
+
+class ColumnarReader:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as manifest_file:
+            self.manifest = json.load(manifest_file)
+        self.loaded = {}
+
+    def __getitem__(self, name):
+        # Memory-mapped, read-only view of one column; nothing is read until it is indexed
+        if name not in self.loaded:
+            info = self.manifest['columns'][name]
+            self.loaded[name] = np.load(os.path.join(self.directory, info['file']), mmap_mode='r')
+        return self.loaded[name]
+
+    def __contains__(self, name):
+        return name in self.manifest['columns']
+
+    def __len__(self):
+        return self.manifest['n_events']
+
+    def columns(self):
+        return list(self.manifest['columns'])
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
@@ -8,6 +8,7 @@ import numpy as np
 
 # Modules | Directories
 from QTracker import QTracker
+from EventIndex import EventIndex
 import time
 
 class DataOrganizer:
@@ -18,93 +19,59 @@ class DataOrganizer:
         self.hits = None
         self.target_track = None
         self.metadata = None
-        self.detectorid = None
-        self.elementid = None
+        self.raw_hits = None
+        self.raw_file = None
+        self.index = None
+        self.selectedRows = None
         
         
     
-    def organizeData(self):
-        #finds the raw file
+    def organizeData(self, raw_file=None, progress=None):
+        # raw_file is normally handed out by the ingestion queue; without one the newest raw file is used
+        # progress(stage, fraction) is forwarded to QTracker, the GUI passes a Qt signal here
 
-        # Define the path to the folder
-        folder_path = 'raw'
-
-        # Check if the folder exists
-        if os.path.exists(folder_path):
-            # Get the list of files in the folder
-            raw_files = glob.glob(os.path.join(folder_path, '*'))
-            
-            # Check if the folder contains any files
-            if raw_files:
-                # Sort the list of files by time modified
-                raw_files.sort(key=os.path.getmtime)
-            else:
-                print(f"The folder '{folder_path}' is empty.")
-        else:
-            print(f"The folder '{folder_path}' does not exist.")
-
-        
-
-        # Get the most recent file path
-        if raw_files:
-            most_recent_raw_file = raw_files[0]
-            #print("Most recent file:", most_recent_raw_file)
-        else:
-            most_recent_raw_file = None
-            #print("The directory is empty")
+        # Load every network once per process so the files after the first do not pay for it
+        QTracker.models.load_all()
 
+        most_recent_raw_file = raw_file if raw_file is not None else self.newest_raw_file()
+        self.raw_file = most_recent_raw_file
+        if most_recent_raw_file is None:
+            return
 
         #Do the same for the TSV file here
 
-        #Pull information from QTracker
-        predictions, filt, self.hits, drift,self.metadata, root_file, self.detectorid, self.elementid = QTracker.prediction(most_recent_raw_file)
+        #Pull information from QTracker, streaming the file through the pipeline in fixed-size batches
+        self.reco, self.hits, self.target_track, self.raw_hits = QTracker.stream(most_recent_raw_file, progress=progress)
         
         #Filter hits and tracks write output
+        # self.reco is a ColumnarReader: columns are picked by name and memory-mapped, only what is used is read
         if(len(self.hits) > 0):
-            self.reco, self.hits, self.target_track = QTracker.tracker(predictions, filt, self.hits, drift,self.metadata, root_file)
-
-            self.sid = self.reco[:,34]
-            self.rid = self.reco[:,32]
-            self.EventID = self.reco[:,33]
-            targetTrackProbabilty = self.reco[:,31]
-            dumpTrackProbabilty = self.reco[:,30]
-
-            #self.mom = self.reco[15:21][abs(self.reco[15:21]) < 120]
-        
-            sub_array = self.reco[15:21].T
-            
-            self.mom = np.where(abs(sub_array) < 120, sub_array, 0)
-            #self.mom = np.reshape[]
-            #self.mom = self.mom.reshape(-1,6)
-            # px_mup = self.reco[15][abs(self.reco[15]) < 120]
-            # py_mup = self.reco[16][abs(self.reco[16]) < 120]
-            # pz_mup = self.reco[17][abs(self.reco[17]) < 120]
-
-            # px_mum = self.reco[18][abs(self.reco[18]) < 120]
-            # py_mum = self.reco[19][abs(self.reco[19]) < 120]
-            # pz_mum = self.reco[20][abs(self.reco[20]) < 120]
-
-            # self.px = np.column_stack((px_mup,px_mum))
-            # self.py = np.column_stack((py_mup,py_mum))
-            # self.pz = np.column_stack((pz_mup,pz_mum))
-            
-            
-            
-            
-            
-            # self.px = np.concatenate((self.reco[15][abs(self.reco[15]) < 120],self.reco[18][abs(self.reco[18]) < 120]))
-            # self.py = np.concatenate((self.reco[16][abs(self.reco[16]) < 120],self.reco[19][abs(self.reco[19]) < 120]))
-            # self.pz = np.concatenate((self.reco[17][abs(self.reco[17]) < 120],self.reco[20][abs(self.reco[20]) < 120])) 
-
-            self.vtx = self.reco[:,21][self.reco[:,21]<1e6]
-            self.vty = self.reco[:,22][self.reco[:,22]<1e6]
-            self.vtz = self.reco[:,23][self.reco[:,23]<1e6]
+            self.sid = self.reco['spill_id']
+            self.rid = self.reco['run_id']
+            self.EventID = self.reco['event_id']
+            targetTrackProbabilty = self.reco['target_dump_prob'][:,1]
+            dumpTrackProbabilty = self.reco['target_dump_prob'][:,0]
+
+            # px, py, pz of mu+ and mu- from the z-vertex branch, unphysical values zeroed
+            z_mom = self.reco['z_mom']
+            self.mom = np.where(abs(z_mom) < 120, z_mom, 0)
+            # Dimuon kinematics of these momenta are computed once by QTracker and stored with the output
+            self.mass = self.reco['z_mass']
+
+            z_vtx = self.reco['z_vtx']
+            self.vtx = z_vtx[:,0][z_vtx[:,0]<1e6]
+            self.vty = z_vtx[:,1][z_vtx[:,1]<1e6]
+            self.vtz = z_vtx[:,2][z_vtx[:,2]<1e6]
 
             probabilityTargetDimu = targetTrackProbabilty>=.9
             probabilityDumpDimu = dumpTrackProbabilty<=.001
             targetDimuIndex =   np.where(probabilityTargetDimu & probabilityDumpDimu)
             self.selectedEvents = self.EventID[targetDimuIndex]
 
+            # Event ID -> row and the hit coordinates of every event, so the hit display only slices
+            self.index = EventIndex(self.EventID, self.raw_hits, self.hits, self.target_track)
+            self.selectedRows = self.index.rows_of(self.selectedEvents)
+
             #clean memory?
 
             #return sid, EventID,selectedEvents, px, py, pz, vtx, vty, vtz, self.hits, self.target_track, self.elementid, self.detectorid
@@ -116,13 +83,29 @@ class DataOrganizer:
             print("No events meeting dimuon criteria.")  # If no events pass the filter, notify the user.
         
 
+    def newest_raw_file(self, folder_path='raw'):
+        # Check if the folder exists and contains any files
+        if not os.path.exists(folder_path):
+            print(f"The folder '{folder_path}' does not exist.")
+            return None
+        raw_files = glob.glob(os.path.join(folder_path, '*'))
+        if not raw_files:
+            print(f"The folder '{folder_path}' is empty.")
+            return None
+        # The most recently modified file
+        return max(raw_files, key=os.path.getmtime)
+
     def grab_Vertex(self):
         return self.vtx, self.vty, self.vtz, self.sid, self.EventID
     
     def grab_HitInfo(self):
-        return self.elementid, self.detectorid, self.selectedEvents, self.sid, self.hits, self.EventID, self.target_track
+        return self.raw_hits, self.selectedEvents, self.sid, self.hits, self.EventID, self.target_track
+    def grab_EventIndex(self):
+        return self.index, self.selectedRows
     def grab_mom(self):
         return self.mom
+    def grab_mass(self):
+        return self.mass
     def grab_meta(self):
         return self.sid, self.rid,     
 
@@ -0,0 +1,62 @@
+# Per-file index of the reconstructed events for the hit display
+# Built once when a file is reconstructed: it maps event IDs to rows and holds the plot coordinates
+# (detectorID, elementID) of the raw, declustered and track hits, so drawing an event is a slice lookup.
+
+import numpy as np
+
+# detectorIDs of the 34 track slots of one muon; station 3 is 3+ or 3- depending on the sign of slot 13
+STATION_1 = np.arange(1, 7)
+STATION_2 = np.arange(13, 19)
+STATION_3M = np.arange(19, 25)
+STATION_3P = np.arange(25, 31)
+HODOSCOPES = np.arange(31, 39)
+PROP_TUBES = np.arange(47, 55)
+TRACK_DETECTORS_3P = np.concatenate((STATION_1, STATION_2, STATION_3P, HODOSCOPES, PROP_TUBES))
+TRACK_DETECTORS_3M = np.concatenate((STATION_1, STATION_2, STATION_3M, HODOSCOPES, PROP_TUBES))
+
+
+class EventIndex:
+    def __init__(self, event_ids, raw_hits, hits, target_track):
+        # The first row of an event ID wins, as with np.where(...)[0][0]
+        unique_ids, first_rows = np.unique(np.asarray(event_ids), return_index=True)
+        self.rows = dict(zip(unique_ids.tolist(), first_rows.tolist()))
+
+        # HitStores hold 0-based plane and cell indices, the display uses detectorID and elementID
+        self.raw_offsets = np.asarray(raw_hits.offsets)
+        self.raw_x = np.asarray(raw_hits.detector, dtype=np.float32) + 1
+        self.raw_y = np.asarray(raw_hits.element, dtype=np.float32) + 1
+        self.hit_offsets = np.asarray(hits.offsets)
+        self.hit_x = np.asarray(hits.detector, dtype=np.float32) + 1
+        self.hit_y = np.asarray(hits.element, dtype=np.float32) + 1
+
+        # target_track is (events, 68, 2): slots 0-33 are the mu+ track, 34-67 the mu- track, the
+        # element is signed. Both muons' detectorIDs follow from the sign of their slot 13.
+        elements = np.asarray(target_track)[:, :, 0]
+        self.mup_y = np.abs(elements[:, :34]).astype(np.float32)
+        self.mum_y = np.abs(elements[:, 34:]).astype(np.float32)
+        self.mup_x = np.where(elements[:, 13:14] > 0, TRACK_DETECTORS_3P, TRACK_DETECTORS_3M).astype(np.float32)
+        self.mum_x = np.where(elements[:, 34 + 13:34 + 14] > 0, TRACK_DETECTORS_3P, TRACK_DETECTORS_3M).astype(np.float32)
+
+    def __len__(self):
+        return len(self.hit_offsets) - 1
+
+    def row(self, event_id):
+        # Row of an event ID in the reconstructed file, None if it is not there
+        return self.rows.get(int(event_id))
+
+    def rows_of(self, event_ids):
+        # Rows of several event IDs, skipping IDs that are not in the file
+        rows = [self.rows.get(int(event_id)) for event_id in event_ids]
+        return np.array([row for row in rows if row is not None], dtype=np.int64)
+
+    def raw(self, row):
+        start, stop = self.raw_offsets[row], self.raw_offsets[row + 1]
+        return self.raw_x[start:stop], self.raw_y[start:stop]
+
+    def declustered(self, row):
+        start, stop = self.hit_offsets[row], self.hit_offsets[row + 1]
+        return self.hit_x[start:stop], self.hit_y[start:stop]
+
+    def tracks(self, row):
+        # (x, y) of the mu+ track, then of the mu- track
+        return (self.mup_x[row], self.mup_y[row]), (self.mum_x[row], self.mum_y[row])
@@ -0,0 +1,40 @@
+# Runs the mass fits off the GUI thread
+# Fits are queued and done one after another by a MassFitter, so every fit starts from the previous one.
+# Fits of single files (labelled) are all kept for the drift time series; of the fits of the displayed
+# histogram only the newest waiting one is done, older ones would be redrawn over at once anyway.
+
+import threading
+from collections import deque
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+class FitWorker(QThread):
+    fitted = pyqtSignal(object)  # the result dict of MassFit.fit_mass, with its label
+
+    def __init__(self, fitter, parent=None):
+        super().__init__(parent)
+        self.fitter = fitter
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.busy = False  # run() is taking requests off pending
+
+    def submit(self, edges, counts, label=None):
+        with self.lock:
+            if label is None:
+                self.pending = deque(request for request in self.pending if request[2] is not None)
+            self.pending.append((edges.copy(), counts.copy(), label))
+            if self.busy:
+                return
+            self.busy = True
+        # The previous run() may still be returning, the thread can only be started again once it has
+        self.wait()
+        self.start()
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.busy = False
+                    return
+                edges, counts, label = self.pending.popleft()
+            self.fitted.emit(self.fitter.fit(edges, counts, label))
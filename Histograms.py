@@ -0,0 +1,129 @@
+# Accumulated histograms for the GUI's mass and vertex plots
+# Every quantity has a fixed binning from histograms.json, so the counts of each new file are
+# added in O(new events) and totals from different files, runs and sessions can be merged.
+# Totals are kept per run, over a rolling window of recent files and overall, and persisted.
+
+import os
+import json
+from collections import deque
+import numpy as np
+
+BINNING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'histograms.json')
+
+
+class Binning:
+    def __init__(self, name, bins, low, high, label=''):
+        self.name = name
+        self.bins = int(bins)
+        self.low = float(low)
+        self.high = float(high)
+        self.label = label
+        self.edges = np.linspace(self.low, self.high, self.bins + 1)
+
+    def key(self):
+        return [self.bins, self.low, self.high]
+
+    def count(self, values):
+        # Counts per bin of one batch of values; values outside the range or not finite are dropped
+        values = np.asarray(values, dtype=np.float64)
+        position = (values - self.low) * (self.bins / (self.high - self.low))
+        inside = np.isfinite(position) & (position >= 0) & (position < self.bins)
+        return np.bincount(position[inside].astype(np.int64), minlength=self.bins)
+
+
+def load_binning(path=BINNING_FILE):
+    with open(path) as config:
+        config = json.load(config)
+    binning = {entry['name']: Binning(entry['name'], entry['bins'], entry['min'], entry['max'], entry.get('label', ''))
+               for entry in config['histograms']}
+    return binning, config.get('rolling_files', 20)
+
+
+class HistogramAccumulator:
+    def __init__(self, path='histogram_state.json', binning_path=BINNING_FILE):
+        self.path = path
+        self.binning, rolling_files = load_binning(binning_path)
+        self.total = self.zeros()
+        self.runs = {}  # run ID -> counts per quantity
+        self.window = deque(maxlen=rolling_files)  # (file, counts per quantity) of the most recent files
+        self.rolling = self.zeros()  # sum over window, kept up to date as files come and go
+        self.files = set()
+        if os.path.exists(path):
+            self.load()
+
+    def zeros(self):
+        return {name: np.zeros(binning.bins, dtype=np.int64) for name, binning in self.binning.items()}
+
+    def add_file(self, raw_file, run_ids, values):
+        # values: quantity name -> per-event values, run_ids: run ID per event (all arrays of one length
+        # per quantity). A file is only counted once, e.g. when a cached reconstruction is loaded again.
+        name = os.path.basename(raw_file)
+        if name in self.files:
+            return False
+        self.files.add(name)
+        run_ids = np.asarray(run_ids)
+        file_counts = self.zeros()
+        for run_id in np.unique(run_ids):
+            in_run = run_ids == run_id
+            run_counts = self.runs.setdefault(int(run_id), self.zeros())
+            for quantity, quantity_values in values.items():
+                counts = self.binning[quantity].count(np.asarray(quantity_values)[in_run])
+                run_counts[quantity] += counts
+                file_counts[quantity] += counts
+        for quantity, counts in file_counts.items():
+            self.total[quantity] += counts
+        if len(self.window) == self.window.maxlen:
+            for quantity, counts in self.window[0][1].items():
+                self.rolling[quantity] -= counts
+        self.window.append((name, file_counts))
+        for quantity, counts in file_counts.items():
+            self.rolling[quantity] += counts
+        self.save()
+        return True
+
+    def counts(self, quantity, view='total', run_id=None):
+        # view is 'total', 'rolling' or 'run'
+        if view == 'run':
+            run = self.runs.get(run_id)
+            return run[quantity] if run is not None else np.zeros(self.binning[quantity].bins, dtype=np.int64)
+        if view == 'rolling':
+            return self.rolling[quantity]
+        return self.total[quantity]
+
+    def save(self):
+        state = {
+            'binning': {name: binning.key() for name, binning in self.binning.items()},
+            'total': {name: counts.tolist() for name, counts in self.total.items()},
+            'runs': {str(run_id): {name: counts.tolist() for name, counts in run.items()} for run_id, run in self.runs.items()},
+            'window': [[name, {quantity: counts.tolist() for quantity, counts in file_counts.items()}]
+                       for name, file_counts in self.window],
+            'files': sorted(self.files),
+        }
+        # Write to a temporary file first so a crash never leaves truncated totals
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as state_file:
+            json.dump(state, state_file)
+        os.replace(temporary, self.path)
+
+    def load(self):
+        with open(self.path) as state_file:
+            state = json.load(state_file)
+        # Only quantities whose binning is unchanged are restored, the others start over
+        same = [name for name, binning in self.binning.items() if state['binning'].get(name) == binning.key()]
+
+        def restore(saved):
+            counts = self.zeros()
+            for name in same:
+                if name in saved:
+                    counts[name] = np.array(saved[name], dtype=np.int64)
+            return counts
+
+        self.total = restore(state['total'])
+        self.runs = {int(run_id): restore(run) for run_id, run in state['runs'].items()}
+        for name, file_counts in state['window'][-self.window.maxlen:]:
+            self.window.append((name, restore(file_counts)))
+        self.rolling = self.zeros()
+        for name, file_counts in self.window:
+            for quantity, counts in file_counts.items():
+                self.rolling[quantity] += counts
+        self.files = set(state['files'])
@@ -0,0 +1,102 @@
+# Compact (CSR-style) storage for the hit matrices produced by QTracker
+# Instead of one mostly empty (54, 201) cube per event, the hits of event n live in
+# detector[offsets[n]:offsets[n+1]], element[...], drift[...] and tdc[...],
+# sorted by detector plane and then by element.
+
+import numpy as np
+
+
+class HitStore:
+    n_detectors = 54
+    n_elements = 201
+
+    def __init__(self, offsets, detector, element, drift, tdc):
+        self.offsets = offsets  # int64, length n_events + 1
+        self.detector = detector  # int16, 0-based plane index (detectorID - 1)
+        self.element = element  # int16, 0-based cell index in the hit matrix
+        self.drift = drift  # float32 drift distance
+        self.tdc = tdc  # int32 TDC time
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.offsets, self.detector, self.element, self.drift, self.tdc))
+
+    def counts(self):
+        return np.diff(self.offsets)
+
+    @staticmethod
+    def cell_counts(detector, element):
+        # Hits per (plane, cell) over any number of events, one bincount; out of range indices are skipped
+        detector = np.asarray(detector, dtype=np.int64)
+        element = np.asarray(element, dtype=np.int64)
+        valid = (detector >= 0) & (detector < HitStore.n_detectors) & (element >= 0) & (element < HitStore.n_elements)
+        cells = detector[valid] * HitStore.n_elements + element[valid]
+        return np.bincount(cells, minlength=HitStore.n_detectors * HitStore.n_elements).reshape(HitStore.n_detectors, HitStore.n_elements)
+
+    def plane_offsets(self):
+        # Offsets of the (event, plane) segments: the hits of one plane in one event are
+        # detector[segments[s]:segments[s+1]]. Empty planes have no segment.
+        n = len(self.detector)
+        start = np.zeros(n, dtype=bool)
+        if n > 0:
+            start[1:] = self.detector[1:] != self.detector[:-1]
+            start[self.offsets[:-1][self.counts() > 0]] = True
+        return np.append(np.flatnonzero(start), n)
+
+    def occupancy(self):
+        # (54, 201) hit counts summed over all events of the store
+        return HitStore.cell_counts(self.detector, self.element)
+
+    @staticmethod
+    def empty():
+        return HitStore(np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int16),
+                        np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int32))
+
+    @staticmethod
+    def concatenate(stores):
+        stores = [s for s in stores if len(s) > 0]
+        if not stores:
+            return HitStore.empty()
+        counts = np.concatenate([s.counts() for s in stores])
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return HitStore(offsets, np.concatenate([s.detector for s in stores]), np.concatenate([s.element for s in stores]),
+                        np.concatenate([s.drift for s in stores]), np.concatenate([s.tdc for s in stores]))
+
+    def select(self, events):
+        # Keep a subset of events, given as a boolean mask or an index array
+        counts = self.counts()
+        if events.dtype == bool:
+            events = np.nonzero(events)[0]
+        keep = np.zeros(len(self), dtype=bool)
+        keep[events] = True
+        hit_mask = np.repeat(keep, counts)
+        offsets = np.zeros(len(events) + 1, dtype=np.int64)
+        np.cumsum(counts[events], out=offsets[1:])
+        return HitStore(offsets, self.detector[hit_mask], self.element[hit_mask], self.drift[hit_mask], self.tdc[hit_mask])
+
+    def compress(self, keep):
+        # Drop individual hits flagged False in keep, e.g. after declustering
+        kept = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(keep, out=kept[1:])
+        return HitStore(kept[self.offsets], self.detector[keep], self.element[keep], self.drift[keep], self.tdc[keep])
+
+    def to_dense(self):
+        # Dense hit cubes for the networks; only ever built for one batch at a time
+        hits_out = np.zeros((len(self), self.n_detectors, self.n_elements), dtype=bool)
+        events = np.repeat(np.arange(len(self)), self.counts())
+        hits_out[events, self.detector, self.element] = True
+        return hits_out
+
+    def arrays(self, prefix='hit_'):
+        # Named arrays for np.savez
+        return {prefix + 'offsets': self.offsets, prefix + 'detector': self.detector, prefix + 'element': self.element,
+                prefix + 'drift': self.drift, prefix + 'tdc': self.tdc}
+
+    @staticmethod
+    def from_arrays(arrays, prefix='hit_'):
+        return HitStore(arrays[prefix + 'offsets'], arrays[prefix + 'detector'], arrays[prefix + 'element'],
+                        arrays[prefix + 'drift'], arrays[prefix + 'tdc'])
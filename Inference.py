@@ -0,0 +1,144 @@
+# Inference layer for the QTracker networks
+# CompiledModel runs a Keras model as a tf.function, with XLA if that turns out faster. Inputs are
+# padded to a few fixed batch sizes, so each model is traced once per size and never again, and
+# the batch size is picked from the throughput measured per size, capped by the free memory.
+# configure_threads fixes TensorFlow's thread pools next to numba's.
+
+import os
+import time
+import numpy as np
+import tensorflow as tf  # For using machine learning models.
+
+# Batch sizes inputs are padded to; each is traced (and compiled) once per model
+BUCKETS = (64, 256, 1024, 4096)
+
+
+def configure_threads(intra_op=None, inter_op=1):
+    # Must run before TensorFlow creates its pools, i.e. before the first model is loaded.
+    # None keeps TensorFlow's default of one thread per core.
+    if intra_op is not None:
+        os.environ['TF_NUM_INTRAOP_THREADS'] = str(intra_op)
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    if inter_op is not None:
+        os.environ['TF_NUM_INTEROP_THREADS'] = str(inter_op)
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+
+
+def available_memory():
+    # Bytes of physical memory not in use, None where the platform does not tell
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def bytes_per_event(model):
+    # Input plus every layer's output for one event in float32, an upper bound of what a batch holds
+    shapes = [model.input_shape]
+    for layer in model.layers:
+        try:
+            shapes.append(layer.output_shape)
+        except (AttributeError, RuntimeError):
+            continue
+    size = 0
+    for shape in shapes:
+        for single in (shape if isinstance(shape, list) else [shape]):
+            size += int(np.prod([dimension or 1 for dimension in single[1:]]))
+    return 4 * size
+
+
+class CompiledModel:
+    def __init__(self, model, name='', buckets=BUCKETS, xla='auto', memory_fraction=0.25):
+        # xla is True, False or 'auto' to keep whichever is faster after warm_up()
+        self.model = model
+        self.name = name
+        shape = model.input_shape
+        self.input_shape = shape[0] if isinstance(shape, list) else shape
+        self.buckets = tuple(sorted(buckets))
+        self.xla = xla
+        self.memory_fraction = memory_fraction
+        self.event_bytes = bytes_per_event(model)
+        self.function = None
+        self.throughput = {}  # bucket -> events/s of full batches, running average
+
+    def compile(self, xla):
+        return tf.function(lambda inputs: self.model(inputs, training=False), jit_compile=xla)
+
+    def call(self, function, batch):
+        return function(tf.constant(batch)).numpy()
+
+    def warm_up(self):
+        # Trace every bucket now instead of on the first real file, and settle XLA on or off
+        # by timing both on the middle bucket
+        choices = [self.xla] if self.xla != 'auto' else [True, False]
+        probe = np.zeros((self.buckets[len(self.buckets) // 2],) + tuple(self.input_shape[1:]), dtype=np.float32)
+        best = None
+        for xla in choices:
+            function = self.compile(xla)
+            try:
+                self.call(function, probe)
+            except (tf.errors.InvalidArgumentError, tf.errors.UnimplementedError, tf.errors.InternalError):
+                continue  # XLA cannot compile this model
+            start = time.perf_counter()
+            for _ in range(3):
+                self.call(function, probe)
+            seconds = time.perf_counter() - start
+            if best is None or seconds < best[0]:
+                best = (seconds, xla, function)
+        if best is None:
+            raise RuntimeError(f"Network {self.name} could not be compiled")
+        self.xla, self.function = best[1], best[2]
+        for bucket in self.buckets:
+            self.call(self.function, np.zeros((bucket,) + tuple(self.input_shape[1:]), dtype=np.float32))
+
+    def allowed_buckets(self):
+        # Buckets whose batches fit in a fraction of the free memory, at least the smallest
+        free = available_memory()
+        if free is None:
+            return self.buckets
+        allowed = [bucket for bucket in self.buckets if bucket * self.event_bytes <= self.memory_fraction * free]
+        return tuple(allowed) or self.buckets[:1]
+
+    def batch_size(self, n_events):
+        # An allowed bucket not measured yet if one fits the events, otherwise the fastest measured one
+        allowed = self.allowed_buckets()
+        unmeasured = [bucket for bucket in allowed if bucket not in self.throughput and bucket <= n_events]
+        if unmeasured:
+            return unmeasured[-1]
+        measured = [bucket for bucket in allowed if bucket in self.throughput]
+        if not measured:
+            return allowed[-1]
+        return max(measured, key=self.throughput.get)
+
+    def predict(self, inputs, batch_size=None, verbose=0):
+        # Same call as keras Model.predict; batch_size is ignored, the batch size is chosen here
+        if self.function is None:
+            self.warm_up()
+        inputs = np.asarray(inputs, dtype=np.float32)
+        n_events = len(inputs)
+        # A batch never needs to be larger than the smallest bucket holding every event
+        batch = min(self.batch_size(n_events), next((size for size in self.buckets if size >= n_events), self.buckets[-1]))
+        outputs = []
+        for start in range(0, n_events, batch):
+            chunk = inputs[start:start + batch]
+            bucket = next(size for size in self.buckets if size >= len(chunk))
+            if bucket > len(chunk):
+                chunk = np.concatenate((chunk, np.zeros((bucket - len(chunk),) + chunk.shape[1:], dtype=np.float32)))
+            begin = time.perf_counter()
+            result = self.call(self.function, chunk)
+            seconds = time.perf_counter() - begin
+            if bucket == batch and start + batch <= n_events:
+                # Only full batches say how fast a bucket is
+                rate = bucket / max(seconds, 1e-9)
+                previous = self.throughput.get(bucket)
+                self.throughput[bucket] = rate if previous is None else 0.8 * previous + 0.2 * rate
+            outputs.append(result[:min(batch, n_events - start)])
+        if not outputs:
+            return self.call(self.function, np.zeros((self.buckets[0],) + tuple(self.input_shape[1:]), dtype=np.float32))[:0]
+        return np.concatenate(outputs)
+
+    def report(self):
+        rates = "  ".join(f"{bucket}: {self.throughput[bucket]:.0f}/s" for bucket in self.buckets if bucket in self.throughput)
+        fastest = max(self.throughput, key=self.throughput.get) if self.throughput else '-'
+        return (f"{self.name:<24}xla={'on' if self.xla else 'off':<4}batch={fastest:<6}"
+                f"{self.event_bytes / 1024:8.1f} KB/event  {rates}")
@@ -0,0 +1,94 @@
+# Ingestion of new raw files for the GUI
+# Keeps a persistent ledger of processed files and queues new arrivals in order,
+# so each raw file is reconstructed exactly once, and only after it has finished writing.
+
+import os
+import json
+import glob
+import time
+from collections import deque
+
+
+class IngestionLedger:
+    def __init__(self, path='ingestion_ledger.json'):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as ledger:
+                self.entries = json.load(ledger)
+
+    def __contains__(self, raw_file):
+        return os.path.basename(raw_file) in self.entries
+
+    def mark(self, raw_file, status):
+        # status is "done", "empty" (no dimuon candidates) or "failed"; all of them count as processed
+        info = os.stat(raw_file) if os.path.exists(raw_file) else None
+        self.entries[os.path.basename(raw_file)] = {
+            'status': status,
+            'size': info.st_size if info else None,
+            'mtime': info.st_mtime if info else None,
+            'processed_at': time.time(),
+        }
+        self.save()
+
+    def save(self):
+        # Write to a temporary file first so a crash never leaves a truncated ledger
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as ledger:
+            json.dump(self.entries, ledger, indent=1)
+        os.replace(temporary, self.path)
+
+
+class IngestionQueue:
+    def __init__(self, folder='raw', ledger=None, stable_polls=2, settle_time=30):
+        self.folder = folder
+        self.ledger = ledger if ledger is not None else IngestionLedger()
+        # A file is queued once its size and mtime were unchanged for stable_polls polls in a row,
+        # or right away if it was last modified more than settle_time seconds ago
+        self.stable_polls = stable_polls
+        self.settle_time = settle_time
+        self.candidates = {}  # path -> ((size, mtime), number of polls it was unchanged)
+        self.queue = deque()
+        self.in_progress = None
+
+    def poll(self):
+        # Scan the raw folder and queue files that finished writing, oldest first
+        if not os.path.exists(self.folder):
+            print(f"The folder '{self.folder}' does not exist.")
+            return []
+        ready = []
+        for path in glob.glob(os.path.join(self.folder, '*')):
+            if not os.path.isfile(path) or path in self.ledger or path in self.queue or path == self.in_progress:
+                continue
+            info = os.stat(path)
+            signature = (info.st_size, info.st_mtime)
+            previous, unchanged = self.candidates.get(path, (None, 0))
+            unchanged = unchanged + 1 if signature == previous else 0
+            self.candidates[path] = (signature, unchanged)
+            settled = unchanged >= self.stable_polls - 1 or time.time() - info.st_mtime > self.settle_time
+            if settled and info.st_size > 0:
+                ready.append((info.st_mtime, path))
+
+        for mtime, path in sorted(ready):
+            del self.candidates[path]
+            self.queue.append(path)
+            print(f"New file queued: {path}")
+        # Forget files that disappeared before they were queued
+        for path in [p for p in self.candidates if not os.path.exists(p)]:
+            del self.candidates[path]
+        return [path for mtime, path in sorted(ready)]
+
+    def __len__(self):
+        return len(self.queue)
+
+    def next(self):
+        # Hand out the oldest queued file; it stays in progress until done() is called
+        if self.in_progress is not None or not self.queue:
+            return None
+        self.in_progress = self.queue.popleft()
+        return self.in_progress
+
+    def done(self, status='done'):
+        if self.in_progress is not None:
+            self.ledger.mark(self.in_progress, status)
+            self.in_progress = None
@@ -0,0 +1,245 @@
+# Timing of the reconstruction pipeline stages
+# QTracker wraps each stage in StageTimer.stage(); the batch CLI and the GUI read the totals.
+# Every finished stage can also be appended to a JSON lines log, and SamplingProfiler can be
+# switched on at run time to find hot spots without restarting.
+
+import os
+import sys
+import json
+import time
+import threading
+import collections
+from contextlib import contextmanager
+
+STATM = '/proc/self/statm'
+
+
+def current_rss_mb():
+    # Resident set size of this process now, None where /proc is not available
+    try:
+        with open(STATM) as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+
+
+class MemorySampler:
+    # Samples the resident set size in a background thread while at least one stage is running and
+    # keeps the highest value seen by each of them. Stages on other threads share the process, so
+    # the peak of a stage includes whatever ran next to it.
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.watches = set()  # ids of the running stages
+        self.peaks = {}  # watch id -> highest RSS seen so far
+        self.active = threading.Event()
+        # Never set; waiting on it between samples keeps the sampler out of SamplingProfiler's busy threads
+        self.pause = threading.Event()
+        self.thread = None
+        self.next_id = 0
+
+    def begin(self):
+        # Start watching; returns (watch id, RSS now), or None where the RSS cannot be read
+        rss = current_rss_mb()
+        if rss is None:
+            return None
+        with self.lock:
+            watch = self.next_id
+            self.next_id += 1
+            self.watches.add(watch)
+            self.peaks[watch] = rss
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop, name='memory sampler', daemon=True)
+                self.thread.start()
+            self.active.set()
+        return watch, rss
+
+    def end(self, watch):
+        # Stop watching; returns the peak RSS during the stage
+        rss = current_rss_mb()
+        with self.lock:
+            self.watches.discard(watch)
+            peak = self.peaks.pop(watch)
+            if not self.watches:
+                self.active.clear()
+        return max(peak, rss) if rss is not None else peak
+
+    def loop(self):
+        while True:
+            self.active.wait()
+            rss = current_rss_mb()
+            if rss is not None:
+                with self.lock:
+                    for watch in self.watches:
+                        self.peaks[watch] = max(self.peaks[watch], rss)
+            self.pause.wait(self.interval)
+
+
+class StageTimer:
+    def __init__(self, log_path=None, recent=500):
+        # stage name -> {'calls', 'seconds', 'events', 'events_out', 'peak_rss_mb', 'rss_increase_mb'}
+        # where the memory figures are the largest of any call: the RSS peak during the stage and how
+        # far that peak was above the RSS at its start
+        self.stats = {}
+        # Stages of the tracker graph finish on several threads
+        self.lock = threading.Lock()
+        # The last finished stages, newest last, for the GUI metrics tab
+        self.recent = collections.deque(maxlen=recent)
+        self.finished = 0  # stages recorded so far, lets readers of recent find what is new
+        self.memory = MemorySampler()
+        self.log_file = None
+        if log_path is not None:
+            self.log_to(log_path)
+
+    def log_to(self, path):
+        # Append one JSON object per finished stage to path; None stops logging
+        with self.lock:
+            if self.log_file is not None:
+                self.log_file.close()
+                self.log_file = None
+            if path is not None:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self.log_file = open(path, 'a', buffering=1)
+
+    @contextmanager
+    def stage(self, name, events=0):
+        # The yielded record can be updated inside the block, e.g. when the event count is only known
+        # afterwards. events_out defaults to events, set it for stages that drop events.
+        record = {'events': events, 'events_out': None}
+        watch = self.memory.begin()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            peak_rss = rss_increase = None
+            if watch is not None:
+                peak_rss = self.memory.end(watch[0])
+                rss_increase = peak_rss - watch[1]
+            events_out = record['events'] if record['events_out'] is None else record['events_out']
+            self.add(name, seconds, record['events'], events_out=events_out, peak_rss=peak_rss, rss_increase=rss_increase)
+
+    def add(self, name, seconds, events=0, calls=1, events_out=None, peak_rss=None, rss_increase=None, log=True):
+        events_out = events if events_out is None else events_out
+        with self.lock:
+            entry = self.stats.setdefault(name, {'calls': 0, 'seconds': 0.0, 'events': 0, 'events_out': 0,
+                                                 'peak_rss_mb': None, 'rss_increase_mb': None})
+            entry['calls'] += calls
+            entry['seconds'] += seconds
+            entry['events'] += int(events)
+            entry['events_out'] += int(events_out)
+            if peak_rss is not None:
+                entry['peak_rss_mb'] = max(entry['peak_rss_mb'] or 0.0, peak_rss)
+            if rss_increase is not None:
+                entry['rss_increase_mb'] = max(entry.get('rss_increase_mb') or 0.0, rss_increase)
+            if log:
+                line = {'time': time.time(), 'stage': name, 'seconds': seconds, 'events_in': int(events),
+                        'events_out': int(events_out), 'peak_rss_mb': peak_rss, 'rss_increase_mb': rss_increase,
+                        'thread': threading.current_thread().name}
+                self.recent.append(line)
+                self.finished += 1
+                if self.log_file is not None:
+                    self.log_file.write(json.dumps(line) + '\n')
+
+    def merge(self, stats):
+        # Add the totals of another timer, e.g. one returned by a batch worker process
+        for name, entry in stats.items():
+            self.add(name, entry['seconds'], entry['events'], entry['calls'],
+                     entry.get('events_out'), entry.get('peak_rss_mb'), entry.get('rss_increase_mb'), log=False)
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+            self.recent.clear()
+            self.finished = 0
+
+    def report(self, n_files=None):
+        lines = [f"{'stage':<24}{'calls':>8}{'seconds':>12}{'events':>12}{'out':>12}{'events/s':>12}{'peak MB':>10}{'+MB':>8}{'files/s':>10}"]
+        for name, entry in self.stats.items():
+            seconds = max(entry['seconds'], 1e-9)
+            files_per_second = f"{n_files / seconds:10.2f}" if n_files else f"{'':>10}"
+            peak = f"{entry['peak_rss_mb']:10.0f}" if entry.get('peak_rss_mb') is not None else f"{'':>10}"
+            increase = f"{entry['rss_increase_mb']:8.0f}" if entry.get('rss_increase_mb') is not None else f"{'':>8}"
+            lines.append(f"{name:<24}{entry['calls']:>8}{entry['seconds']:>12.2f}{entry['events']:>12}"
+                         f"{entry['events_out']:>12}{entry['events'] / seconds:>12.1f}{peak}{increase}{files_per_second}")
+        return "\n".join(lines)
+
+
+class SamplingProfiler:
+    # Statistical profiler for a running process: a background thread looks at the stack of every
+    # other thread at a fixed interval and counts where the busy ones are. It costs nothing while stopped,
+    # so the GUI can switch it on and off without a restart. Time inside numba kernels and
+    # TensorFlow is attributed to the Python line that called them.
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.thread = None
+        self.running = threading.Event()
+        self.lock = threading.Lock()
+        self.samples = 0  # stacks of busy threads looked at
+        self.own = collections.Counter()  # innermost frame only
+        self.inclusive = collections.Counter()  # every frame on the stack, counted once per sample
+
+    @staticmethod
+    def location(frame):
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{frame.f_lineno} {code.co_name}"
+
+    # Innermost functions of threads that are blocked, e.g. idle pool workers; these are not hot spots
+    idle = {'wait', '_worker', 'select', 'sleep', 'accept'}
+
+    def sample(self):
+        me = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me or frame.f_code.co_name in self.idle:
+                continue
+            self.samples += 1
+            self.own[self.location(frame)] += 1
+            seen = set()
+            while frame is not None:
+                code = frame.f_code
+                function = f"{os.path.basename(code.co_filename)} {code.co_name}"
+                if function not in seen:
+                    seen.add(function)
+                    self.inclusive[function] += 1
+                frame = frame.f_back
+
+    def loop(self):
+        while self.running.is_set():
+            with self.lock:
+                self.sample()
+            time.sleep(self.interval)
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.running.set()
+        self.thread = threading.Thread(target=self.loop, name='sampling profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.running.clear()
+        self.thread.join()
+        self.thread = None
+
+    def is_running(self):
+        return self.thread is not None
+
+    def reset(self):
+        with self.lock:
+            self.samples = 0
+            self.own.clear()
+            self.inclusive.clear()
+
+    def report(self, n=20):
+        with self.lock:
+            samples = max(self.samples, 1)
+            lines = [f"{self.samples} busy thread samples, every {self.interval * 1000:.0f} ms", "", "Self (innermost line):"]
+            lines += [f"{100 * count / samples:6.1f}%  {where}" for where, count in self.own.most_common(n)]
+            lines += ["", "Inclusive (function on the stack):"]
+            lines += [f"{100 * count / samples:6.1f}%  {where}" for where, count in self.inclusive.most_common(n)]
+        return "\n".join(lines)
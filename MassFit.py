@@ -0,0 +1,193 @@
+# Binned maximum-likelihood fit of the dimuon mass spectrum
+# The model is a J/psi and a psi' Gaussian on an exponential background, integrated over each bin.
+# The psi' mean and width follow the J/psi ones (fixed mass difference, width proportional to mass),
+# so the free parameters are the three yields, the J/psi mean and width and the background slope.
+# The Poisson likelihood and its gradient are analytic; the uncertainties come from the inverse
+# Fisher information at the minimum. MassFitter starts each fit from the previous result.
+
+import os
+import json
+import time
+import numpy as np
+from scipy.optimize import minimize
+from scipy.special import ndtr
+
+JPSI_MASS = 3.0969  # GeV
+PSIPRIME_MASS = 3.6861  # GeV
+PSIPRIME_SHIFT = PSIPRIME_MASS - JPSI_MASS
+PSIPRIME_SCALE = PSIPRIME_MASS / JPSI_MASS
+
+PARAMETERS = ('n_jpsi', 'mean', 'sigma', 'n_psiprime', 'n_background', 'slope')
+BOUNDS = [(0, None), (2.8, 3.4), (0.02, 0.6), (0, None), (0, None), (1e-3, 20.0)]
+
+
+def gaussian_fractions(edges, mean, sigma):
+    # Fraction of a Gaussian in each bin and its derivatives by mean and sigma
+    z = (edges - mean) / sigma
+    density = np.exp(-0.5 * z * z) / np.sqrt(2 * np.pi)
+    fraction = np.diff(ndtr(z))
+    d_mean = -np.diff(density) / sigma
+    d_sigma = -np.diff(z * density) / sigma
+    return fraction, d_mean, d_sigma
+
+
+def exponential_fractions(edges, slope):
+    # Fraction of exp(-slope m), normalised over the fit range, in each bin and its derivative by slope
+    x = edges - edges[0]
+    width = x[-1]
+    tail = np.exp(-slope * x)
+    norm = 1 - tail[-1]
+    fraction = -np.diff(tail) / norm
+    d_tail = -x * tail
+    d_slope = (-np.diff(d_tail) * norm - fraction * norm * width * tail[-1]) / (norm * norm)
+    return fraction, d_slope
+
+
+def expected_counts(theta, edges):
+    # Expected counts per bin and their Jacobian (bins, parameters)
+    n_jpsi, mean, sigma, n_psiprime, n_background, slope = theta
+    jpsi, jpsi_mean, jpsi_sigma = gaussian_fractions(edges, mean, sigma)
+    psiprime, psiprime_mean, psiprime_sigma = gaussian_fractions(edges, mean + PSIPRIME_SHIFT, sigma * PSIPRIME_SCALE)
+    background, background_slope = exponential_fractions(edges, slope)
+
+    mu = n_jpsi * jpsi + n_psiprime * psiprime + n_background * background
+    jacobian = np.empty((len(mu), len(PARAMETERS)))
+    jacobian[:, 0] = jpsi
+    jacobian[:, 1] = n_jpsi * jpsi_mean + n_psiprime * psiprime_mean
+    jacobian[:, 2] = n_jpsi * jpsi_sigma + n_psiprime * psiprime_sigma * PSIPRIME_SCALE
+    jacobian[:, 3] = psiprime
+    jacobian[:, 4] = background
+    jacobian[:, 5] = n_background * background_slope
+    return mu, jacobian
+
+
+def negative_log_likelihood(theta, edges, counts):
+    # Poisson -log L without the constant log(n!) term, and its gradient
+    mu, jacobian = expected_counts(theta, edges)
+    mu = np.maximum(mu, 1e-12)
+    nll = np.sum(mu - counts * np.log(mu))
+    gradient = (1 - counts / mu) @ jacobian
+    return nll, gradient
+
+
+def fit_range(edges, counts, low, high):
+    # Whole bins inside [low, high], so the background normalisation matches the fitted bins
+    centers = (edges[:-1] + edges[1:]) / 2
+    inside = np.flatnonzero((centers > low) & (centers < high))
+    if len(inside) == 0:
+        return edges[:1], counts[:0]
+    return edges[inside[0]:inside[-1] + 2], np.asarray(counts[inside[0]:inside[-1] + 1], dtype=np.float64)
+
+
+def initial_parameters(edges, counts):
+    # A cold start from the histogram alone
+    total = max(counts.sum(), 1.0)
+    return np.array([0.3 * total, JPSI_MASS, 0.15, 0.02 * total, 0.7 * total, 1.0])
+
+
+def fit_mass(edges, counts, start=None, low=2.0, high=5.0, min_events=20):
+    # Fit counts, a histogram with bin edges edges, within [low, high]. start are the parameters to
+    # start from, e.g. those of the previous fit. Returns a dict; never raises when the fit fails.
+    edges, counts = fit_range(np.asarray(edges, dtype=np.float64), np.asarray(counts), low, high)
+    total = counts.sum()
+    result = {'converged': False, 'events': int(total), 'low': float(edges[0]), 'high': float(edges[-1]),
+              'bins': len(counts), 'values': None, 'errors': None, 'nll': None, 'iterations': 0}
+    if total < min_events or len(counts) < len(PARAMETERS):
+        result['message'] = f"{int(total)} events in {len(counts)} bins, too few to fit"
+        return result
+
+    # Yields are fitted in units of the events in range so that every parameter is of order one
+    scale = np.array([total, 1, 1, total, total, 1])
+    bounds = [(low_bound / s if low_bound is not None else None, high_bound / s if high_bound is not None else None)
+              for (low_bound, high_bound), s in zip(BOUNDS, scale)]
+
+    def objective(scaled):
+        nll, gradient = negative_log_likelihood(scaled * scale, edges, counts)
+        return nll, gradient * scale
+
+    starts = [initial_parameters(edges, counts)]
+    if start is not None:
+        starts.insert(0, np.asarray(start, dtype=np.float64))
+    for theta in starts:
+        scaled = np.clip(theta / scale, [b[0] if b[0] is not None else -np.inf for b in bounds],
+                         [b[1] if b[1] is not None else np.inf for b in bounds])
+        minimum = minimize(objective, scaled, jac=True, method='L-BFGS-B', bounds=bounds)
+        result['iterations'] += int(minimum.nit)
+        if minimum.success and np.all(np.isfinite(minimum.x)):
+            break
+    theta = minimum.x * scale
+    result['message'] = str(minimum.message)
+    if not (minimum.success and np.all(np.isfinite(theta))):
+        return result
+
+    # Covariance from the Fisher information J^T diag(1/mu) J at the minimum
+    mu, jacobian = expected_counts(theta, edges)
+    fisher = jacobian.T @ (jacobian / np.maximum(mu, 1e-12)[:, None])
+    try:
+        covariance = np.linalg.inv(fisher)
+        errors = np.sqrt(np.clip(np.diag(covariance), 0, None))
+    except np.linalg.LinAlgError:
+        errors = np.full(len(PARAMETERS), np.nan)
+    result.update(converged=True, values=dict(zip(PARAMETERS, theta.tolist())),
+                  errors=dict(zip(PARAMETERS, errors.tolist())), nll=float(minimum.fun))
+    return result
+
+
+def model_curve(result, points=400):
+    # Fitted density in counts per bin of the fitted histogram, for drawing over it
+    values = result['values']
+    x = np.linspace(result['low'], result['high'], points)
+    bin_width = (result['high'] - result['low']) / result['bins']
+    density = np.zeros_like(x)
+    for n, mean, sigma in ((values['n_jpsi'], values['mean'], values['sigma']),
+                           (values['n_psiprime'], values['mean'] + PSIPRIME_SHIFT, values['sigma'] * PSIPRIME_SCALE)):
+        density += n * np.exp(-0.5 * ((x - mean) / sigma) ** 2) / (sigma * np.sqrt(2 * np.pi))
+    slope = values['slope']
+    density += values['n_background'] * slope * np.exp(-slope * (x - result['low'])) / (1 - np.exp(-slope * (result['high'] - result['low'])))
+    return x, density * bin_width
+
+
+class MassFitter:
+    # Fits one histogram after another, each starting from the previous converged fit, and keeps the
+    # fitted J/psi mean and width per fit as a time series for drift monitoring.
+    def __init__(self, log_path=None, low=2.0, high=5.0):
+        self.low = low
+        self.high = high
+        self.last = None  # parameters of the last converged fit
+        self.last_events = 1  # events in range of that fit
+        self.history = []  # one entry per labelled fit, oldest first
+        self.log_path = log_path
+        if log_path is not None and os.path.exists(log_path):
+            with open(log_path) as log:
+                self.history = [json.loads(line) for line in log if line.strip()]
+
+    def fit(self, edges, counts, label=None):
+        # label names what was fitted, e.g. the raw file; labelled fits are added to the history
+        start = None
+        if self.last is not None:
+            # The yields of the previous fit are scaled to the events of this histogram in the fit range
+            start = np.array(self.last)
+            in_range = fit_range(np.asarray(edges), np.asarray(counts), self.low, self.high)[1].sum()
+            ratio = max(in_range, 1) / max(self.last_events, 1)
+            start[[0, 3, 4]] *= ratio
+        result = fit_mass(edges, counts, start, self.low, self.high)
+        result['label'] = label
+        if result['converged']:
+            self.last = [result['values'][name] for name in PARAMETERS]
+            self.last_events = max(result['events'], 1)
+            if label is not None:
+                self.record(result)
+        return result
+
+    def record(self, result):
+        entry = {'time': time.time(), 'label': result['label'], 'events': result['events'],
+                 'mean': result['values']['mean'], 'mean_error': result['errors']['mean'],
+                 'sigma': result['values']['sigma'], 'sigma_error': result['errors']['sigma'],
+                 'n_jpsi': result['values']['n_jpsi'], 'n_jpsi_error': result['errors']['n_jpsi']}
+        self.history.append(entry)
+        if self.log_path is not None:
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.log_path, 'a') as log:
+                log.write(json.dumps(entry) + '\n')
@@ -0,0 +1,84 @@
+# Pipeline metrics tab of the GUI
+# Shows the per-stage totals and the most recent stages of a StageTimer, and switches the
+# sampling profiler on and off while the GUI keeps running.
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem, QCheckBox,
+                             QPushButton, QPlainTextEdit, QLabel)
+from Instrumentation import SamplingProfiler
+
+COLUMNS = ['stage', 'calls', 'seconds', 'ms/call', 'events in', 'events out', 'events/s', 'peak RSS (MB)', 'RSS increase (MB)']
+
+
+class MetricsPanel(QWidget):
+    def __init__(self, timer, refresh_ms=2000):
+        super().__init__()
+        self.stage_timer = timer
+        self.profiler = SamplingProfiler()
+        layout = QVBoxLayout(self)
+
+        layout.addWidget(QLabel("Totals per stage since start"))
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels(COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        layout.addWidget(self.table)
+
+        layout.addWidget(QLabel("Most recent stages"))
+        self.recent = QPlainTextEdit()
+        self.recent.setReadOnly(True)
+        self.recent.setMaximumBlockCount(200)
+        layout.addWidget(self.recent)
+
+        controls = QHBoxLayout()
+        self.profile_box = QCheckBox("Sampling profiler")
+        self.profile_box.toggled.connect(self.toggle_profiler)
+        controls.addWidget(self.profile_box)
+        reset_button = QPushButton("Reset profile")
+        reset_button.clicked.connect(self.profiler.reset)
+        controls.addWidget(reset_button)
+        controls.addStretch()
+        layout.addLayout(controls)
+        self.profile = QPlainTextEdit()
+        self.profile.setReadOnly(True)
+        layout.addWidget(self.profile)
+
+        self.shown = 0  # stages of the timer already appended to the text box
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(refresh_ms)
+
+    def toggle_profiler(self, enabled):
+        if enabled:
+            self.profiler.start()
+        else:
+            self.profiler.stop()
+        self.refresh()
+
+    def refresh(self):
+        # Redrawn from the timer's totals; cheap, there are only a few dozen stages
+        with self.stage_timer.lock:
+            stats = {name: dict(entry) for name, entry in self.stage_timer.stats.items()}
+            recent = list(self.stage_timer.recent)
+            finished = self.stage_timer.finished
+        self.table.setRowCount(len(stats))
+        for row, (name, entry) in enumerate(stats.items()):
+            seconds = max(entry['seconds'], 1e-9)
+            peak = entry.get('peak_rss_mb')
+            increase = entry.get('rss_increase_mb')
+            values = [name, entry['calls'], f"{entry['seconds']:.2f}", f"{1000 * seconds / max(entry['calls'], 1):.1f}",
+                      entry['events'], entry['events_out'], f"{entry['events'] / seconds:.0f}",
+                      f"{peak:.0f}" if peak is not None else "", f"{increase:.0f}" if increase is not None else ""]
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(str(value)))
+
+        # Only the stages finished since the last refresh are appended
+        if finished < self.shown:  # the timer was reset
+            self.shown = 0
+        new = recent[len(recent) - min(finished - self.shown, len(recent)):]
+        self.shown = finished
+        for line in new:
+            self.recent.appendPlainText(f"{line['stage']:<24}{line['seconds'] * 1000:10.1f} ms"
+                                        f"{line['events_in']:>8} -> {line['events_out']:<8}{line['thread']}")
+
+        if self.profiler.is_running() or self.profiler.samples:
+            self.profile.setPlainText(self.profiler.report())
@@ -0,0 +1,135 @@
+# Keeps the QTracker networks resident in memory so every raw file reuses them
+# Models are loaded once per process and only reloaded when their directory changes on disk
+# The backend is TensorFlow, or ONNX Runtime / TFLite on networks converted by convert_networks.py;
+# TensorFlow is only imported when the tensorflow backend loads a model.
+
+import os
+import hashlib
+import threading
+import numpy as np
+import Backends
+
+
+class ModelRegistry:
+    def __init__(self, networks_dir='Networks', timer=None, compiled=True, backend='tensorflow', threads=None):
+        if backend not in Backends.BACKENDS:
+            raise ValueError(f"Unknown inference backend {backend}, expected one of {', '.join(Backends.BACKENDS)}")
+        self.networks_dir = networks_dir
+        self.backend = backend
+        self.threads = threads  # intra-op threads of the onnx and tflite backends, None for their default
+        # Optional StageTimer, every load is recorded as a "load <name>" stage
+        self.timer = timer
+        # Run the networks as compiled tf.functions with fixed batch shapes (Inference.CompiledModel),
+        # False keeps plain Keras predict
+        self.compiled = compiled
+        self.models = {}
+        self.stamps = {}
+        self.loads = 0
+        self.lock = threading.Lock()
+        self.fingerprints = {}
+
+    def stamp(self, name):
+        # A SavedModel directory is rewritten as a whole, so the newest mtime and the
+        # total size of its files are enough to notice that a network was replaced.
+        path = os.path.join(self.networks_dir, name)
+        newest = os.path.getmtime(path)
+        size = 0
+        for root, dirs, files in os.walk(path):
+            for filename in files:
+                info = os.stat(os.path.join(root, filename))
+                newest = max(newest, info.st_mtime)
+                size += info.st_size
+        return (newest, size)
+
+    def available(self):
+        # Every subdirectory of Networks/ is one SavedModel
+        if not os.path.isdir(self.networks_dir):
+            return []
+        return sorted(name for name in os.listdir(self.networks_dir)
+                      if os.path.isdir(os.path.join(self.networks_dir, name)))
+
+    def warm_up(self, model):
+        # Run one dummy batch so Keras builds and traces its predict function (or a backend
+        # allocates its buffers) now instead of on the first real file.
+        shape = model.input_shape
+        if isinstance(shape, list):
+            shape = shape[0]
+        model.predict(np.zeros((1,) + tuple(shape[1:]), dtype=np.float32), verbose=0)
+
+    def load(self, name, softmax):
+        if self.timer is None:
+            return self.load_model(name, softmax)
+        with self.timer.stage("load " + name):
+            return self.load_model(name, softmax)
+
+    def load_model(self, name, softmax):
+        if self.backend != 'tensorflow':
+            model = Backends.load(self.backend, self.networks_dir, name, self.model_fingerprint(name), softmax, self.threads)
+            self.warm_up(model)
+            self.loads += 1
+            return model
+        import tensorflow as tf  # For using machine learning models.
+        from Inference import CompiledModel
+        model = tf.keras.models.load_model(os.path.join(self.networks_dir, name))
+        if softmax:
+            # The event filter is trained on logits, the probabilities are used for the cut
+            model = tf.keras.Sequential([model, tf.keras.layers.Softmax()])
+        if self.compiled:
+            model = CompiledModel(model, name)
+            model.warm_up()
+        else:
+            self.warm_up(model)
+        self.loads += 1
+        return model
+
+    def get(self, name, softmax=False):
+        key = (name, softmax)
+        stamp = self.stamp(name)
+        with self.lock:
+            if key not in self.models or self.stamps[key] != stamp:
+                if key in self.models:
+                    print(f"Reloading network {name}")
+                self.models[key] = self.load(name, softmax)
+                self.stamps[key] = stamp
+            return self.models[key]
+
+    def model_fingerprint(self, name):
+        # Content hash of one SavedModel, redone only when its directory's stamp changes
+        stamp = self.stamp(name)
+        if name not in self.fingerprints or self.fingerprints[name][0] != stamp:
+            model_digest = hashlib.sha256()
+            path = os.path.join(self.networks_dir, name)
+            for root, dirs, files in sorted(os.walk(path)):
+                for filename in sorted(files):
+                    full_path = os.path.join(root, filename)
+                    model_digest.update(os.path.relpath(full_path, path).encode())
+                    with open(full_path, 'rb') as model_file:
+                        for block in iter(lambda: model_file.read(1 << 20), b''):
+                            model_digest.update(block)
+            self.fingerprints[name] = (stamp, model_digest.hexdigest())
+        return self.fingerprints[name][1]
+
+    def fingerprint(self):
+        # Content hash of every network, used to key cached reconstructions.
+        # Converted networks agree with TensorFlow only within tolerance, so other backends get their own keys.
+        digest = hashlib.sha256()
+        if self.backend != 'tensorflow':
+            digest.update(self.backend.encode())
+        for name in self.available():
+            digest.update(name.encode())
+            digest.update(self.model_fingerprint(name).encode())
+        return digest.hexdigest()
+
+    def inference_report(self):
+        # Chosen XLA mode, batch size and measured throughput per bucket of every compiled network
+        with self.lock:
+            models = [model for model in self.models.values() if hasattr(model, 'report')]
+        return "\n".join(model.report() for model in models)
+
+    def load_all(self):
+        # Load and warm every network up front; cheap when they are already resident
+        loads = self.loads
+        for name in self.available():
+            self.get(name, softmax=(name == 'event_filter'))
+        if self.loads != loads:
+            print(f"Loaded {self.loads - loads} networks from {self.networks_dir}")
@@ -0,0 +1,122 @@
+# Detector occupancy tab of the GUI
+# QTracker stores the whole-file hit counts per (plane, element) with every output. This tab adds
+# them up as new outputs are logged and shows hits per event per plane and per channel, so noisy
+# and dead channels stand out without looking at single events.
+
+import numpy as np
+import pyqtgraph as pg
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QComboBox, QPushButton, QLabel
+import ColumnarOutput
+
+N_DETECTORS = 54
+N_ELEMENTS = 201
+
+
+def flag_channels(occupancy, noisy_factor=5.0):
+    # Per plane: channels above noisy_factor times the plane's median rate are noisy, empty channels
+    # below the highest occupied element of a plane with a nonzero median are dead.
+    noisy = []
+    dead = []
+    for plane in range(occupancy.shape[0]):
+        counts = occupancy[plane]
+        occupied = np.flatnonzero(counts)
+        if len(occupied) == 0:
+            continue
+        in_use = counts[:occupied[-1] + 1]
+        median = np.median(in_use)
+        if median <= 0:
+            continue
+        noisy += [(plane + 1, element + 1) for element in np.flatnonzero(in_use > noisy_factor * median)]
+        dead += [(plane + 1, element + 1) for element in np.flatnonzero(in_use == 0)]
+    return noisy, dead
+
+
+class OccupancyPanel(QWidget):
+    def __init__(self, output_directory="reconstructed", refresh_ms=2000):
+        super().__init__()
+        layout = QVBoxLayout(self)
+
+        controls = QHBoxLayout()
+        self.source_box = QComboBox()
+        self.source_box.addItem("After timing cuts and declustering", 'occupancy')
+        self.source_box.addItem("Raw hits", 'raw_occupancy')
+        self.source_box.currentIndexChanged.connect(self.redraw)
+        controls.addWidget(self.source_box)
+        reset_button = QPushButton("Reset")
+        reset_button.clicked.connect(self.reset)
+        controls.addWidget(reset_button)
+        self.summary = QLabel()
+        controls.addWidget(self.summary)
+        controls.addStretch()
+        layout.addLayout(controls)
+
+        self.plane_plot = pg.PlotWidget()
+        self.plane_plot.setLabel('bottom', "detectorID")
+        self.plane_plot.setLabel('left', "hits / event")
+        self.plane_bars = pg.BarGraphItem(x=np.arange(1, N_DETECTORS + 1), height=np.zeros(N_DETECTORS), width=0.8, brush='b')
+        self.plane_plot.addItem(self.plane_bars)
+        layout.addWidget(self.plane_plot)
+
+        self.channel_plot = pg.PlotWidget()
+        self.channel_plot.setLabel('bottom', "detectorID")
+        self.channel_plot.setLabel('left', "elementID")
+        self.channel_image = pg.ImageItem()
+        self.channel_image.setColorMap(pg.colormap.get('viridis'))
+        # Pixel (i, j) is detectorID i + 1, elementID j + 1
+        self.channel_image.setRect(0.5, 0.5, N_DETECTORS, N_ELEMENTS)
+        self.channel_plot.addItem(self.channel_image)
+        layout.addWidget(self.channel_plot, stretch=2)
+
+        self.flags = QLabel()
+        self.flags.setWordWrap(True)
+        layout.addWidget(self.flags)
+
+        self.output_log = ColumnarOutput.OutputLog(output_directory)
+        self.reset()
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.timeout.connect(self.refresh)
+        self.refresh_timer.start(refresh_ms)
+        self.refresh()
+
+    def reset(self):
+        # Start the totals over, e.g. after a hardware change
+        self.totals = {'occupancy': np.zeros((N_DETECTORS, N_ELEMENTS), dtype=np.int64),
+                       'raw_occupancy': np.zeros((N_DETECTORS, N_ELEMENTS), dtype=np.int64)}
+        self.n_events = 0
+        self.n_files = 0
+        self.redraw()
+
+    def refresh(self):
+        # Only outputs logged since the last refresh are read; each adds one small array per source
+        changed = False
+        for entry in self.output_log.new_entries():
+            try:
+                reader = ColumnarOutput.ColumnarReader(entry['output'])
+            except FileNotFoundError:
+                continue  # evicted from the cache since it was logged
+            if 'occupancy_events' not in reader:
+                continue
+            for name in self.totals:
+                self.totals[name] += reader[name]
+            self.n_events += int(reader['occupancy_events'][0])
+            self.n_files += 1
+            changed = True
+        if changed:
+            self.redraw()
+
+    def redraw(self):
+        occupancy = self.totals[self.source_box.currentData()]
+        per_event = occupancy / max(self.n_events, 1)
+        self.plane_bars.setOpts(height=per_event.sum(axis=1))
+        self.channel_image.setImage(per_event, autoLevels=True)
+        self.summary.setText(f"{self.n_events} events in {self.n_files} files")
+
+        noisy, dead = flag_channels(occupancy)
+        self.flags.setText(f"Noisy channels ({len(noisy)}): {self.describe(noisy)}\n"
+                           f"Dead channels ({len(dead)}): {self.describe(dead)}")
+
+    @staticmethod
+    def describe(channels, limit=20):
+        text = ", ".join(f"{detector}/{element}" for detector, element in channels[:limit])
+        return text + (" ..." if len(channels) > limit else "")
@@ -1,247 +1,683 @@
 #Modded by Jay, created by Dustin and Arthur 
 
 import os
+import json
 import numpy as np
 import uproot  # For reading ROOT files, a common data format in particle physics.
-import numba  # Just-In-Time (JIT) compiler for speeding up Python code.
+import awkward as ak
 from numba import njit, prange  # njit for compiling functions, prange for parallel loops.
-import tensorflow as tf  # For using machine learning models.
 
 import sys
+from ModelRegistry import ModelRegistry
+from HitStore import HitStore
+from ReconstructionCache import ReconstructionCache
+import ColumnarOutput
+import SpillStats
+import calc
+from Instrumentation import StageTimer
+from StageGraph import StageGraph
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# The cluster rules on the 201 cells of one plane, applied in place exactly as the original dense
+# kernel did: pairs and longer runs are checked working in from both ends of the plane, every
+# rule sees the cells as the previous ones left them, and trailing pairs of a run are checked again.
+@njit
+def decluster_plane(hits, drift, tdc):
+    for j in range(100):#Work from both sides
+        if(hits[j]==1 and hits[j+1]==1):
+            if(hits[j+2]==0):#Two hits
+                if(drift[j]>0.4 and drift[j+1]>0.9):#Edge hit check
+                    hits[j+1]=0
+                    drift[j+1]=0
+                    tdc[j+1]=0
+                elif(drift[j+1]>0.4 and drift[j]>0.9):#Edge hit check
+                    hits[j]=0
+                    drift[j]=0
+                    tdc[j]=0
+                if(abs(tdc[j]-tdc[j+1])<8):#Electronic Noise Check
+                    hits[j+1]=0
+                    drift[j+1]=0
+                    tdc[j+1]=0
+                    hits[j]=0
+                    drift[j]=0
+                    tdc[j]=0
+            else:#Check larger clusters for Electronic Noise
+                n=2
+                while(j+n<201 and hits[j+n]==1):n=n+1
+                dt_mean = 0
+                for m in range(n-1):
+                    dt_mean += (tdc[j+m]-tdc[j+m+1])
+                dt_mean = dt_mean/(n-1)
+                if(dt_mean<10):
+                    for m in range(n):
+                        hits[j+m]=0
+                        drift[j+m]=0
+                        tdc[j+m]=0
+        if(hits[200-j]==1 and hits[199-j]):
+            if(hits[198-j]==0):
+                if(drift[200-j]>0.4 and drift[199-j]>0.9):  # Edge hit check
+                    hits[199-j]=0
+                    drift[199-j]=0
+                elif(drift[199-j]>0.4 and drift[200-j]>0.9):  # Edge hit check
+                    hits[200-j]=0
+                    drift[200-j]=0
+                if(abs(tdc[200-j]-tdc[199-j])<8):  # Electronic Noise Check
+                    hits[199-j]=0
+                    drift[199-j]=0
+                    tdc[199-j]=0
+                    hits[200-j]=0
+                    drift[200-j]=0
+                    tdc[200-j]=0
+            else:  # Check larger clusters for Electronic Noise
+                n=2
+                while(hits[200-j-n]==1): n=n+1
+                dt_mean = 0
+                for m in range(n-1):
+                    dt_mean += abs(tdc[200-j-m]-tdc[200-j-m-1])
+                dt_mean = dt_mean/(n-1)
+                if(dt_mean<10):
+                    for m in range(n):
+                        hits[200-j-m]=0
+                        drift[200-j-m]=0
+                        tdc[200-j-m]=0
+
+
+# The same rules on one run of adjacent hits, cells first to last of a plane. Runs do not interact:
+# every check of decluster_plane starts on a hit and only reads and clears cells up to the next
+# empty one, so the run sees exactly the steps of decluster_plane that start inside it, in the same
+# order. hits, drift and tdc hold cells first - 2 to last + 2, cell c at index c - first + 2. The
+# one exception is a run from cell 0 past cell 100, where the backward search can wrap around to
+# cell 200; declusterize leaves those planes to decluster_plane.
+@njit
+def decluster_run(hits, drift, tdc, first, last):
+    o = 2 - first
+    # Steps j of decluster_plane whose forward check starts at j or backward check at 200 - j in the run
+    lo = 100
+    hi = -1
+    if first <= 99:
+        lo = first
+        hi = min(last, 99)
+    if last >= 101:
+        lo = min(lo, 200 - last)
+        hi = max(hi, 200 - max(first, 101))
+    for j in range(lo, hi + 1):
+        if first <= j and j + 1 <= last and hits[j+o]==1 and hits[j+1+o]==1:
+            if(hits[j+2+o]==0):#Two hits
+                if(drift[j+o]>0.4 and drift[j+1+o]>0.9):#Edge hit check
+                    hits[j+1+o]=0
+                    drift[j+1+o]=0
+                    tdc[j+1+o]=0
+                elif(drift[j+1+o]>0.4 and drift[j+o]>0.9):#Edge hit check
+                    hits[j+o]=0
+                    drift[j+o]=0
+                    tdc[j+o]=0
+                if(abs(tdc[j+o]-tdc[j+1+o])<8):#Electronic Noise Check
+                    hits[j+1+o]=0
+                    drift[j+1+o]=0
+                    tdc[j+1+o]=0
+                    hits[j+o]=0
+                    drift[j+o]=0
+                    tdc[j+o]=0
+            else:#Check larger clusters for Electronic Noise
+                n=2
+                while(j+n<201 and hits[j+n+o]==1):n=n+1
+                dt_mean = 0
+                for m in range(n-1):
+                    dt_mean += (tdc[j+m+o]-tdc[j+m+1+o])
+                dt_mean = dt_mean/(n-1)
+                if(dt_mean<10):
+                    for m in range(n):
+                        hits[j+m+o]=0
+                        drift[j+m+o]=0
+                        tdc[j+m+o]=0
+        if first <= 199-j and 200-j <= last and hits[200-j+o]==1 and hits[199-j+o]==1:
+            if(hits[198-j+o]==0):
+                if(drift[200-j+o]>0.4 and drift[199-j+o]>0.9):  # Edge hit check
+                    hits[199-j+o]=0
+                    drift[199-j+o]=0
+                elif(drift[199-j+o]>0.4 and drift[200-j+o]>0.9):  # Edge hit check
+                    hits[200-j+o]=0
+                    drift[200-j+o]=0
+                if(abs(tdc[200-j+o]-tdc[199-j+o])<8):  # Electronic Noise Check
+                    hits[199-j+o]=0
+                    drift[199-j+o]=0
+                    tdc[199-j+o]=0
+                    hits[200-j+o]=0
+                    drift[200-j+o]=0
+                    tdc[200-j+o]=0
+            else:  # Check larger clusters for Electronic Noise
+                n=2
+                while(hits[200-j-n+o]==1): n=n+1
+                dt_mean = 0
+                for m in range(n-1):
+                    dt_mean += abs(tdc[200-j-m+o]-tdc[200-j-m-1+o])
+                dt_mean = dt_mean/(n-1)
+                if(dt_mean<10):
+                    for m in range(n):
+                        hits[200-j-m+o]=0
+                        drift[200-j-m+o]=0
+                        tdc[200-j-m+o]=0
+
+
+# Per-slot lookup tables of evaluate_finder for the 34 slots of one muon track: stations 1 and 2,
+# station 3, the hodoscopes and the proportional tubes. decided_by is the prediction column whose
+# sign picks the plane (-1 if the plane is fixed), then the 0-based plane for a positive, negative
+# and zero prediction, the half width of the window that must contain a hit, and whether the
+# predicted element is moved to the nearest hit.
+def finder_slot_tables():
+    slot = np.arange(34)
+    plane_positive = np.where(slot <= 5, slot, slot + 6)
+    plane_negative = plane_positive.copy()
+    decided_by = np.full(34, -1)
+    station_3 = (slot >= 12) & (slot <= 17)
+    decided_by[station_3] = 12
+    plane_negative[station_3] = slot[station_3] + 12
+    plane_zero = plane_positive.copy()
+    hodoscopes = (slot >= 18) & (slot <= 25)
+    decided_by[hodoscopes] = 2 * (slot[hodoscopes] - 18) + 30
+    plane_positive[hodoscopes] = decided_by[hodoscopes]
+    plane_negative[hodoscopes] = decided_by[hodoscopes] + 1
+    plane_zero[hodoscopes] = decided_by[hodoscopes] + 1
+    prop_tubes = slot >= 26
+    plane_positive[prop_tubes] = plane_negative[prop_tubes] = plane_zero[prop_tubes] = slot[prop_tubes] + 20
+    windows = np.select([slot < 6, slot < 18, slot < 26], [15, 5, 1], 3)
+    search = (slot < 18) | (slot > 25)
+    return decided_by, plane_positive, plane_negative, plane_zero, windows, search
+
+
+# First index in start:stop of the sorted values that is >= value
+@njit
+def first_at_least(values, start, stop, value):
+    while start < stop:
+        middle = (start + stop) // 2
+        if values[middle] < value:
+            start = middle + 1
+        else:
+            stop = middle
+    return start
+
+
+# Index of a slice bound into the 201 elements of a plane, as Python would resolve it
+@njit
+def slice_index(index):
+    if index < 0:
+        index += 201
+    return min(max(index, 0), 201)
+
+
+# Element of the hit nearest to the 1-based element k among the sorted 0-based hit elements
+# start:stop of one plane. Like a search outwards over k, k+1, k-1, k+2, k-2, ... within 0-200:
+# ties go to the higher element, and element 0 stands for the last cell.
+@njit
+def nearest_hit(element, start, stop, k):
+    cell = k - 1 if k >= 1 else 200
+    h = first_at_least(element, start, stop, cell)
+    if h < stop and element[h] == cell:
+        return k
+    up = -1
+    h = first_at_least(element, start, stop, k)
+    if h < stop and element[h] <= 199:
+        up = element[h] + 1 - k
+    down = -1
+    h = first_at_least(element, start, stop, k - 1) - 1
+    if h >= start:
+        down = k - (element[h] + 1)
+    elif k >= 1 and stop > start and element[stop - 1] == 200:
+        down = k
+    if up >= 0 and (down < 0 or up <= down):
+        return k + up
+    if down >= 0:
+        return k - down
+    return k
 
 
 class QTracker:
+    # Wall time, events in and out and peak memory per pipeline stage
+    timer = StageTimer()
+    # Networks are loaded once per process and shared by every file; loads are timed as stages too.
+    # QTRACKER_BACKEND=onnx or tflite runs the converted networks without importing TensorFlow.
+    models = ModelRegistry('Networks', timer, backend=os.environ.get('QTRACKER_BACKEND', 'tensorflow'))
+    # Finished reconstructions keyed by raw file content and model fingerprint
+    cache = ReconstructionCache('reconstructed')
+    # Columns stream needs to return a cached reconstruction
+    cached_columns = ['target_track', *HitStore.empty().arrays(), *HitStore.empty().arrays('raw_')]
+    # Threads running the tracker stages, and one thread reconstructing the previous chunk while
+    # the next one is read. numba's workqueue threading layer must not be entered from two threads
+    # at once, so the numba kernels are serialised by numba_lock; they still overlap with TensorFlow.
+    stage_executor = ThreadPoolExecutor(max_workers=4)
+    # Basket decompression and interpretation for uproot reads; scales with cores, not branch count
+    read_executor = uproot.ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+    chunk_executor = ThreadPoolExecutor(max_workers=1)
+    numba_lock = threading.Lock()
+
     def __init__(self, root_file):
         print("QTracker Running")
 
         return None
     
-    @njit()
-    def hit_matrix(detectorid, elementid, drifttime, tdctime, hits, drift, tdc):
-        for j in prange(len(detectorid)):
+    # Fill the hit matrices of a whole batch of events in one parallel pass.
+    # The jagged hit branches come in flattened form: the hits of event n are
+    # offsets[n]:offsets[n+1] of detectorid, elementid, drifttime and tdctime.
+    @njit(parallel=True)
+    def hit_matrix(offsets, detectorid, elementid, drifttime, tdctime, window_lo, window_hi, selected, counts):
+        for n in prange(len(offsets) - 1):
             # Apply TDC timing cuts for different detector stations to filter hits.
             # This process segregates hits based on the detector station and applies
             # specific timing constraints to each, aiming to isolate meaningful events.
-            # For each station, if the hit passes timing cuts and either no hit was recorded
-            # before for this element, or the new hit has an earlier TDC time, it's recorded.
+            # For each element only the hit with the earliest TDC time is recorded.
             # This method emphasizes the earliest hit per detector element, which is crucial
             # for accurate track reconstruction.
 
-            # The following blocks are repeated for different detector stations, with each
-            # block applying specific timing cuts for that station. These cuts are based on
-            # the physical layout and expected signal timings of the experiment's detectors.
-            #Apply station 0 TDC timing cuts
-        
-            if (detectorid[j]<7) and (tdctime[j]>1700) and (tdctime[j]<1820):
-                if (tdc[int(detectorid[j])-1][int(elementid[j]-1)]==0) or (tdctime[j]<tdc[int(detectorid[j])-1][int(elementid[j]-1)]):
-                    hits[int(detectorid[j])-1][int(elementid[j]-1)]=1
-                    drift[int(detectorid[j])-1][int(elementid[j]-1)]=drifttime[j]
-                    tdc[int(detectorid[j])-1][int(elementid[j]-1)]=tdctime[j]
-            #Apply station 2 TDC timing cuts
-            if (detectorid[j]>12) and (detectorid[j]<19) and (tdctime[j]>1450) and (tdctime[j]<1710):
-                if (tdc[int(detectorid[j])-1][int(elementid[j]-1)]==0) or (tdctime[j]<tdc[int(detectorid[j])-1][int(elementid[j]-1)]):
-                    hits[int(detectorid[j])-1][int(elementid[j]-1)]=1
-                    drift[int(detectorid[j])-1][int(elementid[j]-1)]=drifttime[j]
-                    tdc[int(detectorid[j])-1][int(elementid[j]-1)]=tdctime[j]
-            #Apply station 3p TDC timing cuts
-            if (detectorid[j]>18) and (detectorid[j]<25) and (tdctime[j]>1360) and (tdctime[j]<1580):
-                if (tdc[int(detectorid[j])-1][int(elementid[j]-1)]==0) or (tdctime[j]<tdc[int(detectorid[j])-1][int(elementid[j]-1)]):
-                    hits[int(detectorid[j])-1][int(elementid[j]-1)]=1
-                    drift[int(detectorid[j])-1][int(elementid[j]-1)]=drifttime[j]
-                    tdc[int(detectorid[j])-1][int(elementid[j]-1)]=tdctime[j]
-            #Apply station 3p TDC timing cuts
-            if (detectorid[j]>24) and (detectorid[j]<31) and (tdctime[j]>1490) and (tdctime[j]<1700):
-                if (tdc[int(detectorid[j])-1][int(elementid[j]-1)]==0) or (tdctime[j]<tdc[int(detectorid[j])-1][int(elementid[j]-1)]):
-                    hits[int(detectorid[j])-1][int(elementid[j]-1)]=1
-                    drift[int(detectorid[j])-1][int(elementid[j]-1)]=drifttime[j]
-                    tdc[int(detectorid[j])-1][int(elementid[j]-1)]=tdctime[j]
-            #Apply prop tube TDC timing cuts
-            if (detectorid[j]>46) and (detectorid[j]<55) and (tdctime[j]>560) and (tdctime[j]<1200):
-                if (tdc[int(detectorid[j])-1][int(elementid[j]-1)]==0) or (tdctime[j]<tdc[int(detectorid[j])-1][int(elementid[j]-1)]):
-                    hits[int(detectorid[j])-1][int(elementid[j]-1)]=1
-                    drift[int(detectorid[j])-1][int(elementid[j]-1)]=drifttime[j]
-                    tdc[int(detectorid[j])-1][int(elementid[j]-1)]=tdctime[j]
-            #Add hodoscope hits
-            if (detectorid[j]>30) and (detectorid[j]<47):
-                if (tdc[int(detectorid[j])-1][int(elementid[j]-1)]==0) or (tdctime[j]<tdc[int(detectorid[j])-1][int(elementid[j]-1)]):
-                    hits[int(detectorid[j])-1][int(elementid[j]-1)]=1
-                    drift[int(detectorid[j])-1][int(elementid[j]-1)]=drifttime[j]
-                    tdc[int(detectorid[j])-1][int(elementid[j]-1)]=tdctime[j]
-        
-        return hits,drift,tdc
-    
+            # The timing windows come from a per-detector lookup table (tdc_windows.json).
+            # These cuts are based on the physical layout and expected signal timings
+            # of the experiment's detectors.
+            start = offsets[n]
+            stop = offsets[n + 1]
+            keys = np.empty(stop - start, dtype=np.int64)
+            index = np.empty(stop - start, dtype=np.int64)
+            m = 0
+            for j in range(start, stop):
+                det = int(detectorid[j]) - 1
+                ele = int(elementid[j]) - 1
+                if det < 0 or det >= 54 or ele < 0 or ele >= 201:
+                    continue
+                if tdctime[j] > window_lo[det] and tdctime[j] < window_hi[det]:
+                    keys[m] = det * 201 + ele
+                    index[m] = j
+                    m += 1
+
+            # Sorting by cell leaves the hits ordered by plane and element, as HitStore expects.
+            # The sort is stable, so among equal TDC times the first hit in the event wins.
+            order = np.argsort(keys[:m], kind='mergesort')
+            c = 0
+            previous = -1
+            for o in order:
+                j = index[o]
+                if keys[o] != previous:
+                    selected[start + c] = j
+                    c += 1
+                    previous = keys[o]
+                elif tdctime[j] < tdctime[selected[start + c - 1]]:
+                    selected[start + c - 1] = j
+            counts[n] = c
+
     # Function to evaluate the Track Finder neural network.
     @njit(parallel=True)
-    def evaluate_finder(testin, testdrift, predictions):
-        # The function constructs inputs for the neural network model based on test data
-        # and predictions, processing each event in parallel for efficiency.
-        reco_in = np.zeros((len(testin), 68, 2))
-        
-        def process_entry(i, dummy, j_offset):
-            j = dummy if dummy <= 5 else dummy + 6
-            if dummy > 11:
-                if predictions[i][12] > 0:
-                    j = dummy + 6
-                elif predictions[i][12] < 0:
-                    j = dummy + 12
-
-            if dummy > 17:
-                j = 2 * (dummy - 18) + 30 if predictions[i][2 * (dummy - 18) + 30] > 0 else 2 * (dummy - 18) + 31
-
-            if dummy > 25:
-                j = dummy + 20
-
-            k = abs(predictions[i][dummy + j_offset])
-            sign = k / predictions[i][dummy + j_offset] if k > 0 else 0
-            if(dummy<6):window=15
-            elif(dummy<12):window=5
-            elif(dummy<18):window=5
-            elif(dummy<26):window=1
-            else:window=3
-            k_sum = np.sum(testin[i][j][k - window:k + window-1])
-            if k_sum > 0 and ((dummy < 18) or (dummy > 25)):
-                k_temp = k
-                n = 1
-                while testin[i][j][k - 1] == 0:
-                    k_temp += n
-                    n = -n * (abs(n) + 1) / abs(n)
-                    if 0 <= k_temp < 201:
-                        k = int(k_temp)
-
-            reco_in[i][dummy + j_offset][0] = sign * k
-            reco_in[i][dummy + j_offset][1] = testdrift[i][j][k - 1]
-
-        for i in prange(predictions.shape[0]):
-            for dummy in prange(34):
-                process_entry(i, dummy, 0)
-            
-            for dummy in prange(34):
-                process_entry(i, dummy, 34)      
-
-        return reco_in
+    def evaluate_finder(offsets, detector, element, drift, predictions, decided_by, plane_positive, plane_negative,
+                        plane_zero, windows, search, reco_in):
+        # The function constructs the inputs of the reconstruction networks from the track finder
+        # predictions: for every slot of the two muon tracks the predicted element is moved to the
+        # nearest hit on the slot's plane, and the drift distance of that hit is looked up.
+        # The plane, search window and whether to search come from the per-slot tables of
+        # finder_slot_tables(). The hits are the compact HitStore arrays, sorted by plane and element,
+        # so both the window count and the nearest-hit search are binary searches in the plane's hits.
+        # Every (event, slot) is independent and the whole batch is one flat parallel loop.
+        n_slots = predictions.shape[1]
+        for f in prange((len(offsets) - 1) * n_slots):
+            i = f // n_slots
+            slot = f % n_slots
+            dummy = slot % 34
+            j = plane_positive[dummy]
+            if decided_by[dummy] >= 0:
+                if predictions[i, decided_by[dummy]] < 0:
+                    j = plane_negative[dummy]
+                elif predictions[i, decided_by[dummy]] == 0:
+                    j = plane_zero[dummy]
+            start = first_at_least(detector, offsets[i], offsets[i + 1], j)
+            stop = first_at_least(detector, start, offsets[i + 1], j + 1)
+
+            prediction = predictions[i, slot]
+            k = abs(prediction)
+            sign = 1 if prediction > 0 else (-1 if prediction < 0 else 0)
+            # Hits in elements k - window to k + window - 1, with the index rules of a Python slice
+            window = windows[dummy]
+            low = slice_index(k - window)
+            high = slice_index(k + window - 1)
+            n_hits = 0
+            if high > low:
+                n_hits = first_at_least(element, start, stop, high) - first_at_least(element, start, stop, low)
+            if n_hits > 0 and search[dummy]:
+                k = nearest_hit(element, start, stop, k)
+
+            cell = k - 1 if k >= 1 else 200
+            h = first_at_least(element, start, stop, cell)
+            reco_in[i, slot, 0] = sign * k
+            reco_in[i, slot, 1] = drift[h] if h < stop and element[h] == cell else 0
 
     # Function to remove closely spaced hits that are likely not real particle interactions (cluster hits).
     @njit(parallel=True)
-    def declusterize(hits, drift, tdc):
-        # This function iterates over hits and removes clusters of hits that are too close
-        # together, likely caused by noise or multiple hits from a single particle passing
-        # through the detector. It's an important step in cleaning the data for analysis.
-        for k in prange(len(hits)):
-            for i in range(31):
-                for j in range(100):#Work from both sides
-                    if(hits[k][i][j]==1 and hits[k][i][j+1]==1):
-                        if(hits[k][i][j+2]==0):#Two hits
-                            if(drift[k][i][j]>0.4 and drift[k][i][j+1]>0.9):#Edge hit check
-                                hits[k][i][j+1]=0
-                                drift[k][i][j+1]=0
-                                tdc[k][i][j+1]=0
-                            elif(drift[k][i][j+1]>0.4 and drift[k][i][j]>0.9):#Edge hit check
-                                hits[k][i][j]=0
-                                drift[k][i][j]=0
-                                tdc[k][i][j]=0
-                            if(abs(tdc[k][i][j]-tdc[k][i][j+1])<8):#Electronic Noise Check
-                                hits[k][i][j+1]=0
-                                drift[k][i][j+1]=0
-                                tdc[k][i][j+1]=0
-                                hits[k][i][j]=0
-                                drift[k][i][j]=0
-                                tdc[k][i][j]=0
-                                
-                        else:#Check larger clusters for Electronic Noise
-                            n=2
-                            while(hits[k][i][j+n]==1):n=n+1
-                            dt_mean = 0
-                            for m in range(n-1):
-                                dt_mean += (tdc[k][i][j+m]-tdc[k][i][j+m+1])
-                            dt_mean = dt_mean/(n-1)
-                            if(dt_mean<10):
-                                for m in range(n):
-                                    hits[k][i][j+m]=0
-                                    drift[k][i][j+m]=0
-                                    tdc[k][i][j+m]=0
-                    if(hits[k][i][200-j]==1 and hits[k][i][199-j]):
-                        if(hits[k][i][198-j]==0):
-                            if(drift[k][i][200-j]>0.4 and drift[k][i][199-j]>0.9):  # Edge hit check
-                                hits[k][i][199-j]=0
-                                drift[k][i][199-j]=0
-                            elif(drift[k][i][199-j]>0.4 and drift[k][i][200-j]>0.9):  # Edge hit check
-                                hits[k][i][200-j]=0
-                                drift[k][i][200-j]=0
-                            if(abs(tdc[k][i][200-j]-tdc[k][i][199-j])<8):  # Electronic Noise Check
-                                hits[k][i][199-j]=0
-                                drift[k][i][199-j]=0
-                                tdc[k][i][199-j]=0
-                                hits[k][i][200-j]=0
-                                drift[k][i][200-j]=0
-                                tdc[k][i][200-j]=0
-                        else:  # Check larger clusters for Electronic Noise
-                            n=2
-                            while(hits[k][i][200-j-n]==1): n=n+1
-                            dt_mean = 0
-                            for m in range(n-1):
-                                dt_mean += abs(tdc[k][i][200-j-m]-tdc[k][i][200-j-m-1])
-                            dt_mean = dt_mean/(n-1)
-                            if(dt_mean<10):
-                                for m in range(n):
-                                    hits[k][i][200-j-m]=0
-                                    drift[k][i][200-j-m]=0
-                                    tdc[k][i][200-j-m]=0       
-
+    def declusterize(segments, detector, element, drift, tdc, planes, keep):
+        # This function removes clusters of hits that are too close together, likely caused by
+        # noise or multiple hits from a single particle passing through the detector. It's an
+        # important step in cleaning the data for analysis.
+        # It works directly on the compact HitStore arrays. segments[s]:segments[s+1] are the hits of
+        # one (event, plane), see HitStore.plane_offsets(), sorted by element. On the planes flagged in
+        # planes, every run of two or more adjacent hits is declustered on its own with decluster_run(),
+        # so the work scales with the clustered hits. Hits to remove are flagged False in keep.
+        for s in prange(len(segments) - 1):
+            start = segments[s]
+            stop = segments[s + 1]
+            if not planes[detector[start]]:
+                continue
+            # A run from cell 0 past cell 100 can reach the other end of the plane, see decluster_run()
+            if element[start] == 0 and stop - start > 101 and element[start + 101] == 101:
+                hits = np.zeros(201, dtype=np.bool_)
+                plane_drift = np.zeros(201)
+                plane_tdc = np.zeros(201, dtype=np.int64)
+                for h in range(start, stop):
+                    hits[element[h]] = True
+                    plane_drift[element[h]] = drift[h]
+                    plane_tdc[element[h]] = tdc[h]
+                decluster_plane(hits, plane_drift, plane_tdc)
+                for h in range(start, stop):
+                    keep[h] = hits[element[h]]
+                continue
+            run_hits = np.zeros(205, dtype=np.bool_)
+            run_drift = np.zeros(205)
+            run_tdc = np.zeros(205, dtype=np.int64)
+            run_start = start
+            for h in range(start + 1, stop + 1):
+                if h < stop and element[h] == element[h - 1] + 1:
+                    continue
+                # run_start:h is a run of adjacent hits
+                if h - run_start >= 2:
+                    first = element[run_start]
+                    length = h - run_start
+                    run_hits[:length + 4] = False
+                    run_drift[:length + 4] = 0
+                    run_tdc[:length + 4] = 0
+                    for r in range(run_start, h):
+                        run_hits[element[r] - first + 2] = True
+                        run_drift[element[r] - first + 2] = drift[r]
+                        run_tdc[element[r] - first + 2] = tdc[r]
+                    decluster_run(run_hits, run_drift, run_tdc, first, first + length - 1)
+                    for r in range(run_start, h):
+                        keep[r] = run_hits[element[r] - first + 2]
+                run_start = h
+
+    # Branches of the save tree read by QTracker.
+    hit_branches = ["fAllHits.detectorID", "fAllHits.elementID", "fAllHits.driftDistance", "fAllHits.tdcTime"]
+    metadata_branches = ["fRunID", "fEventID", "fSpillID", "fTriggerBits", "fTargetPos", "fTurnID", "fRFID",
+                         "fIntensity[33]", "fNRoads[4]", "fNHits[55]"]
+
+    # Number of events carried through the pipeline at once in streaming mode.
+    # The dense (54, 201) cubes cost about 170 KB per event, so this bounds peak memory.
+    chunk_size = 1000
+
+    # Kinematic variables stored with every output as z_<name>, e.g. z_mass
+    stored_kinematics = ('mass', 'pT', 'x1', 'x2', 'xF', 'costheta', 'phi')
+
+    # Planes (detectorID - 1) on which declusterize removes clusters. The original dense kernel looped
+    # over range(31), detectorIDs 1-31; flagging more planes changes the network inputs.
+    decluster_planes = np.arange(54) < 31
+
+    # Lookup tables of evaluate_finder, see finder_slot_tables()
+    finder_slots = finder_slot_tables()
+
+    # (lo, hi) TDC windows per detector, loaded from tdc_windows.json on first use
+    timing_windows = None
+
+    # Per-detector TDC timing windows, (lo, hi) arrays indexed by detectorID - 1.
+    # Detectors without a cut get an infinite window, detectors not listed an empty one.
+    def load_timing_windows(path=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tdc_windows.json')):
+        with open(path) as config:
+            windows = json.load(config)["windows"]
+        window_lo = np.full(54, np.inf)
+        window_hi = np.full(54, -np.inf)
+        for window in windows:
+            first, last = window["detectors"]
+            window_lo[first - 1:last] = window.get("tdc_min", -np.inf)
+            window_hi[first - 1:last] = window.get("tdc_max", np.inf)
+        return window_lo, window_hi
+
+    # Split a jagged hit branch, read as an awkward array, into flat content and per-event offsets.
+    def flatten_jagged(array):
+        counts = ak.to_numpy(ak.num(array))
+        offsets = np.zeros(len(array) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        content = ak.to_numpy(ak.flatten(array))
+        return offsets, content
+
+    # The raw hits of a batch in compact form, unsorted and without timing cuts, for the hit display.
+    def raw_hits(detectorid, elementid, driftdistance, tdctime):
+        offsets, detector = QTracker.flatten_jagged(detectorid)
+        element = QTracker.flatten_jagged(elementid)[1]
+        drift = QTracker.flatten_jagged(driftdistance)[1]
+        tdc = QTracker.flatten_jagged(tdctime)[1]
+        return HitStore(offsets, (detector - 1).astype(np.int16), (element - 1).astype(np.int16),
+                        drift.astype(np.float32), tdc.astype(np.int32))
+
+    # Fill the hit matrices for one batch of events and store them in compact form, before declustering.
+    def timing_cut_hits(detectorid, elementid, driftdistance, tdctime):
+        if QTracker.timing_windows is None:
+            QTracker.timing_windows = QTracker.load_timing_windows()
+        window_lo, window_hi = QTracker.timing_windows
+
+        offsets, detector = QTracker.flatten_jagged(detectorid)
+        element = QTracker.flatten_jagged(elementid)[1]
+        drift = QTracker.flatten_jagged(driftdistance)[1]
+        tdc = QTracker.flatten_jagged(tdctime)[1]
+
+        # hit_matrix writes the chosen hit indices of event n from selected[offsets[n]] on
+        selected = np.empty(len(detector), dtype=np.int64)
+        counts = np.zeros(len(offsets) - 1, dtype=np.int64)
+        with QTracker.numba_lock, QTracker.timer.stage("hit_matrix", len(offsets) - 1):
+            QTracker.hit_matrix(offsets, detector, element, drift, tdc, window_lo, window_hi, selected, counts)
+        # Keep the first counts[n] entries of each event's slice of selected
+        n_raw = np.diff(offsets)
+        position = np.arange(len(detector)) - np.repeat(offsets[:-1], n_raw)
+        selected = selected[position < np.repeat(counts, n_raw)]
+
+        store_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=store_offsets[1:])
+        return HitStore(store_offsets, (detector[selected] - 1).astype(np.int16), (element[selected] - 1).astype(np.int16),
+                        drift[selected].astype(np.float32), tdc[selected].astype(np.int32))
+
+    # Flags the hits of a HitStore that declusterize keeps; runs in parallel over its (event, plane) segments.
+    def decluster(store):
+        keep = np.ones(len(store.detector), dtype=bool)
+        QTracker.declusterize(store.plane_offsets(), store.detector, store.element, store.drift, store.tdc,
+                              QTracker.decluster_planes, keep)
+        return keep
+
+    # Track inputs of the reconstruction networks from the track finder predictions of a HitStore's events.
+    def finder_tracks(store, finder_predictions):
+        reco_in = np.empty((len(store), 68, 2), dtype=np.float32)
+        QTracker.evaluate_finder(store.offsets, store.detector, store.element, store.drift, finder_predictions,
+                                 *QTracker.finder_slots, reco_in)
+        return reco_in
 
+    # The hits of one batch of events after the timing cuts and the removal of closely spaced hits.
+    def build_hits(detectorid, elementid, driftdistance, tdctime):
+        store = QTracker.timing_cut_hits(detectorid, elementid, driftdistance, tdctime)
+        with QTracker.numba_lock, QTracker.timer.stage("declusterize", len(store)):
+            keep = QTracker.decluster(store)  # Remove closely spaced hits.
+        return store.compress(keep)
+
+    # Apply the event filter network to a batch of hit matrices.
+    def event_filter(hits):
+        probability_model = QTracker.models.get('event_filter', softmax=True)
+        with QTracker.timer.stage("event_filter", len(hits)) as record:
+            predictions = probability_model.predict(hits.to_dense(), batch_size=256, verbose=0)
+            # Filter out events based on the prediction from the event filter model.
+            #Keep events that have better than 75% probability of having a dimuon tracks.
+            filt = predictions[:, 3] > 0.75
+            record['events_out'] = np.sum(filt)
+        return predictions, filt
+
+    # Stack the metadata branches into one array, one row per event.
+    def stack_metadata(branches):
+        return np.column_stack([branches[name] for name in QTracker.metadata_branches])
+
+    # Match branches by exact name; uproot's default filter_name is a glob and the [33] in
+    # fIntensity[33] would be read as a character class.
+    def branch_filter(names):
+        names = set(names)
+        return lambda name: name in names
+
+    # One bulk read of exactly the given branches, decompressed and interpreted on read_executor.
+    # Jagged branches must be read with library="ak": as NumPy they become object arrays of one
+    # small array per event, which is orders of magnitude slower to build.
+    def read_branches(targettree, names, entry_start=None, entry_stop=None, library="np"):
+        return targettree.arrays(filter_name=QTracker.branch_filter(names), entry_start=entry_start, entry_stop=entry_stop,
+                                 library=library, decompression_executor=QTracker.read_executor,
+                                 interpretation_executor=QTracker.read_executor)
+
+    # Read the metadata only for the entry range spanned by the events that passed the event filter.
+    # entries are global entry numbers in the tree, in increasing order.
+    def read_metadata(targettree, entries):
+        start, stop = int(entries[0]), int(entries[-1]) + 1
+        branches = QTracker.read_branches(targettree, QTracker.metadata_branches, start, stop)
+        return QTracker.stack_metadata({name: branches[name][entries - start] for name in QTracker.metadata_branches})
+
+    # Print a pipeline stage and forward it to an optional progress callback.
+    def report(progress, stage, fraction):
+        print(stage)
+        if progress is not None:
+            progress(stage, fraction)
 
-    
     # Process each event to fill the hits, drift, and TDC arrays with cleaned and structured data.
     def prediction(root_file):
         root_file = root_file
         targettree = uproot.open(root_file + ":save")
-        detectorid = targettree["fAllHits.detectorID"].arrays(library="np")["fAllHits.detectorID"]
-        elementid = targettree["fAllHits.elementID"].arrays(library="np")["fAllHits.elementID"]
-        driftdistance = targettree["fAllHits.driftDistance"].arrays(library="np")["fAllHits.driftDistance"]
-        tdctime = targettree["fAllHits.tdcTime"].arrays(library="np")["fAllHits.tdcTime"]
-
-        # Initialize arrays to hold processed hit data.
-        hits = np.zeros((len(detectorid), 54, 201), dtype=bool)
-        drift = np.zeros((len(detectorid), 54, 201))
-        tdc = np.zeros((len(detectorid), 54, 201), dtype=int)
-
-        for n in range(len(detectorid)):
-            hits[n], drift[n], tdc[n] = QTracker.hit_matrix(detectorid[n], elementid[n], driftdistance[n], tdctime[n], hits[n], drift[n], tdc[n])
-
-        QTracker.declusterize(hits, drift, tdc)  # Remove closely spaced hits.
+        branches = QTracker.read_branches(targettree, QTracker.hit_branches, library="ak")
+        detectorid = branches["fAllHits.detectorID"]
+        elementid = branches["fAllHits.elementID"]
+        driftdistance = branches["fAllHits.driftDistance"]
+        tdctime = branches["fAllHits.tdcTime"]
 
-        tf.keras.backend.clear_session()  # Clear any existing TensorFlow sessions.
-        tf.compat.v1.reset_default_graph()  # Reset the default graph to prepare for model loading.
+        # Fill the compact hit store and remove closely spaced hits.
+        hits = QTracker.build_hits(detectorid, elementid, driftdistance, tdctime)
 
         print("Loaded events")
 
-        # Load and apply a pre-trained TensorFlow model for event filtering.
-        model = tf.keras.models.load_model('Networks/event_filter')
-        probability_model = tf.keras.Sequential([model, tf.keras.layers.Softmax()])
-        predictions = probability_model.predict(hits, batch_size=256, verbose=0)
-        # Filter out events based on the prediction from the event filter model.
-        #Keep events that have better than 75% probability of having a dimuon tracks.
-        filt = predictions[:, 3] > 0.75
-        hits = hits[filt]
-        drift = drift[filt]
+        # Apply the resident pre-trained TensorFlow model for event filtering.
+        predictions, filt = QTracker.event_filter(hits)
+        hits = hits.select(filt)
+        drift = None  # Drift distances are carried inside the hit store
 
         # Read and filter metadata based on the same criteria used for hits and drift data.
         # This metadata includes various identifiers and measurements related to the events.
-        runid = targettree["fRunID"].arrays(library="np")["fRunID"][filt]
-        eventid =targettree["fEventID"].arrays(library="np")["fEventID"][filt]
-        spill_id = targettree["fSpillID"].arrays(library="np")["fSpillID"][filt]
-        trigger_bit = targettree["fTriggerBits"].arrays(library="np")["fTriggerBits"][filt]
-        target_position = targettree["fTargetPos"].arrays(library="np")["fTargetPos"][filt]
-        turnid = targettree["fTurnID"].arrays(library="np")["fTurnID"][filt]
-        rfid = targettree["fRFID"].arrays(library="np")["fRFID"][filt]
-        intensity = targettree["fIntensity[33]"].arrays(library="np")["fIntensity[33]"][filt]
-        n_roads = targettree["fNRoads[4]"].arrays(library="np")["fNRoads[4]"][filt]
-        n_hits = targettree["fNHits[55]"].arrays(library="np")["fNHits[55]"][filt]
-
-        metadata = np.column_stack((runid, eventid, spill_id, trigger_bit, target_position, turnid, rfid, intensity, n_roads, n_hits))
+        metadata = QTracker.read_metadata(targettree, np.nonzero(filt)[0]) if np.any(filt) else np.zeros((0, 0))
 
         return predictions, filt, hits, drift,metadata, root_file, detectorid, elementid
 
-    def tracker(predictions, filt, hits, drift,metadata, root_file):
+    # Streaming version of prediction + tracker: the file is read in fixed-size event batches with
+    # uproot's chunked iteration, and each batch goes through hit_matrix, declusterize, the event
+    # filter and the tracker, overlapping with the next batch. Only the events passing the filter are
+    # kept, so peak memory depends on chunk_size and not on the size of the file.
+    # progress, if given, is called as progress(stage, fraction of the file done), e.g. a Qt signal's emit.
+    # use_cache=False forces a new reconstruction even if a cached output exists.
+    def stream(root_file, step_size=None, progress=None, use_cache=True):
+        step_size = step_size or QTracker.chunk_size
+        timer = QTracker.timer
+
+        # Reuse a stored reconstruction of the same file made with the same networks and timing windows
+        with timer.stage("cache lookup"):
+            cache_key = QTracker.cache_key(root_file)
+            cached = QTracker.cache.lookup(cache_key, QTracker.cached_columns) if use_cache else None
+        if cached is not None:
+            QTracker.report(progress, f"Loaded cached reconstruction of {root_file}", 1.0)
+            return cached, HitStore.from_arrays(cached), cached['target_track'], HitStore.from_arrays(cached, 'raw_')
+
+        targettree = uproot.open(root_file + ":save")
+        n_total = max(targettree.num_entries, 1)
+
+        # Every reconstructed chunk is appended to the output columns and dropped, so the memory
+        # use does not grow with the file
+        writer = ColumnarOutput.ColumnarWriter(QTracker.output_directory(root_file))
+        n_events = 0
+        pending = None
+        occupancy = {'raw_occupancy': np.zeros((HitStore.n_detectors, HitStore.n_elements), dtype=np.int64),
+                     'occupancy': np.zeros((HitStore.n_detectors, HitStore.n_elements), dtype=np.int64),
+                     'occupancy_events': np.zeros(1, dtype=np.int64)}
+
+        def collect(future, hits, n_done):
+            output_data, target_track = future.result()
+            QTracker.report(progress, f"Reconstructed events up to {n_done}", n_done / n_total)
+            with timer.stage("save", len(output_data)):
+                for name, column in QTracker.output_columns(output_data, target_track).items():
+                    writer.append(name, column)
+                QTracker.append_hits(writer, hits)
+
+        try:
+            # Only the hit branches are read up front; the metadata follows for the events that pass the filter.
+            chunks = targettree.iterate(filter_name=QTracker.branch_filter(QTracker.hit_branches), step_size=step_size,
+                                        library="ak", report=True, decompression_executor=QTracker.read_executor,
+                                        interpretation_executor=QTracker.read_executor)
+            while True:
+                with timer.stage("uproot read") as record:
+                    chunk, chunk_report = next(chunks, (None, None))
+                    record['events'] = len(chunk["fAllHits.detectorID"]) if chunk is not None else 0
+                if chunk is None:
+                    break
+                detectorid = chunk["fAllHits.detectorID"]
+                hits = QTracker.build_hits(detectorid, chunk["fAllHits.elementID"], chunk["fAllHits.driftDistance"], chunk["fAllHits.tdcTime"])
+                # Detector occupancy of every event read, before and after the timing cuts and declustering
+                with timer.stage("occupancy", len(detectorid)):
+                    occupancy['raw_occupancy'] += HitStore.cell_counts(ak.to_numpy(ak.flatten(detectorid)) - 1,
+                                                                       ak.to_numpy(ak.flatten(chunk["fAllHits.elementID"])) - 1)
+                    occupancy['occupancy'] += hits.occupancy()
+                    occupancy['occupancy_events'] += len(detectorid)
+                QTracker.report(progress, f"Loaded events {n_events}-{n_events + len(detectorid)}", n_events / n_total)
+                n_events += len(detectorid)
+
+                predictions, filt = QTracker.event_filter(hits)
+                QTracker.report(progress, f"Event filter: {np.sum(filt)} of {len(filt)} events pass", n_events / n_total)
+                if not np.any(filt):
+                    continue
+
+                with timer.stage("metadata read", np.sum(filt)):
+                    metadata = QTracker.read_metadata(targettree, chunk_report.tree_entry_start + np.nonzero(filt)[0])
+                hits = hits.select(filt)
+                QTracker.append_hits(writer, QTracker.raw_hits(detectorid[filt], chunk["fAllHits.elementID"][filt],
+                                                               chunk["fAllHits.driftDistance"][filt], chunk["fAllHits.tdcTime"][filt]), 'raw_')
+
+                # The tracker of this chunk runs in the background while the next chunk is read and
+                # filtered; at most two chunks are in flight.
+                if pending is not None:
+                    collect(*pending)
+                pending = (QTracker.chunk_executor.submit(QTracker.reconstruct, predictions[filt], hits, metadata), hits, n_events)
+
+            if pending is not None:
+                collect(*pending)
+        except BaseException:
+            writer.abort()
+            raise
+
+        n_reconstructed = writer.rows('spill_id')
+        if n_reconstructed == 0:
+            writer.abort()
+            QTracker.report(progress, "No events meeting dimuon criteria.", 1.0)
+            return np.zeros((0, 0)), HitStore.empty(), np.zeros((0, 68, 2)), HitStore.empty()
+
+        with timer.stage("finish output", n_reconstructed):
+            # Per-spill vertex summaries need the whole file, they are made from the finished columns
+            with QTracker.numba_lock:
+                spill_columns = SpillStats.spill_columns(writer.finish('spill_id'), writer.finish('z_vtx'))
+            output_dir = writer.close({**spill_columns, **occupancy}, n_events=n_reconstructed,
+                                      raw_file=os.path.basename(root_file))
+            QTracker.announce_output(output_dir, root_file, n_reconstructed, len(spill_columns['spill_stats_spill_id']))
+            QTracker.cache.store(cache_key, output_dir, root_file)
+        QTracker.report(progress, "QTracker Complete", 1.0)
+
+        # The named, memory-mapped columns of what was just written
+        reader = ColumnarOutput.ColumnarReader(output_dir)
+        return reader, HitStore.from_arrays(reader), reader['target_track'], HitStore.from_arrays(reader, 'raw_')
+
+    # Everything the output of a raw file depends on: its content, the networks, the timing windows
+    # and the output format.
+    def cache_key(root_file):
+        windows_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tdc_windows.json')
+        return QTracker.cache.key(root_file, QTracker.models.fingerprint(), QTracker.cache.file_hash(windows_file),
+                                  f"columnar-v{ColumnarOutput.FORMAT_VERSION}")
+
+    # Run the track finder, reconstruction and vertexing networks on events that passed the event filter.
+    # The work is expressed as a graph of stages. The All, Z and Target branches only share the hit
+    # inputs, so the scheduler runs them concurrently until the target/dump filter joins them.
+    def reconstruct(predictions, hit_store, metadata):
 
         # Define normalization constants for kinematic and vertex data.
         kin_means = np.array([2, 0, 35, -2, 0, 35])
@@ -259,126 +695,76 @@ class QTracker:
                     128, 128,  112,  112, 128, 128, 134, 134, 112, 112, 134, 134,
                     20,  20,  16,  16,  16,  16,  16,  16,  72,  72,  72,  72,  72,
                     72,  72,  72]
-        
 
-
-
-        
-        predictions = predictions[filt]  # Apply the filter to the predictions as well.
-
-        print("Filtered Events")
-
-        # If there are filtered events to process, continue with the track finding and reconstruction.
-        #if(len(hits) > 0):
         # The predictions from the event filter are stored for later use.
         dimuon_probability = predictions
 
-        # Clear any existing TensorFlow models from memory to load new ones.
-        tf.keras.backend.clear_session()
-        tf.compat.v1.reset_default_graph()
-        
-        # Load the Track Finder model trained to identify tracks across all vertex positions.
-        model = tf.keras.models.load_model('Networks/Track_Finder_All')
-        predictions = (np.round(model.predict(hits, verbose=0) * max_ele)).astype(int)
-        
-        # Evaluate the Track Finder model and adjust the hit matrices accordingly.
-        all_vtx_track = QTracker.evaluate_finder(hits, drift, predictions)
-        print("Found Tracks")
-        
-        # Similar steps are repeated for models trained on different subsets of the data,
-        # such as those specific to z-vertices or target vertices, to improve the precision
-        # of track identification under different conditions.
+        # Dense cubes are only built here, as the batch input of the networks.
+        def dense():
+            with QTracker.numba_lock:
+                return hit_store.to_dense()
 
-        # After finding tracks, the next step is to reconstruct the 4-momentum
-        # for the particles involved in each event. This involves loading a new model
-        # specifically trained for this purpose and processing the track data through it.
-
-        # Clear TensorFlow sessions again to ensure a clean slate for loading new models.
-        tf.keras.backend.clear_session()
-        tf.compat.v1.reset_default_graph()
-        
-        # Load the momentum reconstruction model and predict the 4-momentum for each track.
-        model = tf.keras.models.load_model('Networks/Reconstruction_All')
-        pred = model.predict(all_vtx_track, batch_size=8192, verbose=0)
-        reco_kinematics = pred  # Store the predicted 4-momentum for each event.
-
-        # Vertex reconstruction is similar to the previous steps, using a dedicated model
-        # to determine the points in space where the particle interactions occurred.
-
-        # Combine the reconstructed kinematic data with the original hit data for vertexing.
-        vertex_reco = np.concatenate((pred.reshape((len(pred), 3, 2)), all_vtx_track), axis=1)
-
-        # Clear TensorFlow sessions and load the vertex reconstruction model.
-        tf.keras.backend.clear_session()
-        tf.compat.v1.reset_default_graph()
-        model = tf.keras.models.load_model('Networks/Vertexing_All')
-        
-        # Predict vertex positions for each event.
-        pred = model.predict(vertex_reco, batch_size=8192, verbose=0)
-        reco_vertex = pred  # Store the reconstructed vertex positions.
-
-        # Combine all reconstructed data for a comprehensive analysis.
-        all_vtx_reco_kinematics = np.concatenate((reco_kinematics, reco_vertex), axis=1)
-
-        print("Reconstructed events for all vertices")
-    
-        tf.keras.backend.clear_session()
-        tf.compat.v1.reset_default_graph()
-        model = tf.keras.models.load_model('Networks/Track_Finder_Z')
-        predictions = (np.round(model.predict(hits,verbose=0)*max_ele)).astype(int)
-        z_vtx_track = QTracker.evaluate_finder(hits,drift,predictions)
-
-        # Similar processes are repeated for the tracks identified by
-        # such as those specific to z vertices or target vertices.
         # Three versions of the track finder were trained on different vertex distributions:
         # All vertices along the beamline within 1 meter of the beam.
         # All z-vertices along the beamline and finally Target vertices.
         # This multi-model approach allows for a nuanced analysis of particle tracks
         # from various perspectives, improving the overall quality of the reconstruction.
+        def finder(name):
+            def stage(inputs):
+                model = QTracker.models.get('Track_Finder_' + name)
+                return (np.round(model.predict(inputs, verbose=0) * max_ele)).astype(int)
+            return stage
 
-        tf.keras.backend.clear_session()
-        tf.compat.v1.reset_default_graph()
-        model=tf.keras.models.load_model('Networks/Reconstruction_Z')
-        pred = model.predict(z_vtx_track,batch_size=8192,verbose=0)
-        reco_kinematics = pred
-
-        vertex_reco=np.concatenate((pred.reshape((len(pred),3,2)),z_vtx_track),axis=1)
+        # Evaluate the Track Finder model against the hits of the batch.
+        def evaluate(finder_predictions):
+            with QTracker.numba_lock:
+                return QTracker.finder_tracks(hit_store, finder_predictions)
 
-        tf.keras.backend.clear_session()
-        tf.compat.v1.reset_default_graph()
-        model=tf.keras.models.load_model('Networks/Vertexing_Z')
-        pred = model.predict(vertex_reco,batch_size=8192,verbose=0)
-        reco_vertex = pred
-
-        z_vtx_reco_kinematics=np.concatenate((reco_kinematics,reco_vertex),axis=1)
-
-        print("Reconstructed events for z vertices")
-    
-        tf.keras.backend.clear_session()
-        tf.compat.v1.reset_default_graph()
-        model = tf.keras.models.load_model('Networks/Track_Finder_Target')
-        predictions = (np.round(model.predict(hits,verbose=0)*max_ele)).astype(int)
-        target_track = QTracker.evaluate_finder(hits,drift,predictions)
-
-        tf.keras.backend.clear_session()
-        tf.compat.v1.reset_default_graph()
-        model=tf.keras.models.load_model('Networks/Reconstruction_Target')
-        pred = model.predict(target_track,batch_size=8192,verbose=0)
-        reco_kinematics = pred
-
-        target_vtx_reco_kinematics= reco_kinematics
-
-        reco_kinematics = np.concatenate((all_vtx_reco_kinematics,z_vtx_reco_kinematics,target_vtx_reco_kinematics),axis=1)
-
-        tf.keras.backend.clear_session()
-        tf.compat.v1.reset_default_graph()
-        model=tf.keras.models.load_model('Networks/target_dump_filter')
-        target_dump_prob = model.predict(reco_kinematics,batch_size=8192,verbose=0)
-        tracks = np.concatenate((all_vtx_track, z_vtx_track, target_track),axis=2)
+        # After finding tracks, the next step is to reconstruct the 4-momentum
+        # for the particles involved in each event.
+        def reconstruction(name):
+            def stage(track):
+                model = QTracker.models.get('Reconstruction_' + name)
+                return model.predict(track, batch_size=8192, verbose=0)
+            return stage
+
+        # Vertex reconstruction uses the reconstructed kinematics together with the track hits
+        # to determine the points in space where the particle interactions occurred.
+        def vertexing(name):
+            def stage(reco_kinematics, track):
+                vertex_reco = np.concatenate((reco_kinematics.reshape((len(reco_kinematics), 3, 2)), track), axis=1)
+                model = QTracker.models.get('Vertexing_' + name)
+                reco_vertex = model.predict(vertex_reco, batch_size=8192, verbose=0)
+                # Combine all reconstructed data for a comprehensive analysis.
+                return np.concatenate((reco_kinematics, reco_vertex), axis=1)
+            return stage
+
+        def target_dump(all_vtx_reco_kinematics, z_vtx_reco_kinematics, target_vtx_reco_kinematics):
+            reco_kinematics = np.concatenate((all_vtx_reco_kinematics,z_vtx_reco_kinematics,target_vtx_reco_kinematics),axis=1)
+            model = QTracker.models.get('target_dump_filter')
+            return model.predict(reco_kinematics,batch_size=8192,verbose=0)
+
+        graph = StageGraph()
+        graph.add('dense', dense)
+        for name in ('All', 'Z', 'Target'):
+            graph.add('finder_' + name, finder(name), 'dense')
+            graph.add('evaluate_' + name, evaluate, 'finder_' + name)
+            graph.add('reconstruction_' + name, reconstruction(name), 'evaluate_' + name)
+        for name in ('All', 'Z'):
+            graph.add('vertexing_' + name, vertexing(name), 'reconstruction_' + name, 'evaluate_' + name)
+        graph.add('target_dump', target_dump, 'vertexing_All', 'vertexing_Z', 'reconstruction_Target')
+
+        with QTracker.timer.stage("tracker", len(hit_store)):
+            results = graph.run(QTracker.stage_executor, QTracker.timer, len(hit_store))
+        print("Reconstructed events for all, z and target vertices")
+
+        all_vtx_reco_kinematics = results['vertexing_All']
+        z_vtx_reco_kinematics = results['vertexing_Z']
+        target_vtx_reco_kinematics = results['reconstruction_Target']
+        target_dump_prob = results['target_dump']
+        target_track = results['evaluate_Target']
         all_predictions = np.column_stack((all_vtx_reco_kinematics*stds+means,z_vtx_reco_kinematics*stds+means, target_vtx_reco_kinematics*kin_stds+kin_means))            
 
-        print("Reconstructed events for target vertices")
-        
         output_data = np.column_stack((dimuon_probability, all_predictions, target_dump_prob, metadata))
     
         # After processing through all models, the results are aggregated,
@@ -387,29 +773,74 @@ class QTracker:
 
         # The reconstructed kinematics and vertex information are normalized
         # using predefined means and standard deviations before saving.
+        return output_data, target_track
 
-        # The QTracker output data is saved to a NumPy file for further analysis,
-
-        base_filename = 'reconstructed/' + os.path.basename(root_file).split('.')[0]
+    # The QTracker output data is saved as named columns, one .npy file each plus a manifest,
+    # in reconstructed/<raw file name>_reconstructed/ for further analysis.
+    def output_directory(root_file):
         os.makedirs("reconstructed", exist_ok=True)  # Ensure the output directory exists.
-        np.savez(base_filename + '_reconstructed', output_data, hits, target_track)  # Save the final dataset.
-        
-        print(f"File {base_filename}_reconstructed.npz has been saved successfully.\n")
-        print("QTracker Complete")
+        return 'reconstructed/' + os.path.basename(root_file).split('.')[0] + '_reconstructed'
+
+    # The event level columns of a batch of reconstructed events
+    def output_columns(output_data, target_track):
+        columns = ColumnarOutput.split_output(output_data)
+        columns['target_track'] = target_track
+        # Dimuon kinematics of the z-vertex momenta, with unphysical components zeroed as in the GUI
+        z_mom = np.where(abs(columns['z_mom']) < 120, columns['z_mom'], 0)
+        with QTracker.numba_lock:
+            columns.update({'z_' + name.lower(): values for name, values in
+                            calc.kinematics(z_mom, QTracker.stored_kinematics).items()})
+        return columns
+
+    # Append the hits of a batch of events to the hit columns, continuing the offsets of earlier batches
+    def append_hits(writer, hits, prefix='hit_'):
+        arrays = hits.arrays(prefix)
+        offsets = arrays.pop(prefix + 'offsets')
+        if writer.rows(prefix + 'offsets') == 0:
+            writer.append(prefix + 'offsets', offsets[:1])
+        writer.append(prefix + 'offsets', offsets[1:] + writer.rows(prefix + 'detector'))
+        for name, array in arrays.items():
+            writer.append(name, array)
+
+    # Announce a new output to SpillCharts and other followers of the output log
+    def announce_output(output_dir, root_file, n_events, n_spills):
+        ColumnarOutput.log_output("reconstructed", {'output': output_dir, 'raw_file': os.path.basename(root_file),
+                                                    'n_events': n_events, 'n_spills': n_spills})
+        print(f"File {output_dir} has been saved successfully.\n")
+
+    # Save a whole reconstruction at once.
+    # occupancy, if given, holds the whole-file detector occupancy columns.
+    def save_output(root_file, output_data, hits, target_track, raw_hits=None, occupancy=None):
+        columns = QTracker.output_columns(output_data, target_track)
+        # Per-spill vertex summaries, so SpillCharts never has to touch event level data
+        with QTracker.numba_lock:
+            columns.update(SpillStats.spill_columns(columns['spill_id'], columns['z_vtx']))
+        columns.update(hits.arrays())
+        if raw_hits is not None:
+            columns.update(raw_hits.arrays('raw_'))
+        if occupancy is not None:
+            columns.update(occupancy)
+        output_dir = ColumnarOutput.write(QTracker.output_directory(root_file), columns, n_events=len(output_data),
+                                          raw_file=os.path.basename(root_file))  # Save the final dataset.
+        # Not stored in the cache: an entry made by stream for this directory no longer describes it
+        QTracker.cache.forget(output_dir)
+        QTracker.announce_output(output_dir, root_file, len(output_data), len(columns['spill_stats_spill_id']))
+        return output_dir
 
-        return output_data, hits, target_track
-        
+    def tracker(predictions, filt, hits, drift,metadata, root_file):
+        predictions = predictions[filt]  # Apply the filter to the predictions as well.
 
-        # else:
-        #     print("No events meeting dimuon criteria.")  # If no events pass the filter, notify the user.
-        #     #return None
+        print("Filtered Events")
 
-        # return output_data, hits, target_track
+        # drift is kept in the signature for old callers, the drift distances live in the hit store
+        output_data, target_track = QTracker.reconstruct(predictions, hits, metadata)
+        QTracker.save_output(root_file, output_data, hits, target_track)
+        print("QTracker Complete")
+
+        return output_data, hits, target_track
 
 # reconstructed_files = [os.path.join("Raw", f) for f in os.listdir("Raw") if os.path.isfile(os.path.join("Raw", f))]
 # reconstructed_files.sort(key=lambda x: os.path.getmtime(x), reverse=True)
 # most_recent_filename = reconstructed_files[0]
 
 # output_data, hits, target_track = QTracker.Tracker(root_file= most_recent_filename)
-
-
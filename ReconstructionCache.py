@@ -0,0 +1,132 @@
+# Content-addressed cache of QTracker outputs
+# A reconstruction is keyed by the hash of the raw file plus a fingerprint of the networks
+# and timing windows that produced it, so a restart never reprocesses a file it already has.
+# The cache index lives next to the outputs in reconstructed/cache_index.json. Batch workers share
+# it, so every read-modify-write of the index holds an exclusive lock on cache_index.json.lock.
+
+import os
+import json
+import time
+import shutil
+import hashlib
+from contextlib import contextmanager
+import ColumnarOutput
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where the index is used without locking
+    fcntl = None
+
+
+class ReconstructionCache:
+    def __init__(self, directory='reconstructed', max_bytes=20 * 1024**3):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'cache_index.json')
+        self.lock_path = self.index_path + '.lock'
+        # Oldest-used outputs are deleted once the cached files exceed max_bytes
+        self.max_bytes = max_bytes
+        self.hashes = {}  # path -> ((size, mtime), sha256) so unchanged files are hashed once
+
+    def file_hash(self, path):
+        info = os.stat(path)
+        stamp = (info.st_size, info.st_mtime)
+        if path in self.hashes and self.hashes[path][0] == stamp:
+            return self.hashes[path][1]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as raw:
+            for block in iter(lambda: raw.read(1 << 20), b''):
+                digest.update(block)
+        self.hashes[path] = (stamp, digest.hexdigest())
+        return self.hashes[path][1]
+
+    def key(self, root_file, *fingerprints):
+        # fingerprints: anything else the output depends on, e.g. the model and config hashes
+        digest = hashlib.sha256(self.file_hash(root_file).encode())
+        for fingerprint in fingerprints:
+            digest.update(fingerprint.encode())
+        return digest.hexdigest()
+
+    @contextmanager
+    def locked(self):
+        # Held around every read-modify-write of the index, across processes
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as index:
+            return json.load(index)
+
+    def write_index(self, entries):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self.index_path + f'.{os.getpid()}.tmp'
+        with open(temporary, 'w') as index:
+            json.dump(entries, index, indent=1)
+        os.replace(temporary, self.index_path)
+
+    def lookup(self, key, required_columns=()):
+        # A reader over the stored columns of a cached reconstruction, or None on a miss. An output
+        # that was since overwritten in another format or without some of required_columns is a
+        # miss too, and its entry is dropped.
+        with self.locked():
+            entries = self.read_index()
+            entry = entries.get(key)
+            if entry is None or not os.path.exists(entry['file']):
+                return None
+            try:
+                reader = ColumnarOutput.ColumnarReader(entry['file'])
+            except (OSError, ValueError):
+                reader = None
+            if (reader is None or reader.manifest.get('version') != ColumnarOutput.FORMAT_VERSION
+                    or not all(name in reader for name in required_columns)):
+                del entries[key]
+                self.write_index(entries)
+                return None
+            entry['last_used'] = time.time()
+            self.write_index(entries)
+            return reader
+
+    def store(self, key, path, raw_file):
+        # Register an output directory written by QTracker.save_output and evict old entries if needed
+        with self.locked():
+            entries = self.read_index()
+            # The output file was overwritten, so older keys pointing at it are stale
+            for other in [k for k, entry in entries.items() if entry['file'] == path]:
+                del entries[other]
+            entries[key] = {'file': path, 'raw_file': os.path.basename(raw_file),
+                            'size': ColumnarOutput.size(path), 'last_used': time.time()}
+            self.evict(entries, keep=key)
+            self.write_index(entries)
+
+    def forget(self, path):
+        # Drop the entries of an output directory that was rewritten outside the cache
+        with self.locked():
+            entries = self.read_index()
+            stale = [k for k, entry in entries.items() if entry['file'] == path]
+            for key in stale:
+                del entries[key]
+            if stale:
+                self.write_index(entries)
+
+    def evict(self, entries, keep=None):
+        # Drop entries whose file is gone, then delete least recently used outputs over the size limit
+        for key in [k for k, entry in entries.items() if not os.path.exists(entry['file'])]:
+            del entries[key]
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(entries[key]['file'], ignore_errors=True)
+            total -= entries[key]['size']
+            print(f"Evicted cached reconstruction {entries[key]['file']}")
+            del entries[key]
@@ -0,0 +1,30 @@
+# Runs the QTracker reconstruction off the GUI thread
+# The worker fills a fresh DataOrganizer and hands it to the GUI when it is done,
+# so the displays keep showing the previous file until the new one is ready.
+
+from PyQt5.QtCore import QThread, pyqtSignal
+from DataOrganizer import DataOrganizer
+
+
+class ReconstructionWorker(QThread):
+    progress = pyqtSignal(str, float)  # stage description, fraction of the file done
+    reconstructed = pyqtSignal(object)  # the filled DataOrganizer
+    failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.raw_file = None
+
+    def process(self, raw_file):
+        # Reconstruct one raw file in the background
+        self.raw_file = raw_file
+        self.start()
+
+    def run(self):
+        organizer = DataOrganizer()
+        try:
+            organizer.organizeData(raw_file=self.raw_file, progress=self.progress.emit)
+        except Exception as error:
+            self.failed.emit(f"Reconstruction failed: {error!r}")
+            return
+        self.reconstructed.emit(organizer)
@@ -5,8 +5,7 @@ from pyqtgraph.Qt import QtGui
 from random import randrange, uniform
 from PyQt5 import QtCore
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLineEdit, QApplication
-from spinquest_gui.modules.calculations.DataReader import DataReader
-from types import NoneType
+import ColumnarOutput
 import pyqtgraph as pg
 application = QApplication(sys.argv)
 
@@ -36,8 +35,6 @@ class SpillCharts(QWidget):
         layout.addWidget(self.vtzSPlot)
         self.setLayout(layout)
         
-        self.reader = None
-
         self.MAX_SPILLS = 5
         self.xSScatter = []
         self.ySScatter = []
@@ -48,50 +45,38 @@ class SpillCharts(QWidget):
         self.currentFile = 0
         self.position = 0
         self.spillsDisplayed = 0
+        # (spill ID, mean, std) of every spill drawn so far, the per-spill summaries are tiny
+        self.spillHistory = []
+        self.outputLog = ColumnarOutput.OutputLog("reconstructed")
 
-        if not (os.path.exists("SpillVertexMeans")):
-            path = os.path.join("SpillVertexMeans")
-            os.mkdir(path)
-            with open ("SpillVertexMeans/README.txt",'w') as README:
-                README.write("This directory contains npz files labeled by spill. Each file contains 7 0-dimensional arrays stored in npy files\n")
-                README.write("The 0th array contains the spill ID\n")
-                README.write("The 1st, 2nd, and 3rd arrays contain the mean X, Y, and Z vertex positions over all events in the spill respectively\n")
-                README.write("The 4th, 5th, and 6th arrays contain the standard deviations of X, Y, and Z vertex positions respectively\n")
-
-
-        self.filenames = sorted([filename for filename in os.listdir("reconstructed") if filename.endswith(".npz")])
-        self.fileCount = len(self.filenames)
-        while (self.fileCount > self.currentFile):
-            if (self.currentFile >= self.MAX_SPILLS):
-                self.vtxSPlot.removeItem(self.xSScatter[self.position])
-                self.vtySPlot.removeItem(self.ySScatter[self.position])
-                self.vtzSPlot.removeItem(self.zSScatter[self.position])
-                self.vtxSPlot.removeItem(self.xErr[self.position])
-                self.vtySPlot.removeItem(self.yErr[self.position])
-                self.vtzSPlot.removeItem(self.zErr[self.position])
-            self.reader = DataReader([os.path.join("reconstructed", filename) for filename in self.filenames], "EVENT")
-            self.DrawSpill()
+        self.UpdateChart()
 
         timer = QtCore.QTimer(self)
         timer.timeout.connect(self.UpdateChart)
         timer.start(500)
 
     def UpdateChart(self):
-        self.filenames = sorted([filename for filename in os.listdir("reconstructed") if filename.endswith(".npz")])
-        self.fileCount = len(self.filenames)
-        if (self.fileCount > self.currentFile):
-            if (self.currentFile >= self.MAX_SPILLS):
-                self.vtxSPlot.removeItem(self.xSScatter[self.position])
-                self.vtySPlot.removeItem(self.ySScatter[self.position])
-                self.vtzSPlot.removeItem(self.zSScatter[self.position])
-                self.vtxSPlot.removeItem(self.xErr[self.position])
-                self.vtySPlot.removeItem(self.yErr[self.position])
-                self.vtzSPlot.removeItem(self.zErr[self.position])
-            self.reader = DataReader([os.path.join("reconstructed", filename) for filename in self.filenames], "EVENT")
-            self.DrawSpill()
+        # Only outputs logged since the last refresh are read, however many files came before
+        for entry in self.outputLog.new_entries():
+            self.DrawFile(entry['output'])
+            self.currentFile += 1
+
+    def DrawFile(self, path):
+        # QTracker stores the vertex mean and standard deviation of every spill in the file
+        if not os.path.exists(os.path.join(path, ColumnarOutput.MANIFEST)):
+            return  # evicted from the cache since it was logged
+        reader = ColumnarOutput.ColumnarReader(path)
+        if 'spill_stats_spill_id' not in reader:
+            return
+        sidData = np.array(reader['spill_stats_spill_id'])
+        means = np.array(reader['spill_stats_mean'])
+        stds = np.array(reader['spill_stats_std'])
+        for i in range(len(sidData)):
+            self.spillHistory.append((sidData[i], means[i], stds[i]))
+            self.DrawSpill(sidData[i], means[i], stds[i])
 
     def SetSpillWindow(self):
-        if self.txtin.text().isdigit():
+        if self.txtin.text().isdigit() and int(self.txtin.text()) > 0:
             for i in range (self.spillsDisplayed):
                 self.vtxSPlot.removeItem(self.xSScatter[i])
                 self.vtySPlot.removeItem(self.ySScatter[i])
@@ -106,56 +91,39 @@ class SpillCharts(QWidget):
             self.yErr = []
             self.zErr = []
             self.MAX_SPILLS = int(self.txtin.text())
-            self.currentFile = max(self.currentFile-self.MAX_SPILLS,0)
             self.position = 0
             self.spillsDisplayed = 0
-            self.filenames = sorted([filename for filename in os.listdir("reconstructed") if filename.endswith(".npz")])
-            self.fileCount = len(self.filenames)
-            self.reader = DataReader([os.path.join("reconstructed", filename) for filename in self.filenames], "EVENT")
-            while (self.fileCount > self.currentFile):
-                self.DrawSpill()
+            for sid, mean, std in self.spillHistory[-self.MAX_SPILLS:]:
+                self.DrawSpill(sid, mean, std)
 
-    def DrawSpill(self):
-        self.reader.current_index = self.currentFile
-        self.reader.grab = "EVENT"
-        self.eidData = np.array(self.reader.read_data())
-        self.reader.grab = "XVERTEX"
-        self.vtxData = np.array(self.reader.read_data())
-        self.reader.grab = "YVERTEX"
-        self.vtyData = np.array(self.reader.read_data())
-        self.reader.grab = "ZVERTEX"
-        self.vtzData = np.array(self.reader.read_data())
-        self.reader.grab = "SPILL"
-        self.sidData = np.array(self.reader.read_data()[0])
-        self.vtxMean = np.array([np.mean(self.vtxData)])
-        self.vtyMean = np.array([np.mean(self.vtyData)])
-        self.vtzMean = np.array([np.mean(self.vtzData)])
-        self.vtxSTD = np.std(self.vtxData)
-        self.vtySTD = np.std(self.vtyData)
-        self.vtzSTD = np.std(self.vtzData)
-        if (self.spillsDisplayed < self.MAX_SPILLS):
+    def DrawSpill(self, sid, mean, std):
+        sidData = np.array([sid])
+        if (self.spillsDisplayed >= self.MAX_SPILLS):
+            self.vtxSPlot.removeItem(self.xSScatter[self.position])
+            self.vtySPlot.removeItem(self.ySScatter[self.position])
+            self.vtzSPlot.removeItem(self.zSScatter[self.position])
+            self.vtxSPlot.removeItem(self.xErr[self.position])
+            self.vtySPlot.removeItem(self.yErr[self.position])
+            self.vtzSPlot.removeItem(self.zErr[self.position])
+        else:
             self.xSScatter.append(pg.ScatterPlotItem(size=10,brush=pg.mkBrush(0,0,255,255)))
             self.ySScatter.append(pg.ScatterPlotItem(size=10,brush=pg.mkBrush(255,0,0,255)))
             self.zSScatter.append(pg.ScatterPlotItem(size=10,brush=pg.mkBrush(0,255,0,255)))
-            self.xErr.append(pg.ErrorBarItem(x=self.sidData,y=self.vtxMean,height=self.vtxSTD,pen=pg.mkPen(0,0,255,255),beam=0.5))
-            self.yErr.append(pg.ErrorBarItem(x=self.sidData,y=self.vtyMean,height=self.vtySTD,pen=pg.mkPen(255,0,0,255),beam=0.5))
-            self.zErr.append(pg.ErrorBarItem(x=self.sidData,y=self.vtzMean,height=self.vtzSTD,pen=pg.mkPen(0,255,0,255),beam=0.5))
+            self.xErr.append(None)
+            self.yErr.append(None)
+            self.zErr.append(None)
             self.spillsDisplayed += 1
-        self.xErr[self.position] = pg.ErrorBarItem(x=self.sidData,y=self.vtxMean,height=self.vtxSTD,pen=pg.mkPen(0,0,255,255),beam=0.5)
-        self.xSScatter[self.position].setData(self.sidData,self.vtxMean)
+        self.xErr[self.position] = pg.ErrorBarItem(x=sidData,y=mean[0:1],height=std[0],pen=pg.mkPen(0,0,255,255),beam=0.5)
+        self.xSScatter[self.position].setData(sidData,mean[0:1])
         self.vtxSPlot.addItem(self.xSScatter[self.position])
         self.vtxSPlot.addItem(self.xErr[self.position])
-        self.yErr[self.position] = pg.ErrorBarItem(x=self.sidData,y=self.vtyMean,height=self.vtySTD,pen=pg.mkPen(255,0,0,255),beam=0.5)
-        self.ySScatter[self.position].setData(self.sidData,self.vtyMean)
+        self.yErr[self.position] = pg.ErrorBarItem(x=sidData,y=mean[1:2],height=std[1],pen=pg.mkPen(255,0,0,255),beam=0.5)
+        self.ySScatter[self.position].setData(sidData,mean[1:2])
         self.vtySPlot.addItem(self.ySScatter[self.position])
         self.vtySPlot.addItem(self.yErr[self.position])
-        self.zErr[self.position] = pg.ErrorBarItem(x=self.sidData,y=self.vtzMean,height=self.vtzSTD,pen=pg.mkPen(0,255,0,255),beam=0.5)
-        self.zSScatter[self.position].setData(self.sidData,self.vtzMean)
+        self.zErr[self.position] = pg.ErrorBarItem(x=sidData,y=mean[2:3],height=std[2],pen=pg.mkPen(0,255,0,255),beam=0.5)
+        self.zSScatter[self.position].setData(sidData,mean[2:3])
         self.vtzSPlot.addItem(self.zSScatter[self.position])
         self.vtzSPlot.addItem(self.zErr[self.position])
-        self.spillString = str(self.sidData)
-        np.savez('SpillVertexMeans/' + self.spillString + '.npz',self.sidData,self.vtxMean,self.vtyMean,self.vtzMean,self.vtxSTD,self.vtySTD,self.vtzSTD)
-        self.currentFile += 1
         self.position += 1
         self.position = self.position % self.MAX_SPILLS
-        layout=self.layout()
\ No newline at end of file
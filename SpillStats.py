@@ -0,0 +1,52 @@
+# Per-spill vertex statistics, computed once when a reconstruction is saved
+# Events are sorted by spill ID and every spill is reduced in a single pass with Welford's
+# algorithm, so a file holding many spills still gets correct per-spill means and widths.
+
+import numpy as np
+from numba import njit, prange
+
+
+@njit(parallel=True)
+def group_welford(values, starts, stops, counts, means, stds):
+    # values are sorted by group, group g is values[starts[g]:stops[g]]
+    for g in prange(len(starts)):
+        n = 0
+        mean = np.zeros(values.shape[1])
+        m2 = np.zeros(values.shape[1])
+        for i in range(starts[g], stops[g]):
+            n += 1
+            for c in range(values.shape[1]):
+                delta = values[i, c] - mean[c]
+                mean[c] += delta / n
+                m2[c] += delta * (values[i, c] - mean[c])
+        counts[g] = n
+        for c in range(values.shape[1]):
+            means[g, c] = mean[c]
+            # Population standard deviation, as np.std
+            stds[g, c] = np.sqrt(m2[c] / n) if n > 0 else np.nan
+
+
+def spill_vertex_stats(spill_id, vertex):
+    # spill_id (N,), vertex (N, 3); vertices at or beyond 1e6 cm are failed fits and are skipped
+    valid = np.all(np.isfinite(vertex) & (np.abs(vertex) < 1e6), axis=1)
+    spill_id = np.asarray(spill_id)[valid]
+    vertex = np.asarray(vertex, dtype=np.float64)[valid]
+
+    order = np.argsort(spill_id, kind='stable')
+    spill_sorted = spill_id[order]
+    vertex_sorted = np.ascontiguousarray(vertex[order])
+    starts = np.flatnonzero(np.r_[True, spill_sorted[1:] != spill_sorted[:-1]]) if len(order) else np.zeros(0, dtype=np.int64)
+    stops = np.r_[starts[1:], len(order)].astype(np.int64)
+
+    counts = np.zeros(len(starts), dtype=np.int64)
+    means = np.zeros((len(starts), 3))
+    stds = np.zeros((len(starts), 3))
+    group_welford(vertex_sorted, starts.astype(np.int64), stops, counts, means, stds)
+    return spill_sorted[starts], counts, means, stds
+
+
+def spill_columns(spill_id, vertex):
+    # The per-spill summary as output columns, one row per spill
+    spills, counts, means, stds = spill_vertex_stats(spill_id, vertex)
+    return {'spill_stats_spill_id': spills.astype(np.int64), 'spill_stats_count': counts,
+            'spill_stats_mean': means, 'spill_stats_std': stds}
@@ -0,0 +1,39 @@
+# Explicit dependency graph of pipeline stages
+# Each stage is a function of the results of the stages it depends on. The scheduler submits
+# every stage as soon as its inputs exist, so independent branches run concurrently.
+
+from concurrent.futures import wait, FIRST_COMPLETED
+
+
+class StageGraph:
+    def __init__(self):
+        self.stages = {}  # name -> (function, names of the stages it depends on)
+
+    def add(self, name, function, *depends_on):
+        # Dependencies must be added first, which keeps the graph acyclic
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}")
+        self.stages[name] = (function, depends_on)
+
+    def run_stage(self, name, function, arguments, timer, events):
+        if timer is None:
+            return function(*arguments)
+        with timer.stage(name, events):
+            return function(*arguments)
+
+    def run(self, executor, timer=None, events=0):
+        # Returns the results of all stages by name
+        results = {}
+        running = {}
+        waiting = dict(self.stages)
+        while waiting or running:
+            for name, (function, depends_on) in list(waiting.items()):
+                if all(dependency in results for dependency in depends_on):
+                    arguments = [results[dependency] for dependency in depends_on]
+                    running[executor.submit(self.run_stage, name, function, arguments, timer, events)] = name
+                    del waiting[name]
+            done, not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+        return results
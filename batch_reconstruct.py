@@ -0,0 +1,111 @@
+# Headless batch reconstruction of raw files, e.g. for reprocessing a run backlog
+# Usage: python batch_reconstruct.py raw/ [more dirs or globs] --workers 4 --threads 4
+# Writes the same reconstructed outputs as the GUI and prints per-stage throughput at the end.
+
+import os
+import sys
+import glob
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from Instrumentation import StageTimer
+
+# Set in each worker process by init_worker
+QTracker = None
+
+
+def init_worker(threads, chunk_size, metrics_log, inter_op=1, backend='tensorflow'):
+    # Thread counts must be fixed before numba and TensorFlow start their pools,
+    # so QTracker is only imported here, inside the worker.
+    global QTracker
+    for variable in ('OMP_NUM_THREADS', 'NUMBA_NUM_THREADS'):
+        os.environ[variable] = str(threads)
+    os.environ['QTRACKER_BACKEND'] = backend
+    if backend == 'tensorflow':
+        import Inference
+        Inference.configure_threads(threads, inter_op)
+    import uproot
+    from QTracker import QTracker as tracker
+    QTracker = tracker
+    QTracker.models.threads = threads
+    QTracker.read_executor = uproot.ThreadPoolExecutor(max_workers=threads)
+    if chunk_size:
+        QTracker.chunk_size = chunk_size
+    if metrics_log:
+        # Workers share the log; each stage is one short line, appended in a single write
+        QTracker.timer.log_to(metrics_log)
+    # One warm model set per worker, reused for every file it gets
+    QTracker.models.load_all()
+
+
+def process_file(raw_file, use_cache):
+    QTracker.timer.reset()
+    start = time.perf_counter()
+    output_data = QTracker.stream(raw_file, use_cache=use_cache)[0]
+    return raw_file, len(output_data), time.perf_counter() - start, QTracker.timer.stats
+
+
+def find_raw_files(inputs):
+    # Directories are expanded to the files they contain, anything else is treated as a glob
+    raw_files = []
+    for item in inputs:
+        if os.path.isdir(item):
+            raw_files += [path for path in glob.glob(os.path.join(item, '*')) if os.path.isfile(path)]
+        else:
+            raw_files += glob.glob(item)
+    return sorted(set(raw_files), key=os.path.getmtime)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Reconstruct raw SpinQuest ROOT files with QTracker")
+    parser.add_argument('inputs', nargs='+', help="directories or globs of raw ROOT files")
+    parser.add_argument('--workers', type=int, default=max(1, os.cpu_count() // 4), help="number of worker processes")
+    parser.add_argument('--threads', type=int, default=4, help="numba/TensorFlow threads per worker")
+    parser.add_argument('--inter-op-threads', type=int, default=1,
+                        help="TensorFlow inter-op threads per worker; the tracker already runs its branches concurrently")
+    parser.add_argument('--backend', choices=('tensorflow', 'onnx', 'tflite'), default='tensorflow',
+                        help="inference backend; onnx and tflite need the networks converted by convert_networks.py")
+    parser.add_argument('--chunk-size', type=int, default=None, help="events per streaming batch")
+    parser.add_argument('--no-cache', action='store_true', help="reconstruct even if a cached output exists")
+    parser.add_argument('--metrics-log', default=None, help="append every finished stage to this JSON lines file")
+    args = parser.parse_args(argv)
+
+    raw_files = find_raw_files(args.inputs)
+    if not raw_files:
+        print("No raw files found.")
+        return 1
+    print(f"Reconstructing {len(raw_files)} files with {args.workers} workers x {args.threads} threads")
+
+    timer = StageTimer()
+    n_done = 0
+    n_failed = 0
+    start = time.perf_counter()
+    # spawn, not fork: TensorFlow does not survive being forked after initialisation
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context,
+                             initializer=init_worker,
+                             initargs=(args.threads, args.chunk_size, args.metrics_log, args.inter_op_threads, args.backend)) as pool:
+        futures = {pool.submit(process_file, raw_file, not args.no_cache): raw_file for raw_file in raw_files}
+        for future in as_completed(futures):
+            try:
+                raw_file, n_events, seconds, stats = future.result()
+            except Exception as error:
+                n_failed += 1
+                print(f"FAILED {futures[future]}: {error!r}")
+                continue
+            n_done += 1
+            timer.merge(stats)
+            print(f"[{n_done + n_failed}/{len(raw_files)}] {raw_file}: {n_events} dimuon events in {seconds:.1f} s")
+
+    wall = time.perf_counter() - start
+    print()
+    print("Per-stage totals (seconds summed over workers):")
+    print(timer.report(n_done))
+    print(f"\n{n_done} files in {wall:.1f} s wall time, {n_done / wall:.2f} files/s, {n_failed} failed")
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
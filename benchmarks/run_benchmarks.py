@@ -0,0 +1,207 @@
+# Benchmarks of the reconstruction pipeline on synthetic data
+# Usage: python benchmarks/run_benchmarks.py --events 10000 --hits 150 --output bench.json
+#        python benchmarks/run_benchmarks.py --compare bench.json   (prints ratios to an earlier run)
+# Every stage is timed on the same generated raw file with stand-in networks, so the results of
+# two commits can be compared directly. The first call of each case compiles the numba kernels and
+# is reported separately as compile_seconds.
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+import numpy as np
+import uproot
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+
+
+def time_case(function, repeat, events):
+    # function() runs one iteration; returns the timing summary of the case
+    start = time.perf_counter()
+    function()
+    first = time.perf_counter() - start
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    best = min(seconds)
+    return {'compile_seconds': max(first - best, 0.0), 'min_seconds': best, 'median_seconds': float(np.median(seconds)),
+            'repeat': repeat, 'events': events, 'events_per_second': events / max(best, 1e-9)}
+
+
+# Batch sizes of the Keras predict calls before the compiled inference layer; None is Keras' default
+KERAS_BATCH_SIZES = {'event_filter': 256, 'Reconstruction_All': 8192, 'Reconstruction_Z': 8192,
+                     'Reconstruction_Target': 8192, 'Vertexing_All': 8192, 'Vertexing_Z': 8192,
+                     'target_dump_filter': 8192}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, workdir):
+    from QTracker import QTracker
+    from ModelRegistry import ModelRegistry
+    from ReconstructionCache import ReconstructionCache
+    from Histograms import HistogramAccumulator
+    import calc
+    import synthetic
+
+    # The stand-in networks and all outputs live in the scratch directory
+    os.chdir(workdir)
+    QTracker.models = ModelRegistry(synthetic.make_networks(os.path.join(workdir, 'Networks')), QTracker.timer)
+    QTracker.cache = ReconstructionCache(os.path.join(workdir, 'reconstructed'))
+    QTracker.models.load_all()
+
+    window_lo, window_hi = QTracker.timing_windows = QTracker.load_timing_windows()
+    raw_file = synthetic.write_root_file(os.path.join(workdir, 'synthetic_raw.root'), args.events, args.hits,
+                                         args.spills, args.seed, (window_lo, window_hi))
+    # No array cache, every iteration reads and decompresses the baskets like a new file
+    tree = uproot.open(raw_file + ':save', array_cache=None)
+    results = {}
+    results['uproot read'] = time_case(lambda: QTracker.read_branches(tree, QTracker.hit_branches, library="ak"), args.repeat, args.events)
+    branches = QTracker.read_branches(tree, QTracker.hit_branches, library="ak")
+    detectorid = branches["fAllHits.detectorID"]
+    offsets, detector = QTracker.flatten_jagged(detectorid)
+    element = QTracker.flatten_jagged(branches["fAllHits.elementID"])[1]
+    drift = QTracker.flatten_jagged(branches["fAllHits.driftDistance"])[1]
+    tdc = QTracker.flatten_jagged(branches["fAllHits.tdcTime"])[1]
+    n_events = len(detectorid)
+
+    def hit_matrix():
+        selected = np.empty(len(detector), dtype=np.int64)
+        counts = np.zeros(n_events, dtype=np.int64)
+        QTracker.hit_matrix(offsets, detector, element, drift, tdc, window_lo, window_hi, selected, counts)
+    results['hit_matrix'] = time_case(hit_matrix, args.repeat, n_events)
+
+    # declusterize works on the hits that passed the timing cuts
+    hits = QTracker.timing_cut_hits(detectorid, branches["fAllHits.elementID"], branches["fAllHits.driftDistance"],
+                                    branches["fAllHits.tdcTime"])
+    results['declusterize'] = time_case(lambda: QTracker.decluster(hits), args.repeat, n_events)
+
+    hits = hits.compress(QTracker.decluster(hits))
+    inputs = hits.to_dense()
+    max_ele = np.array([200, 200, 168, 168, 200, 200, 128, 128, 112, 112, 128, 128, 134, 134, 112, 112, 134, 134,
+                        20, 20, 16, 16, 16, 16, 16, 16, 72, 72, 72, 72, 72, 72, 72, 72] * 2)
+    finder_predictions = np.round(QTracker.models.get('Track_Finder_All').predict(inputs, verbose=0) * max_ele).astype(int)
+    results['evaluate_finder'] = time_case(lambda: QTracker.finder_tracks(hits, finder_predictions),
+                                           args.repeat, n_events)
+
+    # Dimuon momenta around the J/psi region, in the (px, py, pz) x 2 layout of the z_mom column
+    rng = np.random.default_rng(args.seed)
+    mom = np.column_stack((rng.normal(2, 0.6, n_events), rng.normal(0, 1.2, n_events), rng.normal(35, 10, n_events),
+                           rng.normal(-2, 0.6, n_events), rng.normal(0, 1.2, n_events), rng.normal(35, 10, n_events)))
+    results['calcVariables'] = time_case(lambda: calc.calcVariables(mom), args.repeat, n_events)
+    results['kinematics mass only'] = time_case(lambda: calc.kinematics(mom, ('mass',)), args.repeat, n_events)
+
+    # The GUI's accumulated mass and vertex histograms with the binning of histograms.json. Every
+    # iteration adds the events as a new file, over two runs, including saving the state.
+    mass = calc.calcVariables(mom)[0]
+    vertex = rng.normal([0, 0, -300], [10, 10, 300], (n_events, 3))
+    values = {'mass': mass, 'vtx': vertex[:, 0], 'vty': vertex[:, 1], 'vtz': vertex[:, 2]}
+    run_ids = np.repeat([1, 2], [n_events // 2, n_events - n_events // 2])
+    histograms = HistogramAccumulator(os.path.join(workdir, 'histogram_state.json'))
+    results['histogram binning'] = time_case(
+        lambda: [histograms.binning[name].count(quantity) for name, quantity in values.items()], args.repeat, n_events)
+    added = iter(range(args.repeat + 1))
+    results['histogramming'] = time_case(lambda: histograms.add_file(f'file_{next(added)}.root', run_ids, values),
+                                         args.repeat, n_events)
+
+    # Every network through the compiled inference layer against plain Keras predict with the batch
+    # sizes QTracker used before, on inputs of the network's shape. At most 4096 events, the event
+    # filter input alone is 43 KB per event
+    n_inference = min(n_events, 4096)
+    keras_models = ModelRegistry(QTracker.models.networks_dir, compiled=False)
+    for name in QTracker.models.available():
+        softmax = name == 'event_filter'
+        compiled = QTracker.models.get(name, softmax)
+        inputs = rng.random((n_inference,) + tuple(compiled.input_shape[1:]), dtype=np.float32)
+        keras = keras_models.get(name, softmax)
+        results['predict ' + name + ' keras'] = time_case(
+            lambda: keras.predict(inputs, batch_size=KERAS_BATCH_SIZES.get(name), verbose=0), args.repeat, n_inference)
+        results['predict ' + name] = time_case(lambda: compiled.predict(inputs), args.repeat, n_inference)
+    print(QTracker.models.inference_report())
+
+    # The full pipeline: read, hit matrices, event filter, tracker graph and save
+    QTracker.timer.reset()
+    results['tracker'] = time_case(lambda: QTracker.stream(raw_file, use_cache=False), args.repeat, n_events)
+    results['tracker']['stages'] = QTracker.timer.stats
+
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {'events': args.events, 'hits_per_event': args.hits, 'spills': args.spills, 'seed': args.seed,
+                   'repeat': args.repeat, 'raw_hits': int(len(detector)), 'hits_after_cuts': int(len(hits.detector))},
+        'environment': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'numba': __import__('numba').__version__, 'cpu_count': os.cpu_count(),
+                        'machine': platform.machine()},
+        'results': results,
+    }
+
+
+def compare(baseline, current):
+    # Ratio of best times, > 1 means the current run is slower
+    lines = [f"{'case':<36}{'baseline s':>12}{'current s':>12}{'ratio':>8}"]
+    for name, entry in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['min_seconds']
+        after = entry['min_seconds']
+        lines.append(f"{name:<36}{before:>12.4f}{after:>12.4f}{after / max(before, 1e-12):>8.2f}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the QTracker pipeline on synthetic data")
+    parser.add_argument('--events', type=int, default=10000, help="events in the synthetic raw file")
+    parser.add_argument('--hits', type=float, default=150, help="mean raw hits per event")
+    parser.add_argument('--spills', type=int, default=10, help="spills the events are spread over")
+    parser.add_argument('--repeat', type=int, default=3, help="timed iterations per case after the first")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file for the results")
+    parser.add_argument('--compare', default=None, help="earlier results JSON to compare against")
+    parser.add_argument('--keep', action='store_true', help="keep the scratch directory with the generated files")
+    args = parser.parse_args(argv)
+    args.output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        # Loaded up front, the baseline may be the file this run overwrites
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    workdir = tempfile.mkdtemp(prefix='qtracker_bench_')
+    cwd = os.getcwd()
+    try:
+        results = run(args, workdir)
+    finally:
+        os.chdir(cwd)
+        if args.keep:
+            print(f"Generated files kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=1)
+    print(f"{'case':<36}{'min s':>10}{'median s':>10}{'compile s':>10}{'events/s':>12}")
+    for name, entry in results['results'].items():
+        print(f"{name:<36}{entry['min_seconds']:>10.4f}{entry['median_seconds']:>10.4f}"
+              f"{entry['compile_seconds']:>10.2f}{entry['events_per_second']:>12.1f}")
+    print(f"Results written to {args.output}")
+    if baseline is not None:
+        print(compare(baseline, results))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
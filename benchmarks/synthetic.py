@@ -0,0 +1,148 @@
+# Synthetic SpinQuest-like inputs for the benchmarks
+# write_root_file makes a raw file with the same save tree branches QTracker reads, and
+# make_networks saves small stand-in Keras models with the input and output shapes of the real
+# networks, so the whole pipeline runs without Networks/.
+
+import os
+import numpy as np
+import awkward as ak
+import uproot
+import tensorflow as tf
+
+N_DETECTORS = 54
+N_ELEMENTS = 201
+BASKET_BYTES = 32000
+
+
+def synthetic_hits(n_events, hits_per_event, rng, windows=None, cluster_fraction=0.1):
+    # Flat hit arrays and per-event counts. Hit multiplicities are Poisson around hits_per_event.
+    # windows is QTracker's (lo, hi) TDC window table; most hits are put inside their detector's
+    # window so the timing cuts keep a realistic share. A cluster_fraction of hits get a neighbour
+    # on the next element with a close TDC time, which declusterize has to remove.
+    counts = rng.poisson(hits_per_event, n_events)
+    n_hits = int(counts.sum())
+    detector = rng.integers(1, N_DETECTORS + 1, n_hits)
+    element = rng.integers(1, N_ELEMENTS, n_hits)
+    drift = rng.random(n_hits)
+    tdc = rng.uniform(500, 1900, n_hits)
+    if windows is not None:
+        lo, hi = windows
+        lo = np.where(np.isfinite(lo), lo, 500)[detector - 1]
+        hi = np.where(np.isfinite(hi), hi, 1900)[detector - 1]
+        inside = rng.random(n_hits) < 0.9
+        tdc[inside] = rng.uniform(lo[inside], np.maximum(hi[inside], lo[inside] + 1))
+
+    # Neighbouring hits are added right after their partner, in the same event
+    partner = rng.random(n_hits) < cluster_fraction
+    repeat = np.where(partner, 2, 1)
+    source = np.repeat(np.arange(n_hits), repeat)
+    event_counts = np.bincount(np.repeat(np.arange(n_events), counts)[source], minlength=n_events)
+    neighbour = np.zeros(len(source), dtype=bool)
+    neighbour[1:] = source[1:] == source[:-1]
+    detector = detector[source]
+    element = np.minimum(element[source] + neighbour, N_ELEMENTS - 1)
+    drift = drift[source]
+    tdc = tdc[source] + neighbour * rng.uniform(-3, 3, len(source))
+    return event_counts, detector, element, drift, tdc
+
+
+# uproot names a fixed-size array branch after its dimensions, e.g. fIntensity[33][33] for a branch
+# fIntensity[33] of 33 floats. In SpinQuest files the dimensions are only in the branch name, as
+# ROOT writes split object members. The leaves of these branches are laid out as if they were
+# scalars, so their titles carry the dimension once and uproot reads them back as (33,) arrays.
+def keep_branch_names(tree, names):
+    cascading = tree._cascading
+    branches = [datum for datum in cascading._branch_data if datum['fName'] in names]
+    if len(branches) != len(names):
+        raise RuntimeError("uproot's tree writer changed, the fixed-size branches cannot be named")
+    for datum in branches:
+        datum['fTitle'] = datum['fName'] + '/' + datum['fTitle'].rsplit('/', 1)[1]
+    build_out = cascading._build_out
+
+    def scalar_layout():
+        shapes = [datum['shape'] for datum in branches]
+        for datum in branches:
+            datum['shape'] = ()
+        try:
+            return build_out()
+        finally:
+            for datum, shape in zip(branches, shapes):
+                datum['shape'] = shape
+
+    cascading._build_out = scalar_layout
+    # mktree has written the metadata already; the first extend writes it again in the new layout
+    cascading._needs_relocation_before_extend = True
+
+
+def write_root_file(path, n_events=10000, hits_per_event=150, n_spills=10, seed=0, windows=None):
+    # A TTree named save like the raw SpinQuest files: the hit branches are jagged and share the
+    # fAllHits_ counter, as the members of the fAllHits TClonesArray do
+    rng = np.random.default_rng(seed)
+    counts, detector, element, drift, tdc = synthetic_hits(n_events, hits_per_event, rng, windows)
+
+    def jagged(content):
+        return ak.unflatten(content, counts)
+
+    spill = np.arange(n_events) * n_spills // max(n_events, 1)
+    data = {
+        'fAllHits.detectorID': jagged(detector.astype(np.int32)),
+        'fAllHits.elementID': jagged(element.astype(np.int32)),
+        'fAllHits.driftDistance': jagged(drift.astype(np.float32)),
+        'fAllHits.tdcTime': jagged(tdc.astype(np.float32)),
+        'fRunID': np.full(n_events, 6000, dtype=np.int32),
+        'fEventID': np.arange(n_events, dtype=np.int32),
+        'fSpillID': (spill + 1000).astype(np.int32),
+        'fTriggerBits': np.ones(n_events, dtype=np.int32),
+        'fTargetPos': rng.integers(1, 4, n_events).astype(np.int32),
+        'fTurnID': rng.integers(0, 370000, n_events).astype(np.int32),
+        'fRFID': rng.integers(0, 588, n_events).astype(np.int32),
+        'fIntensity[33]': rng.random((n_events, 33)).astype(np.float32),
+        'fNRoads[4]': rng.integers(0, 10, (n_events, 4)).astype(np.int16),
+        'fNHits[55]': rng.integers(0, 50, (n_events, 55)).astype(np.int16),
+    }
+    types = {name: ('var * ' + str(values.type.content.content) if name.startswith('fAllHits.') else
+                    np.dtype((values.dtype, values.shape[1:]))) for name, values in data.items()}
+    with uproot.recreate(path) as root_file:
+        tree = root_file.mktree('save', types, counter_name=lambda name: name.split('.')[0] + '_')
+        keep_branch_names(tree, [name for name in data if name.endswith(']')])
+        # One extend per basket, with about ROOT's default 32 kB of hits per basket
+        step = max(1, int(BASKET_BYTES // (4 * max(hits_per_event, 1))))
+        for start in range(0, n_events, step):
+            tree.extend({name: values[start:start + step] for name, values in data.items()})
+    return path
+
+
+def dense_model(input_shape, outputs, activation=None, bias=None, seed=0):
+    # One Dense layer on the flattened input; the weights are small so the outputs stay in range
+    initializer = tf.keras.initializers.RandomNormal(stddev=0.01, seed=seed)
+    bias_initializer = tf.keras.initializers.Constant(bias) if bias is not None else 'zeros'
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=input_shape),
+        tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(outputs, activation=activation, kernel_initializer=initializer,
+                              bias_initializer=bias_initializer),
+    ])
+    return model
+
+
+def make_networks(networks_dir):
+    # Stand-ins for every network QTracker loads, saved as SavedModel directories like Networks/.
+    # The event filter's dimuon logit is biased so that every event passes its cut and the
+    # tracker sees the whole file.
+    os.makedirs(networks_dir, exist_ok=True)
+    dimuon_bias = [0, 0, 0, 5.0, 0, 0]
+    models = {
+        'event_filter': dense_model((N_DETECTORS, N_ELEMENTS), 6, bias=dimuon_bias),
+        'Track_Finder_All': dense_model((N_DETECTORS, N_ELEMENTS), 68, 'tanh', seed=1),
+        'Track_Finder_Z': dense_model((N_DETECTORS, N_ELEMENTS), 68, 'tanh', seed=2),
+        'Track_Finder_Target': dense_model((N_DETECTORS, N_ELEMENTS), 68, 'tanh', seed=3),
+        'Reconstruction_All': dense_model((68, 2), 6, seed=4),
+        'Reconstruction_Z': dense_model((68, 2), 6, seed=5),
+        'Reconstruction_Target': dense_model((68, 2), 6, seed=6),
+        'Vertexing_All': dense_model((71, 2), 3, seed=7),
+        'Vertexing_Z': dense_model((71, 2), 3, seed=8),
+        'target_dump_filter': dense_model((24,), 2, 'softmax', seed=9),
+    }
+    for name, model in models.items():
+        model.save(os.path.join(networks_dir, name))
+    return networks_dir
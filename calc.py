@@ -1,11 +1,7 @@
 import os
 import numpy as np
 import numba
-import matplotlib.pyplot as plt
-from scipy.optimize import curve_fit
 from numba import prange
-import glob
-import sys
 
 
 
@@ -32,42 +28,67 @@ def boost(vector, boost_v):
     
     return vector
 
+# Dimuon kinematics, in the order calcVariables returns them
+KINEMATICS = ('mass', 'pT', 'x1', 'x2', 'xF', 'costheta', 'sintheta', 'phi')
+
 @numba.njit(parallel=True)
-def calcVariables(mom):
+def kinematics_kernel(mom, slots, out):
+    # mom is (N, 6): px, py, pz of mu+ then mu-. slots[k] is the row of out for KINEMATICS[k],
+    # or -1 if that variable is not wanted. Everything is scalar arithmetic, nothing is allocated per event.
     mmu = 0.10566
     mp = 0.938
     ebeam = 120.0
-    p_beam = np.array([0.0, 0.0, np.sqrt(ebeam * ebeam - mp * mp), ebeam])
-    p_target = np.array([0.0, 0.0, 0.0, mp])
-    p_cms = p_beam + p_target
-    s = lorentz_dot(p_cms, p_cms)
-    mass = np.zeros((len(mom)))
-    pT = np.zeros((len(mom)))
-    x1 = np.zeros((len(mom)))
-    x2 = np.zeros((len(mom)))
-    xF = np.zeros((len(mom)))
-    costheta = np.zeros((len(mom)))
-    sintheta = np.zeros((len(mom)))
-    phi = np.zeros((len(mom)))
-    for i in prange(len(mom)):
-        momentum = mom[i]
-        E_pos = np.sqrt(momentum[0] * momentum[0] + momentum[1] * momentum[1] + momentum[2] * momentum[2] + mmu * mmu)
-        p_pos = np.array([momentum[0], momentum[1], momentum[2], E_pos])
-        E_neg = np.sqrt(momentum[3] * momentum[3] + momentum[4] * momentum[4] + momentum[5] * momentum[5] + mmu * mmu)
-        p_neg = np.array([momentum[3], momentum[4], momentum[5], E_neg])
+    pz_beam = np.sqrt(ebeam * ebeam - mp * mp)
+    # p_cms = p_beam + p_target = (0, 0, pz_beam, ebeam + mp)
+    s = (ebeam + mp) * (ebeam + mp) - pz_beam * pz_beam
+    target_cms = mp * (ebeam + mp)
+    beam_cms = ebeam * (ebeam + mp) - pz_beam * pz_beam
+    for i in prange(mom.shape[0]):
+        px1 = mom[i, 0]
+        py1 = mom[i, 1]
+        pz1 = mom[i, 2]
+        px2 = mom[i, 3]
+        py2 = mom[i, 4]
+        pz2 = mom[i, 5]
+        e1 = np.sqrt(px1 * px1 + py1 * py1 + pz1 * pz1 + mmu * mmu)
+        e2 = np.sqrt(px2 * px2 + py2 * py2 + pz2 * pz2 + mmu * mmu)
+        px = px1 + px2
+        py = py1 + py2
+        pz = pz1 + pz2
+        e = e1 + e2
 
-        p_sum = p_pos + p_neg
+        mass = np.sqrt(e * e - px * px - py * py - pz * pz)
+        pt2 = px * px + py * py
+        if slots[0] >= 0:
+            out[slots[0], i] = mass
+        if slots[1] >= 0:
+            out[slots[1], i] = np.sqrt(pt2)
+        if slots[2] >= 0:
+            out[slots[2], i] = mp * e / target_cms
+        if slots[3] >= 0:
+            out[slots[3], i] = (ebeam * e - pz_beam * pz) / beam_cms
+        if slots[4] >= 0:
+            out[slots[4], i] = 2.0 * pz / np.sqrt(s) / (1.0 - mass * mass / s)
+        if slots[5] >= 0 or slots[6] >= 0:
+            costheta = 2.0 * (e2 * pz1 - e1 * pz2) / mass / np.sqrt(mass * mass + pt2)
+            if slots[5] >= 0:
+                out[slots[5], i] = costheta
+            if slots[6] >= 0:
+                out[slots[6], i] = np.sqrt(1 - costheta * costheta)
+        if slots[7] >= 0:
+            out[slots[7], i] = np.arctan2(2.0 * np.sqrt(mass * mass + pt2) * (px2 * py1 - px1 * py2),
+                                          mass * (px1 * px1 - px2 * px2 + py1 * py1 - py2 * py2))
 
-        mass[i] = np.sqrt(lorentz_dot(p_sum, p_sum))
-        pT[i] = np.sqrt(p_sum[0]**2 + p_sum[1]**2)
-
-        x1[i] = lorentz_dot(p_target, p_sum) / lorentz_dot(p_target, p_cms)
-        x2[i] = lorentz_dot(p_beam, p_sum) / lorentz_dot(p_beam, p_cms)
-        
-        costheta[i] = 2.0 * (p_neg[3] * p_pos[2] - p_pos[3] * p_neg[2]) / mass[i] / np.sqrt(mass[i] * mass[i] + pT[i] * pT[i])
-        xF[i] = 2.0 * p_sum[2] / np.sqrt(s) / (1.0 - mass[i] * mass[i] / s)
-        phi[i] = np.arctan2(2.0 * np.sqrt(mass[i] * mass[i] + pT[i] * pT[i]) * (p_neg[0] * p_pos[1] - p_pos[0] * p_neg[1]), 
-                            mass[i] * (p_pos[0] * p_pos[0] - p_neg[0] * p_neg[0] + p_pos[1] * p_pos[1] - p_neg[1] * p_neg[1]))
-        sintheta[i] = np.sqrt(1 - costheta[i]**2)
-    return mass, pT, x1, x2, xF, costheta, sintheta, phi
+def kinematics(mom, outputs=KINEMATICS):
+    # Only the requested variables are computed; returns a dict name -> (N,) array
+    slots = np.full(len(KINEMATICS), -1, dtype=np.int64)
+    for row, name in enumerate(outputs):
+        slots[KINEMATICS.index(name)] = row
+    out = np.empty((len(outputs), len(mom)))
+    kinematics_kernel(np.ascontiguousarray(mom, dtype=np.float64), slots, out)
+    return {name: out[row] for row, name in enumerate(outputs)}
 
+def calcVariables(mom):
+    # mass, pT, x1, x2, xF, costheta, sintheta, phi
+    results = kinematics(mom)
+    return tuple(results[name] for name in KINEMATICS)
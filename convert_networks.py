@@ -0,0 +1,103 @@
+# One-time conversion of the QTracker networks for the TensorFlow-free inference backends
+# Usage: python convert_networks.py --backend onnx [--networks Networks]
+#        python convert_networks.py --backend tflite --check-only
+# Every SavedModel in Networks/ is converted to Networks_<backend>/<name>.onnx or .tflite and its
+# outputs are compared with TensorFlow's on sample inputs. The manifest written next to the files
+# records the result; QTracker only loads conversions that passed and match the current SavedModel.
+# Needs TensorFlow plus tf2onnx and onnxruntime (onnx) or tflite-runtime (tflite); QTracker itself
+# then runs with QTRACKER_BACKEND=onnx or tflite, or batch_reconstruct.py --backend.
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+import Backends
+from ModelRegistry import ModelRegistry
+
+
+def sample_inputs(shape, n_samples, rng):
+    # Hit matrices are sparse 0/1 cubes, everything else takes normalised values
+    if len(shape) == 3:
+        inputs = (rng.random((n_samples,) + tuple(shape[1:])) < 0.015).astype(np.float32)
+    else:
+        inputs = rng.normal(size=(n_samples,) + tuple(shape[1:])).astype(np.float32)
+    inputs[0] = 0
+    return inputs
+
+
+def convert(model, backend, path):
+    import tensorflow as tf
+    shape = model.input_shape[0] if isinstance(model.input_shape, list) else model.input_shape
+    if backend == 'onnx':
+        import tf2onnx
+        signature = (tf.TensorSpec((None,) + tuple(shape[1:]), tf.float32, name='input'),)
+        tf2onnx.convert.from_keras(model, input_signature=signature, opset=13, output_path=path)
+    else:
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        with open(path, 'wb') as model_file:
+            model_file.write(converter.convert())
+    return shape
+
+
+def check(model, backend, path, shape, n_samples, rtol, atol, rng):
+    # Largest deviation from TensorFlow on the sample inputs, and whether it is within tolerance
+    inputs = sample_inputs(shape, n_samples, rng)
+    reference = model.predict(inputs, batch_size=1024, verbose=0)
+    converted = (Backends.OnnxModel if backend == 'onnx' else Backends.TFLiteModel)(path).predict(inputs, batch_size=1024)
+    difference = np.abs(converted - reference)
+    return {'passed': bool(np.all(difference <= atol + rtol * np.abs(reference))), 'max_abs_diff': float(difference.max()),
+            'samples': n_samples, 'rtol': rtol, 'atol': atol}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert the QTracker networks for ONNX Runtime or TFLite")
+    parser.add_argument('--backend', choices=('onnx', 'tflite'), required=True)
+    parser.add_argument('--networks', default='Networks', help="directory of the SavedModels")
+    parser.add_argument('--samples', type=int, default=2048, help="sample inputs per network for the output check")
+    parser.add_argument('--rtol', type=float, default=1e-4)
+    parser.add_argument('--atol', type=float, default=1e-4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check-only', action='store_true', help="only re-check the existing conversions")
+    args = parser.parse_args(argv)
+
+    import tensorflow as tf
+    registry = ModelRegistry(args.networks)
+    names = registry.available()
+    if not names:
+        print(f"No networks found in {args.networks}")
+        return 1
+    directory = Backends.converted_dir(args.networks, args.backend)
+    os.makedirs(directory, exist_ok=True)
+    manifest = Backends.read_manifest(directory)
+    rng = np.random.default_rng(args.seed)
+
+    n_failed = 0
+    for name in names:
+        path = os.path.join(directory, name + Backends.EXTENSIONS[args.backend])
+        # The raw network: the event filter's softmax is applied by the backend models
+        model = tf.keras.models.load_model(os.path.join(args.networks, name))
+        start = time.perf_counter()
+        if args.check_only:
+            if name not in manifest or not os.path.exists(path):
+                print(f"{name:<24}not converted")
+                n_failed += 1
+                continue
+            shape = model.input_shape[0] if isinstance(model.input_shape, list) else model.input_shape
+        else:
+            shape = convert(model, args.backend, path)
+        result = check(model, args.backend, path, shape, args.samples, args.rtol, args.atol, rng)
+        manifest[name] = {'fingerprint': registry.model_fingerprint(name), 'check': result,
+                          'converted': manifest.get(name, {}).get('converted') if args.check_only else time.strftime('%Y-%m-%dT%H:%M:%S')}
+        Backends.write_manifest(directory, manifest)
+        n_failed += not result['passed']
+        print(f"{name:<24}{'ok' if result['passed'] else 'MISMATCH':<10}max abs diff {result['max_abs_diff']:.3g}"
+              f"  {time.perf_counter() - start:.1f} s")
+
+    print(f"{len(names) - n_failed}/{len(names)} networks usable with the {args.backend} backend, written to {directory}")
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,9 @@
 # Native Package | sys
 import sys
 
+# Native Package | concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+
 # External Packages | NumPy
 import numpy as np
 
@@ -9,56 +12,68 @@ import numpy as np
 import pyqtgraph as pg
 
 class HitDisplay:
-    def __init__(self):
-        #elemid =np.where(hits==True)[1]
-        #detid = np.where(hits==True)[0]
-        elemid = None
-        detid = None
-        
-        
-        
-        
-
-    def getOcc(self,hits,selectedEvents, eventID,ith_event):
-        eventIndex = np.where(selectedEvents[ith_event] == eventID)[0]
-        Hodo = np.zeros(16)
-
-        DC = np.zeros(30)
-
-        propTube = np.zeros(7)
-
-        hitmatrix = np.vstack((np.where(hits[eventIndex]==True)[1],np.where(hits[eventIndex]==True)[2])).T
-        #shift detector from 0 to 1
-        hitmatrix[:,0] = hitmatrix[:,0]+1
-
-        for i in range(1,7):
-            index = hitmatrix[hitmatrix[:,0] == i]
-            DC[i] = len(index)
-
+    # Draws one event at a time into a persistent set of scatter items. The items, pens and brushes
+    # are made once and every new event only replaces their data with setData.
+    PREFETCH = 32  # events ahead whose coordinates are prepared in the background
+
+    def __init__(self, plot_widget=None):
+        self.scatter_raw = pg.ScatterPlotItem(pen=pg.mkPen(None), symbol='o', size=10, brush=pg.mkBrush(128, 128, 128, 50))
+        self.scatter_cluster = pg.ScatterPlotItem(pen=pg.mkPen(None), symbol='o', size=10, brush=pg.mkBrush(255, 255, 255, 80))
+        self.scatter_mup = pg.ScatterPlotItem(pen=pg.mkPen(None), symbol='s', size=10, brush=pg.mkBrush(255, 0, 0, 120))
+        self.scatter_mum = pg.ScatterPlotItem(pen=pg.mkPen(None), symbol='s', size=10, brush=pg.mkBrush(0, 255, 0, 120))
+        if plot_widget is not None:
+            for item in self.items():
+                plot_widget.addItem(item)
+
+        # row -> future of the event's coordinates, for the event index they were made from
+        self.prefetcher = ThreadPoolExecutor(max_workers=1)
+        self.frames = {}
+        self.frames_index = None
+
+    def items(self):
+        return self.scatter_raw, self.scatter_cluster, self.scatter_mup, self.scatter_mum
+
+    @staticmethod
+    def frame(index, row):
+        # Contiguous copies of one event's coordinates, ready for setData
+        (mup_x, mup_y), (mum_x, mum_y) = index.tracks(row)
+        return tuple(np.ascontiguousarray(array) for array in
+                     index.raw(row) + index.declustered(row) + (mup_x, mup_y, mum_x, mum_y))
+
+    def prefetch(self, index, rows):
+        # Prepare the coordinates of the upcoming rows on a background thread
+        if index is not self.frames_index:
+            self.frames = {}
+            self.frames_index = index
+        wanted = set(int(row) for row in rows[:self.PREFETCH])
+        for row in list(self.frames):
+            if row not in wanted:
+                del self.frames[row]
+        for row in wanted:
+            if row not in self.frames:
+                self.frames[row] = self.prefetcher.submit(self.frame, index, row)
+
+    def draw(self, index, row, upcoming=()):
+        # index is the file's EventIndex and row the event's row in it, see EventIndex.row().
+        # upcoming are the rows likely to be drawn next.
+        future = self.frames.get(int(row)) if index is self.frames_index else None
+        frame = future.result() if future is not None else self.frame(index, row)
+        raw_x, raw_y, cluster_x, cluster_y, mup_x, mup_y, mum_x, mum_y = frame
+        self.scatter_raw.setData(raw_x, raw_y)
+        self.scatter_cluster.setData(cluster_x, cluster_y)
+        self.scatter_mup.setData(mup_x, mup_y)
+        self.scatter_mum.setData(mum_x, mum_y)
+        self.prefetch(index, upcoming)
+
+    def getOcc(self,event_index,row):
+        # Hits per detectorID of one event in a single bincount over its declustered hits
+        detectorid = event_index.declustered(row)[0].astype(int)
+        per_detector = np.bincount(detectorid, minlength=55)[1:55]
+
+        DC = per_detector[0:30]  # drift chambers, detectorIDs 1-30
+        Hodo = per_detector[30:46]  # hodoscopes, 31-46
+        propTube = per_detector[46:54]  # proportional tubes, 47-54
 
-        for i in range(12,17):
-            index = hitmatrix[hitmatrix[:,0] == i]
-            DC[i-6] = len(index)
-        
-        for i in range(18,23):
-            index = hitmatrix[hitmatrix[:,0] == i]
-            DC[i-6] = len(index)
-        for i in range(24,29):
-            index = hitmatrix[hitmatrix[:,0] == i]
-            DC[i-6] = len(index)
-        
-        
-
-        for i in range(30,46):
-            Hodo[30-i] = len(hitmatrix[(hitmatrix[:,0]==i)])
-            
-        for i in range(46,54):
-            propTube[46-i] = len(hitmatrix[(hitmatrix[:,0]==i)])
-            
-
-
-        
-        
         return(DC, Hodo, propTube)
 
 
@@ -69,51 +84,6 @@ class HitDisplay:
     
 
 
-    def Raw_Hit(self, elementid, detectorid, selectedEvents, sid, eventID,ith_event):
-        eventIndex = np.where(selectedEvents[ith_event] == eventID)[0]
- 
-        # Create a scatter plot item
-        scatter = pg.ScatterPlotItem(detectorid[eventIndex][0],elementid[eventIndex][0], pen=pg.mkPen(None), symbol='o', size=10, brush=pg.mkBrush(128, 128, 128, 50))
-        return scatter
-    def Cluster_Hit(self,hits, selectedEvents, sid, eventID,ith_event):
-        eventIndex = np.where(selectedEvents[ith_event] == eventID)[0]
-        cluster = np.vstack((np.where(hits[eventIndex]==True)[1],np.where(hits[eventIndex]==True)[2])).T
-        #shift detector from 0 to 1
-        cluster[:,0] = cluster[:,0]+1
-        # detectorid = np.arange(0,55)
-        # print(elementID)
-        
-        # # Create a scatter plot item
-        scatter = pg.ScatterPlotItem(cluster[:,0],cluster[:,1], pen=pg.mkPen(None), symbol='o', size=10, brush=pg.mkBrush(255, 255, 255, 80))
-        return scatter
-    def Track_Hits(self,selectedEvents,sid,eventID,track, ith_event):
-
-        elementid_mup = track[ith_event][:34,0]
-        elementid_mum = track[ith_event][34:,0]
-        st1 = np.arange(1,7)
-        st2 = np.arange(13,19)
-        st3m = np.arange(19,25)
-        st3p = np.arange(25,31)
-        hodo = np.arange(31,39) 
-        prop = np.arange(47,55)
-        if elementid_mup[13] > 0:
-            detectorid_mup = np.concatenate((st1,st2,st3p,hodo,prop))
-        else:
-            detectorid_mup = np.concatenate((st1,st2,st3m,hodo,prop))
-
-        if elementid_mum[13] > 0:
-            detectorid_mum = np.concatenate((st1,st2,st3p,hodo,prop))
-        else:
-            detectorid_mum = np.concatenate((st1,st2,st3m,hodo,prop))
-
-        elementid_mup = np.abs(elementid_mup)
-        elementid_mum = np.abs(elementid_mum)
-
-        scatter_mup = pg.ScatterPlotItem(detectorid_mup,elementid_mup, pen=pg.mkPen(None), symbol='s', size=10, brush=pg.mkBrush(255, 0, 0, 120))
-        scatter_mum = pg.ScatterPlotItem(detectorid_mum,elementid_mum, pen=pg.mkPen(None), symbol='s', size=10, brush=pg.mkBrush(0, 255, 0, 120))
-
-        return scatter_mup, scatter_mum
-
         
 # import time
 # from DataOrganizer import dataOrganizer
@@ -3,14 +3,21 @@
 # Jay
 
 import sys
-from PyQt5.QtWidgets import QApplication, QMainWindow, QVBoxLayout, QWidget, QTabWidget
-from PyQt5.QtCore import QTimer
-from DataOrganizer import DataOrganizer
+import time
+from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout, QWidget, QTabWidget, QProgressBar,
+                             QPushButton, QSlider, QSpinBox, QLabel, QComboBox)
+from PyQt5.QtCore import QTimer, Qt
+from ReconstructionWorker import ReconstructionWorker
+from Ingestion import IngestionQueue
 from hitDisplay import HitDisplay
+from MetricsPanel import MetricsPanel
+from OccupancyPanel import OccupancyPanel
+from QTracker import QTracker
+from Histograms import HistogramAccumulator
+from MassFit import MassFitter, model_curve
+from FitWorker import FitWorker
 import pyqtgraph as pg
-import calc
 import numpy as np
-from scipy.optimize import curve_fit
 import os
 
 # Define a class for our main window that inherits from QMainWindow
@@ -37,21 +44,34 @@ class MainWindow(QMainWindow):
 
 
 
-        # Initialize DataOrganizer
-        self.organizer = DataOrganizer()
-        self.organizer.organizeData()
+        # Progress of the reconstruction running in the background
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.statusBar().addPermanentWidget(self.progress_bar)
+
+        # The DataOrganizer is filled by the background worker, the plots wait for its first result
+        self.organizer = None
+        self.ingestion = IngestionQueue('raw')
+        self.worker = ReconstructionWorker(self)
+        self.worker.progress.connect(self.reconstruction_progress)
+        self.worker.reconstructed.connect(self.reconstruction_finished)
+        self.worker.failed.connect(self.reconstruction_failed)
+        self.worker.finished.connect(self.reconstruction_thread_done)
 
         # Create and add the scatter plot tab
         self.plot_tab()
+        # Whole-file detector occupancy, summed over every reconstructed file as it arrives
+        self.tabs.addTab(OccupancyPanel("reconstructed"), "Occupancy")
+        # Stage timings of the reconstruction and of the redraws below, also logged as JSON lines
+        QTracker.timer.log_to(os.path.join('logs', 'pipeline_metrics.jsonl'))
+        self.tabs.addTab(MetricsPanel(QTracker.timer), "Metrics")
 
-        
         # Setup a timer to check for new files repeatedly
+        # A file is queued once it stopped growing, and every file is processed once
+        self.check_new_files()
         self.file_check_timer = QTimer(self)
-        self.file_check_timer.timeout.connect(lambda: self.check_new_files('raw'))
-        self.file_check_timer.start(40000)  # Check for new files every 40 seconds
-
-        # Initialize seen files set
-        self.seen_files = set(os.listdir('raw'))
+        self.file_check_timer.timeout.connect(self.check_new_files)
+        self.file_check_timer.start(5000)  # Check for new files every 5 seconds
 
     def plot_tab(self):
         plot_tab = QWidget()
@@ -63,6 +83,10 @@ class MainWindow(QMainWindow):
         self.plot_widget_2 = pg.PlotWidget()
 
         plot_layout.addWidget(self.plot_widget_1)
+        # Persistent hit display items, only their data changes from event to event
+        self.hit_view = HitDisplay(self.plot_widget_1)
+        self.plot_widget_1.setYRange(0, 201)
+        plot_layout.addLayout(self.playback_controls())
         plot_layout.addWidget(self.plot_widget_2)
         
         self.plot_widget_vtx = pg.PlotWidget()
@@ -73,111 +97,222 @@ class MainWindow(QMainWindow):
         plot_layout.addWidget(self.plot_widget_vty)
         plot_layout.addWidget(self.plot_widget_vtz)
 
-        # Setup a timer to call hit_display repeatedly
+        # Mass and vertex histograms are accumulated over files with fixed binning and kept across restarts.
+        # Their plot items are made once here; a new file only updates their data.
+        self.histograms = HistogramAccumulator('histogram_state.json')
+        self.current_run = max(self.histograms.runs) if self.histograms.runs else None
+        self.histogram_view = QComboBox()
+        self.histogram_view.addItem("Current run", 'run')
+        self.histogram_view.addItem(f"Last {self.histograms.window.maxlen} files", 'rolling')
+        self.histogram_view.addItem("All files", 'total')
+        self.histogram_view.currentIndexChanged.connect(self.redraw_histograms)
+        plot_layout.addWidget(self.histogram_view)
+        self.histogram_items = {}
+        for name, widget, brush in (('mass', self.plot_widget_2, 'b'), ('vtx', self.plot_widget_vtx, 'r'),
+                                    ('vty', self.plot_widget_vty, 'g'), ('vtz', self.plot_widget_vtz, 'b')):
+            self.histogram_items[name] = pg.PlotDataItem(stepMode="center", fillLevel=0, brush=brush)
+            widget.addItem(self.histogram_items[name])
+            widget.setLabel('bottom', self.histograms.binning[name].label)
+        self.mass_plot_decorations()
+
+        # J/psi fits run in a worker: the displayed histogram is fitted for the curve on the mass plot,
+        # every file on its own for the drift of the fitted mean and width, logged to logs/mass_fits.jsonl
+        self.fit_item = pg.PlotDataItem(pen=pg.mkPen('y', width=2))
+        self.plot_widget_2.addItem(self.fit_item)
+        drift_layout = QHBoxLayout()
+        self.drift_items = {}
+        for name, title in (('mean', 'J/psi mean (GeV)'), ('sigma', 'J/psi width (GeV)')):
+            widget = pg.PlotWidget()
+            widget.setLabel('bottom', 'file')
+            widget.setLabel('left', title)
+            points = pg.PlotDataItem(pen=None, symbol='o', symbolSize=5)
+            errors = pg.ErrorBarItem(x=np.zeros(0), y=np.zeros(0), height=np.zeros(0))
+            widget.addItem(errors)
+            widget.addItem(points)
+            self.drift_items[name] = (points, errors)
+            drift_layout.addWidget(widget)
+        plot_layout.addLayout(drift_layout)
+        self.fit_worker = FitWorker(MassFitter(os.path.join('logs', 'mass_fits.jsonl')), self)
+        self.fit_worker.fitted.connect(self.mass_fit_finished)
+        self.draw_drift()
+
+        self.redraw_histograms()
+
+        # Setup a timer to call hit_display repeatedly, started once the first file is reconstructed
         # Initialize event index
         self.ith_event = 0
+        self.playing = True
         self.timer = QTimer(self)
-        self.timer.timeout.connect(self.hit_display)
-        self.timer.start(1000)  # Call hit_display every 1000 milliseconds (1 second)
-
-        self.invariant_mass_display()
-        self.vertex_per_spill()
-
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.timeout.connect(lambda: self.timed_frame("hit display", self.hit_display))
+        # Frame times are added to the stage timer once per second, not once per frame
+        self.frame_totals = {}  # redraw name -> [frames, seconds]
+        self.frame_flush_timer = QTimer(self)
+        self.frame_flush_timer.timeout.connect(self.flush_frames)
+        self.frame_flush_timer.start(1000)
+
+    def playback_controls(self):
+        # Pause, step, seek and rate of the hit display playback
+        controls = QHBoxLayout()
+        self.play_button = QPushButton("Pause")
+        self.play_button.clicked.connect(self.toggle_playback)
+        back_button = QPushButton("<")
+        back_button.clicked.connect(lambda: self.step_event(-1))
+        forward_button = QPushButton(">")
+        forward_button.clicked.connect(lambda: self.step_event(1))
+        self.seek_slider = QSlider(Qt.Horizontal)
+        self.seek_slider.setRange(0, 0)
+        self.seek_slider.sliderMoved.connect(self.seek_event)
+        self.event_label = QLabel("event 0 / 0")
+        # Up to one event per frame of the display
+        screen = QApplication.primaryScreen()
+        max_rate = int(screen.refreshRate()) if screen is not None else 60
+        self.rate_box = QSpinBox()
+        self.rate_box.setRange(1, max(max_rate, 1))
+        self.rate_box.setValue(1)
+        self.rate_box.setSuffix(" events/s")
+        self.rate_box.valueChanged.connect(self.set_playback_rate)
+        for widget in (self.play_button, back_button, forward_button, self.seek_slider, self.event_label, self.rate_box):
+            controls.addWidget(widget)
+        return controls
+
+    def toggle_playback(self):
+        self.playing = not self.playing
+        self.play_button.setText("Pause" if self.playing else "Play")
+        if self.playing and self.organizer is not None:
+            if self.ith_event >= len(self.organizer.selectedRows):
+                self.ith_event = 0  # play again from the start
+            self.timer.start(1000 // self.rate_box.value())
+        else:
+            self.timer.stop()
+
+    def set_playback_rate(self, rate):
+        if self.timer.isActive():
+            self.timer.setInterval(1000 // rate)
+
+    def step_event(self, delta):
+        # Show the previous or next event and stay paused
+        if self.organizer is None:
+            return
+        if self.playing:
+            self.toggle_playback()
+        self.ith_event = max(self.ith_event - 1 + delta, 0)
+        self.timed_frame("hit display", self.hit_display)
 
+    def seek_event(self, position):
+        if self.organizer is None:
+            return
+        self.ith_event = position
+        self.timed_frame("hit display", self.hit_display)
 
+    def start_reconstruction(self):
+        # Only one reconstruction runs at a time, the next queued file starts when it is done
+        if self.worker.isRunning():
+            return
+        raw_file = self.ingestion.next()
+        if raw_file is None:
+            return
+        self.progress_bar.setValue(0)
+        self.statusBar().showMessage(f"Reconstructing {raw_file} ({len(self.ingestion)} more queued)")
+        self.worker.process(raw_file)
+
+    def reconstruction_progress(self, stage, fraction):
+        self.statusBar().showMessage(stage)
+        self.progress_bar.setValue(int(100 * fraction))
+
+    def reconstruction_failed(self, message):
+        print(message)
+        self.statusBar().showMessage(message)
+        self.ingestion.done('failed')
+
+    def reconstruction_thread_done(self):
+        self.start_reconstruction()
+
+    def reconstruction_finished(self, organizer):
+        # Keep showing the previous file if the new one has no dimuon candidates
+        if organizer.reco is None or len(organizer.reco) == 0:
+            self.ingestion.done('empty')
+            return
+        self.ingestion.done('done')
+        self.organizer = organizer
 
-    def check_new_files(self, directory):
-        # Current set of files in the directory
-        current_files = set(os.listdir(directory))
-        
-        # Check for new files
-        new_files = current_files - self.seen_files
-        
-        if new_files:
-            for file in new_files:
-                print(f"New file detected: {file}")
-            # Update the set of seen files
-            self.seen_files.update(new_files)
-            
-            # Reorganize data and update displays
-            self.organizer.organizeData()
-
-            self.ith_event = 0
-            self.timer = QTimer(self)
-            self.timer.timeout.connect(self.hit_display)
-            self.timer.start(1000)  # Call hit_display every 1000 milliseconds (1 second)
-
-            self.invariant_mass_display()
-            self.vertex_per_spill()
+        self.ith_event = 0
+        self.seek_slider.setRange(0, max(len(organizer.selectedRows) - 1, 0))
+        if self.playing:
+            self.timer.start(1000 // self.rate_box.value())  # Call hit_display at the playback rate
+
+        # Add the new file's events to the accumulated histograms, O(new events)
+        z_vtx = organizer.reco['z_vtx']
+        if self.histograms.add_file(organizer.raw_file, organizer.rid,
+                                    {'mass': organizer.grab_mass(), 'vtx': z_vtx[:, 0], 'vty': z_vtx[:, 1], 'vtz': z_vtx[:, 2]}):
+            mass_binning = self.histograms.binning['mass']
+            self.fit_worker.submit(mass_binning.edges, mass_binning.count(organizer.grab_mass()),
+                                   label=os.path.basename(organizer.raw_file))
+        self.current_run = int(organizer.rid[-1])
+        self.redraw_histograms()
+
+    def redraw_histograms(self):
+        events = int(self.histograms.counts('mass', 'total').sum())
+        self.timed_redraw("invariant mass", self.invariant_mass_display, events)
+        self.timed_redraw("vertex per spill", self.vertex_per_spill, events)
+
+    def histogram(self, name):
+        # Bin edges and counts of one quantity in the selected view
+        counts = self.histograms.counts(name, self.histogram_view.currentData(), self.current_run)
+        return self.histograms.binning[name].edges, counts
+
+    def timed_redraw(self, name, redraw, events):
+        with QTracker.timer.stage("redraw " + name, events):
+            redraw()
+
+    def timed_frame(self, name, redraw):
+        # Like timed_redraw for redraws that run up to once per display frame
+        start = time.perf_counter()
+        redraw()
+        totals = self.frame_totals.setdefault(name, [0, 0.0])
+        totals[0] += 1
+        totals[1] += time.perf_counter() - start
+
+    def flush_frames(self):
+        # One stage timer entry per redraw for the frames of the last second
+        for name, (frames, seconds) in self.frame_totals.items():
+            QTracker.timer.add("redraw " + name, seconds, frames, calls=frames)
+        self.frame_totals = {}
+
+    def check_new_files(self):
+        # Queue raw files that finished writing and start on them if the worker is idle
+        self.ingestion.poll()
+        self.start_reconstruction()
 
     def hit_display(self):
-        elementid, detectorid, selectedEvents, sid, hits, eventID, track = self.organizer.grab_HitInfo()
-        if self.ith_event >= len(selectedEvents):
-            self.timer.stop() 
+        # Rows of the selected events in the file's event index, looked up once per file
+        index, selectedRows = self.organizer.grab_EventIndex()
+        if self.ith_event >= len(selectedRows):
+            # End of the file: pause on the last event
+            if self.playing:
+                self.toggle_playback()
+            self.ith_event = len(selectedRows)
             return
-        
-        hitmatrices = HitDisplay()
-        scatter_raw = hitmatrices.Raw_Hit(elementid, detectorid, selectedEvents, sid, eventID, self.ith_event)
-        scatter_cluster = hitmatrices.Cluster_Hit(hits, selectedEvents, sid, eventID, self.ith_event)
-        scatter_mup, scatter_mum = hitmatrices.Track_Hits(selectedEvents, sid, eventID, track, self.ith_event)
-        
-        # Clear the plot widget before drawing new data
-        self.plot_widget_1.clear()
-        # Add the scatter plot items to the plot widget
-        self.plot_widget_1.addItem(scatter_raw)
-        self.plot_widget_1.addItem(scatter_cluster)
-        self.plot_widget_1.addItem(scatter_mup)
-        self.plot_widget_1.addItem(scatter_mum)
-
-        # Set the y-axis limit to 0, 201
-        self.plot_widget_1.setYRange(0, 201)
-        #print("Hit Display plotted")
+        row = selectedRows[self.ith_event]
+
+        # Only the data of the persistent items changes; the next events are prepared in the background
+        self.hit_view.draw(index, row, selectedRows[self.ith_event + 1:])
+        self.seek_slider.blockSignals(True)
+        self.seek_slider.setValue(self.ith_event)
+        self.seek_slider.blockSignals(False)
+        self.event_label.setText(f"event {self.ith_event + 1} / {len(selectedRows)}")
 
         # Advance the event index
         self.ith_event += 1
 
-    def invariant_mass_display(self):
-        mom = self.organizer.grab_mom()
-        invar_mass = []
-        mass = calc.calcVariables(mom)[0]
-
+    def mass_plot_decorations(self):
         jpsi_mass = 3.0969  # J/psi mass in GeV
         psiprime_mass = 3.6861  # Psi prime mass in GeV
 
-        def gaussian(x, amplitude, mean, stddev):
-            return amplitude * np.exp(-((x - mean) / stddev) ** 2 / 2)
-        # Create a histogram item
-        histogram_item = pg.PlotDataItem()
-
-        # Generate the histogram
-        hist, bin_edges = np.histogram(mass, bins=np.linspace(0, 10.0, 101))
-
-        bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
-        fit_range = (bin_centers < 3.3)
-        initial_guess = [max(hist), jpsi_mass, 0.1]
-
-        x_fit_data = bin_centers[fit_range]
-        y_fit_data = hist[fit_range]
-
-        params, covariance = curve_fit(gaussian, x_fit_data, y_fit_data, p0=initial_guess)
-        mean_fit, width_fit = params[1], abs(params[2])
-        print(f"Mean of the Gaussian fit: {mean_fit:.3f} GeV")
-        print(f"Width (sigma) of the Gaussian fit: {width_fit:.3f} GeV")
-
-        # Plot the histogram
-        histogram_item.setData(x=bin_edges, y=hist, stepMode="center", fillLevel=0, brush='b')
-
-        # Clear the plot widget before drawing new data
-        self.plot_widget_2.clear()
-
         # Set labels and title
         self.plot_widget_2.setLabel('left', 'Frequency')
-        self.plot_widget_2.setLabel('bottom', 'Value')
         self.plot_widget_2.setTitle('Histogram Example')
 
-        # Add the histogram item to the plot widget
-        self.plot_widget_2.addItem(histogram_item)
-
         # Add vertical lines for jpsi_mass and psiprime_mass
         jpsi_line = pg.InfiniteLine(pos=jpsi_mass, angle=90, pen=pg.mkPen('r', style=pg.QtCore.Qt.DashLine))
         psiprime_line = pg.InfiniteLine(pos=psiprime_mass, angle=90, pen=pg.mkPen('g', style=pg.QtCore.Qt.DashLine))
@@ -194,31 +329,46 @@ class MainWindow(QMainWindow):
 
         self.plot_widget_2.addItem(jpsi_label)
         self.plot_widget_2.addItem(psiprime_label)
+
+    def invariant_mass_display(self):
+        # The accumulated histogram, the masses are stored with each reconstructed output
+        bin_edges, hist = self.histogram('mass')
+
+        # Only the data of the existing histogram item changes; the fit curve follows when the worker is done
+        self.histogram_items['mass'].setData(x=bin_edges, y=hist)
+        self.fit_worker.submit(bin_edges, hist)
         print("=========PLOTTED MASS============")
 
+    def mass_fit_finished(self, result):
+        if result['label'] is not None:
+            self.draw_drift()
+            return
+        if not result['converged']:
+            self.fit_item.setData(x=np.zeros(0), y=np.zeros(0))
+            self.statusBar().showMessage(f"J/psi fit failed: {result['message']}")
+            return
+        self.fit_item.setData(*model_curve(result))
+        values, errors = result['values'], result['errors']
+        print(f"Mean of the J/psi fit: {values['mean']:.4f} +- {errors['mean']:.4f} GeV")
+        print(f"Width (sigma) of the J/psi fit: {values['sigma']:.4f} +- {errors['sigma']:.4f} GeV")
+        self.statusBar().showMessage(f"J/psi mean {values['mean']:.4f} +- {errors['mean']:.4f} GeV, "
+                                     f"width {values['sigma']:.4f} +- {errors['sigma']:.4f} GeV, "
+                                     f"{values['n_jpsi']:.0f} +- {errors['n_jpsi']:.0f} J/psi")
+
+    def draw_drift(self):
+        # Fitted J/psi mean and width of every file, oldest first
+        history = list(self.fit_worker.fitter.history)
+        x = np.arange(len(history), dtype=float)
+        for name, (points, errors) in self.drift_items.items():
+            y = np.array([entry[name] for entry in history], dtype=float)
+            error = np.array([entry[name + '_error'] for entry in history], dtype=float)
+            points.setData(x=x, y=y)
+            errors.setData(x=x, y=y, height=2 * error)
+
     def vertex_per_spill(self):
-        vtx, vty, vtz, sid, EventID = self.organizer.grab_Vertex()
-       # Create histogram items for vtx, vty, vtz
-        hist_vtx = pg.PlotDataItem()
-        hist_vty = pg.PlotDataItem()
-        hist_vtz = pg.PlotDataItem()
-
-        hist_vtx_data, bin_edges_vtx = np.histogram(vtx, bins=50)
-        hist_vty_data, bin_edges_vty = np.histogram(vty, bins=50)
-        hist_vtz_data, bin_edges_vtz = np.histogram(vtz, bins=50)
-
-        hist_vtx.setData(x=bin_edges_vtx, y=hist_vtx_data, stepMode="center", fillLevel=0, brush='r')
-        hist_vty.setData(x=bin_edges_vty, y=hist_vty_data, stepMode="center", fillLevel=0, brush='g')
-        hist_vtz.setData(x=bin_edges_vtz, y=hist_vtz_data, stepMode="center", fillLevel=0, brush='b')
-
-        # Clear the plot widget before drawing new data
-        self.plot_widget_vtx.clear()
-        self.plot_widget_vty.clear()
-        self.plot_widget_vtz.clear()
-        # Add histograms to the plot widgets
-        self.plot_widget_vtx.addItem(hist_vtx)
-        self.plot_widget_vty.addItem(hist_vty)
-        self.plot_widget_vtz.addItem(hist_vtz)
+        for name in ('vtx', 'vty', 'vtz'):
+            bin_edges, counts = self.histogram(name)
+            self.histogram_items[name].setData(x=bin_edges, y=counts)
 
         print("=========PLOTTED vtx============")
 
@@ -0,0 +1,37 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Instrumentation import SamplingProfiler, StageTimer
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < end:
+        total += 1
+    return total
+
+
+def test_sampling_profiler_collects_samples():
+    profiler = SamplingProfiler(interval=0.002)
+    profiler.start()
+    try:
+        busy(0.2)
+        assert profiler.thread.is_alive()
+    finally:
+        profiler.stop()
+    assert profiler.samples > 0
+    assert any('busy' in where for where in profiler.inclusive)
+
+
+def test_stage_records_memory_of_the_stage():
+    timer = StageTimer()
+    with timer.stage('quick', 3):
+        pass
+    entry = timer.stats['quick']
+    assert entry['calls'] == 1 and entry['events'] == 3
+    if entry['peak_rss_mb'] is not None:
+        assert entry['rss_increase_mb'] >= 0